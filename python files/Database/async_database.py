@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from ..data_models.data_models import PatientInput, Prescription, DoctorFeedback
+from .database_manager import MedicalDatabase, TrainingRecord
+from .write_behind import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMedicalDatabase:
+    """Awaitable facade over MedicalDatabase for use from the asyncio server"""
+
+    def __init__(self, database: MedicalDatabase, read_workers: int = 2, max_pending_writes: int = 1000,
+                 write_behind: bool = False, buffer_max_rows: int = 500, buffer_max_delay_ms: float = 50.0):
+        self.database = database
+        # Write-behind mode batches patient/prescription/feedback rows into group commits
+        self.buffer = WriteBehindBuffer(database, buffer_max_rows, buffer_max_delay_ms) if write_behind else None
+        # SQLite allows one writer at a time, so all writes go through a single thread in order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="db-reader")
+        self._write_slots = asyncio.Semaphore(max_pending_writes)
+        self._background = set()
+        self.failed_background_writes = 0
+
+    async def _write(self, fn, *args):
+        async with self._write_slots:
+            return await asyncio.get_running_loop().run_in_executor(self._writer, fn, *args)
+
+    async def _read(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._readers, fn, *args)
+
+    async def save_patient_input(self, patient_input: PatientInput) -> int:
+        if self.buffer is not None:
+            return await asyncio.wrap_future(self.buffer.add_patient_input(patient_input).future)
+        return await self._write(self.database.save_patient_input, patient_input)
+
+    async def save_prescription(self, prescription: Prescription, patient_input_id: int) -> int:
+        if self.buffer is not None:
+            return await asyncio.wrap_future(self.buffer.add_prescription(prescription, patient_input_id).future)
+        return await self._write(self.database.save_prescription, prescription, patient_input_id)
+
+    async def save_doctor_feedback(self, feedback: DoctorFeedback, prescription_id: int) -> int:
+        if self.buffer is not None:
+            return await asyncio.wrap_future(self.buffer.add_feedback(feedback, prescription_id).future)
+        return await self._write(self.database.save_doctor_feedback, feedback, prescription_id)
+
+    async def save_model_version(self, version: str, training_data_count: int, feedback_count: int):
+        return await self._write(self.database.save_model_version, version, training_data_count, feedback_count)
+
+    async def save_prescription_record(self, patient_input: PatientInput, prescription: Prescription) -> Tuple[int, int]:
+        """Save a patient input and its prescription, linked by patient_input_id"""
+        if self.buffer is not None:
+            patient_row = self.buffer.add_patient_input(patient_input)
+            prescription_row = self.buffer.add_prescription(prescription, patient_row)
+            prescription_id = await asyncio.wrap_future(prescription_row.future)
+            return patient_row.id, prescription_id
+        
+        def _save():
+            patient_id = self.database.save_patient_input(patient_input)
+            return patient_id, self.database.save_prescription(prescription, patient_id)
+        return await self._write(_save)
+
+    async def get_patient_input(self, patient_id: int) -> Optional[PatientInput]:
+        return await self._read(self.database.get_patient_input, patient_id)
+
+    async def get_prescription(self, prescription_id: int) -> Optional[Prescription]:
+        return await self._read(self.database.get_prescription, prescription_id)
+
+    async def find_prescriptions_by_medication(self, medication: str, limit: int = 100) -> Dict[int, Prescription]:
+        return await self._read(self.database.find_prescriptions_by_medication, medication, limit)
+
+    async def get_feedback_for_training(self, limit: int = 100) -> List[Dict]:
+        return await self._read(self.database.get_feedback_for_training, limit)
+
+    async def iter_feedback_for_training(self, chunk_size: int = 1000,
+                                         after: Optional[int] = None) -> AsyncIterator[TrainingRecord]:
+        """Async counterpart of MedicalDatabase.iter_feedback_for_training; each page is read off the loop"""
+        while True:
+            page = await self._read(self.database.get_feedback_page, after, chunk_size)
+            for record in page:
+                yield record
+            if len(page) < chunk_size:
+                return
+            after = page[-1].key
+
+    async def get_model_stats(self) -> Dict:
+        return await self._read(self.database.get_model_stats)
+
+    def persist_in_background(self, coro) -> asyncio.Task:
+        """Run a save coroutine without making the caller wait for it"""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+        return task
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.failed_background_writes += 1
+            logger.error(f"Background database write failed: {task.exception()}")
+
+    def get_stats(self) -> Dict:
+        stats = {
+            'pending_background_writes': len(self._background),
+            'failed_background_writes': self.failed_background_writes
+        }
+        if self.buffer is not None:
+            stats['write_behind'] = self.buffer.get_stats()
+        return stats
+
+    async def close(self):
+        """Wait for pending writes, then stop the threads and close the database"""
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self.buffer is not None:
+            # Flush on shutdown; blocking, so keep it off the event loop
+            await asyncio.get_running_loop().run_in_executor(self._writer, self.buffer.close)
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.database.close()
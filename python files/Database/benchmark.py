@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict
+
+from .database_manager import MedicalDatabase
+
+logger = logging.getLogger(__name__)
+
+SYMPTOMS = ["fever", "cough", "headache", "fatigue", "back pain", "nausea", "chest pain", "dizziness"]
+DIAGNOSES = ["hypertension", "diabetes", "asthma", "migraine", "influenza", "arthritis"]
+MEDICATIONS = ["Ibuprofen", "Metformin", "Lisinopril", "Albuterol", "Paracetamol", "Amoxicillin"]
+
+
+def seed_database(db_path: str, rows: int, feedback_ratio: float = 0.1, chunk_size: int = 50000, seed: int = 0):
+    """Fill the original (unmigrated) schema with `rows` patient inputs and prescriptions"""
+    MedicalDatabase(db_path, pooled=False, migrate=False)
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    feedback_every = max(1, round(1 / feedback_ratio)) if feedback_ratio > 0 else 0
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    try:
+        for chunk_start in range(1, rows + 1, chunk_size):
+            ids = range(chunk_start, min(chunk_start + chunk_size, rows + 1))
+            patients, prescriptions, feedback = [], [], []
+            for i in ids:
+                timestamp = (start + timedelta(seconds=i)).isoformat()
+                medications = json.dumps(rng.sample(MEDICATIONS, 2))
+                patients.append((i, ", ".join(rng.sample(SYMPTOMS, 2)), rng.randint(1, 90),
+                                 rng.choice(["male", "female"]), rng.choice(DIAGNOSES), timestamp))
+                prescriptions.append((i, i, medications, 0.85, "1.0", timestamp))
+                if feedback_every and i % feedback_every == 0:
+                    feedback.append((i, medications, json.dumps(rng.sample(MEDICATIONS, 3)), "", "dr_bench",
+                                     timestamp))
+            conn.executemany('INSERT INTO patient_inputs (id, symptoms, age, gender, diagnosis, timestamp) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', patients)
+            conn.executemany('INSERT INTO prescriptions (id, patient_input_id, medications, confidence, '
+                             'model_version, timestamp) VALUES (?, ?, ?, ?, ?, ?)', prescriptions)
+            conn.executemany('INSERT INTO doctor_feedback (prescription_id, original_prescription, '
+                             'modified_prescription, feedback_notes, doctor_id, timestamp) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', feedback)
+            conn.commit()
+            logger.info(f"Seeded {ids[-1]}/{rows} rows")
+        conn.executemany('INSERT INTO model_versions (version, training_data_count, feedback_incorporated, '
+                         'created_at) VALUES (?, ?, ?, ?)',
+                         [(f"1.{n}", n * 100, n * 10, (start + timedelta(days=n)).isoformat())
+                          for n in range(1000)])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def time_query(fn: Callable, repeats: int = 5) -> Dict:
+    """Median and max wall time of fn() in milliseconds"""
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return {'median_ms': round(statistics.median(timings), 2), 'max_ms': round(max(timings), 2)}
+
+
+def measure(db: MedicalDatabase, repeats: int) -> Dict:
+    return {
+        'get_model_stats': time_query(db.get_model_stats, repeats),
+        'get_feedback_for_training': time_query(lambda: db.get_feedback_for_training(100), repeats)
+    }
+
+
+def run_benchmark(db_path: str, rows: int, feedback_ratio: float = 0.1, repeats: int = 5,
+                  reseed: bool = False) -> Dict:
+    """Seed, time the queries on the original schema, migrate, and time them again"""
+    if reseed or not os.path.exists(db_path):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        started = time.perf_counter()
+        seed_database(db_path, rows, feedback_ratio)
+        logger.info(f"Seeding took {time.perf_counter() - started:.1f}s")
+    else:
+        conn = sqlite3.connect(db_path)
+        if conn.execute('PRAGMA user_version').fetchone()[0] > 0:
+            logger.warning(f"{db_path} is already migrated; 'before' timings will include the indexes "
+                           f"(use --reseed for a clean baseline)")
+        conn.close()
+
+    before_db = MedicalDatabase(db_path, migrate=False)
+    before = measure(before_db, repeats)
+    before_db.close()
+
+    started = time.perf_counter()
+    after_db = MedicalDatabase(db_path)
+    migration_ms = (time.perf_counter() - started) * 1000.0
+    after = measure(after_db, repeats)
+    stats = after_db.get_model_stats()
+    after_db.close()
+
+    return {
+        'rows': rows,
+        'feedback_ratio': feedback_ratio,
+        'stats': stats,
+        'migration_ms': round(migration_ms, 1),
+        'before': before,
+        'after': after
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Benchmark get_model_stats/get_feedback_for_training "
+                                                 "before and after the index and counter migration")
+    parser.add_argument("--db-path", default="benchmark_medical.db")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Patient inputs/prescriptions to seed")
+    parser.add_argument("--feedback-ratio", type=float, default=0.1)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--reseed", action="store_true", help="Recreate the database even if it exists")
+    parser.add_argument("--output", default="", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.db_path, args.rows, args.feedback_ratio, args.repeats, args.reseed)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -7,99 +7,457 @@ from ..data_models.data_models import PatientInput, Prescription, DoctorFeedback
 import sqlite3
 import json
 import logging
-from typing import List, Dict, Optional
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Dict, Optional, Tuple
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Tables whose row counts are maintained by triggers in table_counts
+COUNTED_TABLES = ('patient_inputs', 'prescriptions', 'doctor_feedback')
 
 
+def _counter_triggers(table: str) -> List[str]:
+    return [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_count_insert AFTER INSERT ON {table}
+        BEGIN
+            UPDATE table_counts SET row_count = row_count + 1 WHERE name = '{table}';
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_count_delete AFTER DELETE ON {table}
+        BEGIN
+            UPDATE table_counts SET row_count = row_count - 1 WHERE name = '{table}';
+        END
+        '''
+    ]
+
+
+def medication_key(name: str) -> str:
+    """Case- and whitespace-insensitive dictionary key for a medication name"""
+    return name.strip().lower()
+
+
+def _json_array(column: str) -> str:
+    """SQL for a JSON column that json_each can read: the column if it holds an array, else '[]'"""
+    # Nested CASE because SQLite does not guarantee AND short-circuits, and json_type() raises on malformed JSON
+    return f"COALESCE(CASE WHEN json_valid({column}) THEN CASE WHEN json_type({column}) = 'array' THEN {column} END END, '[]')"
+
+
+def _backfill_links(link_table: str, id_column: str, source: str, json_column: str,
+                    extra_columns: str = '', extra_values: str = '') -> str:
+    return f'''
+        INSERT OR IGNORE INTO {link_table} ({id_column}, {extra_columns}position, medication_id, spelling)
+        SELECT s.id, {extra_values}j.key, m.id, NULLIF(j.value, m.name)
+        FROM {source} s, json_each({_json_array('s.' + json_column)}) j
+        JOIN medications m ON m.name_key = medication_key(j.value)
+        WHERE j.type = 'text'
+    '''
+
+
+def _backfill_dictionary(source: str, json_column: str) -> str:
+    # First spelling seen (oldest row) becomes the dictionary name
+    return f'''
+        INSERT OR IGNORE INTO medications (name, name_key)
+        SELECT j.value, medication_key(j.value)
+        FROM {source} s, json_each({_json_array('s.' + json_column)}) j
+        WHERE j.type = 'text'
+        ORDER BY s.id, j.key
+    '''
+
+
+# Schema migrations, applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    # 1: indexes on foreign keys and timestamps, trigger-maintained row counts
+    [
+        'CREATE INDEX IF NOT EXISTS idx_prescriptions_patient_input_id ON prescriptions (patient_input_id)',
+        'CREATE INDEX IF NOT EXISTS idx_doctor_feedback_prescription_id ON doctor_feedback (prescription_id)',
+        'CREATE INDEX IF NOT EXISTS idx_doctor_feedback_timestamp ON doctor_feedback (timestamp, id)',
+        'CREATE INDEX IF NOT EXISTS idx_prescriptions_timestamp ON prescriptions (timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_patient_inputs_timestamp ON patient_inputs (timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_model_versions_created_at ON model_versions (created_at)',
+        '''
+        CREATE TABLE IF NOT EXISTS table_counts (
+            name TEXT PRIMARY KEY,
+            row_count INTEGER NOT NULL
+        )
+        ''',
+        # Backfill once from the existing rows; the triggers keep it current from here on
+        *[f"INSERT OR REPLACE INTO table_counts (name, row_count) SELECT '{table}', COUNT(*) FROM {table}"
+          for table in COUNTED_TABLES],
+        *[sql for table in COUNTED_TABLES for sql in _counter_triggers(table)]
+    ],
+    # 2: medication dictionary and prescription/feedback<->medication link tables, backfilled from
+    # the JSON columns (rows whose JSON is malformed or not an array are left unlinked)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS medications (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            name_key TEXT NOT NULL UNIQUE
+        )
+        ''',
+        # spelling is NULL unless the row spelled the name differently from the dictionary entry
+        '''
+        CREATE TABLE IF NOT EXISTS prescription_medications (
+            prescription_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            medication_id INTEGER NOT NULL,
+            spelling TEXT,
+            PRIMARY KEY (prescription_id, position),
+            FOREIGN KEY (prescription_id) REFERENCES prescriptions (id),
+            FOREIGN KEY (medication_id) REFERENCES medications (id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_prescription_medications_medication_id '
+        'ON prescription_medications (medication_id, prescription_id)',
+        # modified: 0 for the original prescription, 1 for the doctor's modified one
+        '''
+        CREATE TABLE IF NOT EXISTS feedback_medications (
+            feedback_id INTEGER NOT NULL,
+            modified INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            medication_id INTEGER NOT NULL,
+            spelling TEXT,
+            PRIMARY KEY (feedback_id, modified, position),
+            FOREIGN KEY (feedback_id) REFERENCES doctor_feedback (id),
+            FOREIGN KEY (medication_id) REFERENCES medications (id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_feedback_medications_medication_id '
+        'ON feedback_medications (medication_id, feedback_id)',
+        _backfill_dictionary('prescriptions', 'medications'),
+        _backfill_dictionary('doctor_feedback', 'original_prescription'),
+        _backfill_dictionary('doctor_feedback', 'modified_prescription'),
+        _backfill_links('prescription_medications', 'prescription_id', 'prescriptions', 'medications'),
+        _backfill_links('feedback_medications', 'feedback_id', 'doctor_feedback', 'original_prescription',
+                        'modified, ', '0, '),
+        _backfill_links('feedback_medications', 'feedback_id', 'doctor_feedback', 'modified_prescription',
+                        'modified, ', '1, ')
+    ]
+]
+
+
+def _medication_ids(cursor: sqlite3.Cursor, names: List[str]) -> Dict[str, Tuple[int, Optional[str]]]:
+    """Dictionary id for each name (adding missing entries), plus the spelling to store when it
+    differs from the dictionary name"""
+    keys = {}
+    for name in names:
+        keys.setdefault(medication_key(name), name)
+    if not keys:
+        return {}
+    cursor.executemany('INSERT OR IGNORE INTO medications (name, name_key) VALUES (?, ?)',
+                       [(name, key) for key, name in keys.items()])
+    entries = {}
+    key_list = list(keys)
+    # Chunked to stay under SQLite's bound-parameter limit
+    for start in range(0, len(key_list), 500):
+        chunk = key_list[start:start + 500]
+        cursor.execute(f'SELECT name_key, id, name FROM medications WHERE name_key IN ({",".join("?" * len(chunk))})',
+                       chunk)
+        entries.update((key, (medication_id, name)) for key, medication_id, name in cursor.fetchall())
+    ids = {}
+    for name in names:
+        medication_id, dictionary_name = entries[medication_key(name)]
+        ids[name] = (medication_id, None if name == dictionary_name else name)
+    return ids
+
+
+def link_prescription_medications(cursor: sqlite3.Cursor, prescriptions: List[Tuple[int, List[str]]]):
+    """Add medication dictionary entries and link rows for (prescription_id, medications) pairs"""
+    ids = _medication_ids(cursor, list({name for _, medications in prescriptions for name in medications}))
+    cursor.executemany('''
+        INSERT INTO prescription_medications (prescription_id, position, medication_id, spelling)
+        VALUES (?, ?, ?, ?)
+    ''', [(prescription_id, position, *ids[name])
+          for prescription_id, medications in prescriptions
+          for position, name in enumerate(medications)])
+
+
+def link_feedback_medications(cursor: sqlite3.Cursor, feedback: List[Tuple[int, List[str], List[str]]]):
+    """Add medication dictionary entries and link rows for (feedback_id, original, modified) triples"""
+    ids = _medication_ids(cursor, list({name for _, original, modified in feedback
+                                        for name in (*original, *modified)}))
+    cursor.executemany('''
+        INSERT INTO feedback_medications (feedback_id, modified, position, medication_id, spelling)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(feedback_id, modified, position, *ids[name])
+          for feedback_id, original, modified_list in feedback
+          for modified, medications in ((0, original), (1, modified_list))
+          for position, name in enumerate(medications)])
+
+
+class TrainingRecord:
+    """One feedback row for training; prescription lists are decoded from JSON on first access"""
+    
+    __slots__ = ('symptoms', 'age', 'gender', 'diagnosis', 'feedback_notes', 'timestamp', 'id',
+                 '_original_json', '_modified_json', '_original', '_modified')
+    
+    def __init__(self, symptoms: str, age: int, gender: str, diagnosis: str, original_prescription: str,
+                 modified_prescription: str, feedback_notes: str, timestamp: str, id: int):
+        self.symptoms = symptoms
+        self.age = age
+        self.gender = gender
+        self.diagnosis = diagnosis
+        self.feedback_notes = feedback_notes
+        self.timestamp = timestamp
+        self.id = id
+        self._original_json = original_prescription
+        self._modified_json = modified_prescription
+        self._original = None
+        self._modified = None
+    
+    @property
+    def original_prescription(self) -> List[str]:
+        if self._original is None:
+            self._original = json.loads(self._original_json)
+        return self._original
+    
+    @property
+    def modified_prescription(self) -> List[str]:
+        if self._modified is None:
+            self._modified = json.loads(self._modified_json)
+        return self._modified
+    
+    @property
+    def key(self) -> int:
+        """Keyset pagination cursor: the next page starts after this id"""
+        return self.id
+    
+    def to_dict(self, decode: bool = True) -> Dict:
+        """Same fields as get_feedback_for_training; decode=False keeps the raw JSON strings"""
+        return {
+            'symptoms': self.symptoms,
+            'age': self.age,
+            'gender': self.gender,
+            'diagnosis': self.diagnosis,
+            'original_prescription': self.original_prescription if decode else self._original_json,
+            'modified_prescription': self.modified_prescription if decode else self._modified_json,
+            'feedback_notes': self.feedback_notes
+        }
+
+
+class SQLiteConnectionPool:
+    """Thread-safe pool of persistent SQLite connections tuned for many small queries"""
+    
+    def __init__(self, db_path: str, pool_size: int = 4, cache_size_kb: int = 16384,
+                 mmap_size: int = 256 * 1024 * 1024, timeout: float = 30.0):
+        self.db_path = db_path
+        self.pool_size = max(1, pool_size)
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+    
+    def _create_connection(self) -> sqlite3.Connection:
+        # check_same_thread=False: a connection is only ever used by one thread at a time,
+        # but the event loop thread and executor threads take turns with it
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+    
+    def acquire(self) -> sqlite3.Connection:
+        """Take an idle connection, opening a new one while under pool_size"""
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                try:
+                    return self._create_connection()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get(timeout=self.timeout)
+    
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool (or close it if the pool was closed)"""
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+    
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+    
+    def close(self):
+        """Close every idle connection; busy ones are closed when released"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+        logger.info("Database connection pool closed")
 
 
 class MedicalDatabase:
     """Database manager for medical MCP system"""
     
-    def __init__(self, db_path: str = "medical_mcp.db"):
+    def __init__(self, db_path: str = "medical_mcp.db", pooled: bool = True, pool_size: int = 4,
+                 cache_size_kb: int = 16384, mmap_size: int = 256 * 1024 * 1024, migrate: bool = True):
         self.db_path = db_path
+        # migrate=False leaves the schema as originally created (used by the benchmark baseline)
+        self.migrate = migrate
+        # Pooled mode keeps connections open (WAL, synchronous=NORMAL) instead of
+        # reconnecting for every statement
+        self.pool = SQLiteConnectionPool(db_path, pool_size, cache_size_kb, mmap_size) if pooled else None
         self.init_database()
     
+    @contextmanager
+    def connection(self):
+        """Connection for one operation: borrowed from the pool, or opened and closed"""
+        if self.pool is not None:
+            with self.pool.connection() as conn:
+                yield conn
+        else:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                yield conn
+            finally:
+                conn.close()
+    
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Cursor inside a write transaction: committed on exit, rolled back on error
+
+        BEGIN IMMEDIATE takes the write lock up front, so ids read inside the
+        transaction cannot be taken by another writer before the commit.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+    
     def init_database(self):
         """Initialize SQLite database with required tables"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Patient inputs table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS patient_inputs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    symptoms TEXT NOT NULL,
-                    age INTEGER NOT NULL,
-                    gender TEXT NOT NULL,
-                    diagnosis TEXT NOT NULL,
-                    timestamp TEXT NOT NULL
-                )
-            ''')
-            
-            # Prescriptions table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS prescriptions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_input_id INTEGER,
-                    medications TEXT NOT NULL,
-                    confidence REAL NOT NULL,
-                    model_version TEXT NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    FOREIGN KEY (patient_input_id) REFERENCES patient_inputs (id)
-                )
-            ''')
-            
-            # Doctor feedback table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS doctor_feedback (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    prescription_id INTEGER,
-                    original_prescription TEXT NOT NULL,
-                    modified_prescription TEXT NOT NULL,
-                    feedback_notes TEXT,
-                    doctor_id TEXT NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    FOREIGN KEY (prescription_id) REFERENCES prescriptions (id)
-                )
-            ''')
-            
-            # Model versions table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS model_versions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    version TEXT NOT NULL,
-                    training_data_count INTEGER,
-                    feedback_incorporated INTEGER,
-                    created_at TEXT NOT NULL
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                
+                # Patient inputs table
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS patient_inputs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        symptoms TEXT NOT NULL,
+                        age INTEGER NOT NULL,
+                        gender TEXT NOT NULL,
+                        diagnosis TEXT NOT NULL,
+                        timestamp TEXT NOT NULL
+                    )
+                ''')
+                
+                # Prescriptions table
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS prescriptions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        patient_input_id INTEGER,
+                        medications TEXT NOT NULL,
+                        confidence REAL NOT NULL,
+                        model_version TEXT NOT NULL,
+                        timestamp TEXT NOT NULL,
+                        FOREIGN KEY (patient_input_id) REFERENCES patient_inputs (id)
+                    )
+                ''')
+                
+                # Doctor feedback table
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS doctor_feedback (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        prescription_id INTEGER,
+                        original_prescription TEXT NOT NULL,
+                        modified_prescription TEXT NOT NULL,
+                        feedback_notes TEXT,
+                        doctor_id TEXT NOT NULL,
+                        timestamp TEXT NOT NULL,
+                        FOREIGN KEY (prescription_id) REFERENCES prescriptions (id)
+                    )
+                ''')
+                
+                # Model versions table
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS model_versions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        version TEXT NOT NULL,
+                        training_data_count INTEGER,
+                        feedback_incorporated INTEGER,
+                        created_at TEXT NOT NULL
+                    )
+                ''')
+                
+                conn.commit()
+            if self.migrate:
+                self.apply_migrations()
             logger.info("Database initialized successfully")
             
         except Exception as e:
             logger.error(f"Error initializing database: {e}")
             raise
 
+    def apply_migrations(self) -> int:
+        """Run pending schema migrations and return the resulting schema version"""
+        with self.connection() as conn:
+            # Used by the backfill statements so SQL and Python agree on dictionary keys
+            conn.create_function('medication_key', 1, medication_key, deterministic=True)
+            cursor = conn.cursor()
+            version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    for sql in statements:
+                        cursor.execute(sql)
+                    cursor.execute(f'PRAGMA user_version = {number}')
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                logger.info(f"Applied database migration {number}")
+                version = number
+        return version
+
     def save_patient_input(self, patient_input: PatientInput) -> int:
         """Save patient input and return patient ID"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO patient_inputs (symptoms, age, gender, diagnosis, timestamp)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (patient_input.symptoms, patient_input.age, patient_input.gender, 
-                  patient_input.diagnosis, patient_input.timestamp))
-            patient_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO patient_inputs (symptoms, age, gender, diagnosis, timestamp)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (patient_input.symptoms, patient_input.age, patient_input.gender, 
+                      patient_input.diagnosis, patient_input.timestamp))
+                patient_id = cursor.lastrowid
+                conn.commit()
             logger.info(f"Patient input saved with ID: {patient_id}")
             return patient_id
         except Exception as e:
@@ -109,16 +467,17 @@ class MedicalDatabase:
     def save_prescription(self, prescription: Prescription, patient_input_id: int) -> int:
         """Save prescription and return prescription ID"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO prescriptions (patient_input_id, medications, confidence, model_version, timestamp)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (patient_input_id, json.dumps(prescription.medications), 
-                  prescription.confidence, prescription.model_version, prescription.timestamp))
-            prescription_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO prescriptions (patient_input_id, medications, confidence, model_version, timestamp)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (patient_input_id, json.dumps(prescription.medications), 
+                      prescription.confidence, prescription.model_version, prescription.timestamp))
+                prescription_id = cursor.lastrowid
+                if self.migrate:
+                    link_prescription_medications(cursor, [(prescription_id, prescription.medications)])
+                conn.commit()
             logger.info(f"Prescription saved with ID: {prescription_id}")
             return prescription_id
         except Exception as e:
@@ -128,18 +487,20 @@ class MedicalDatabase:
     def save_doctor_feedback(self, feedback: DoctorFeedback, prescription_id: int) -> int:
         """Save doctor feedback and return feedback ID"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO doctor_feedback (prescription_id, original_prescription, 
-                                           modified_prescription, feedback_notes, doctor_id, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (prescription_id, json.dumps(feedback.original_prescription),
-                  json.dumps(feedback.modified_prescription), feedback.feedback_notes,
-                  feedback.doctor_id, feedback.timestamp))
-            feedback_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO doctor_feedback (prescription_id, original_prescription, 
+                                               modified_prescription, feedback_notes, doctor_id, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (prescription_id, json.dumps(feedback.original_prescription),
+                      json.dumps(feedback.modified_prescription), feedback.feedback_notes,
+                      feedback.doctor_id, feedback.timestamp))
+                feedback_id = cursor.lastrowid
+                if self.migrate:
+                    link_feedback_medications(cursor, [(feedback_id, feedback.original_prescription,
+                                                        feedback.modified_prescription)])
+                conn.commit()
             logger.info(f"Doctor feedback saved with ID: {feedback_id}")
             return feedback_id
         except Exception as e:
@@ -149,11 +510,10 @@ class MedicalDatabase:
     def get_patient_input(self, patient_id: int) -> Optional[PatientInput]:
         """Get patient input by ID"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM patient_inputs WHERE id = ?', (patient_id,))
-            row = cursor.fetchone()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT * FROM patient_inputs WHERE id = ?', (patient_id,))
+                row = cursor.fetchone()
             
             if row:
                 return PatientInput(
@@ -168,14 +528,46 @@ class MedicalDatabase:
             logger.error(f"Error getting patient input: {e}")
             return None
 
+    def _load_prescriptions(self, cursor: sqlite3.Cursor, prescription_ids: List[int]) -> Dict[int, Prescription]:
+        """Build Prescriptions from the link table (no JSON parsing), in the order of prescription_ids"""
+        placeholders = ",".join("?" * len(prescription_ids))
+        cursor.execute(f'''
+            SELECT id, patient_input_id, confidence, model_version, timestamp
+            FROM prescriptions WHERE id IN ({placeholders})
+        ''', prescription_ids)
+        rows = {row[0]: row for row in cursor.fetchall()}
+        
+        medications = {prescription_id: [] for prescription_id in rows}
+        cursor.execute(f'''
+            SELECT pm.prescription_id, COALESCE(pm.spelling, m.name)
+            FROM prescription_medications pm
+            JOIN medications m ON m.id = pm.medication_id
+            WHERE pm.prescription_id IN ({placeholders})
+            ORDER BY pm.prescription_id, pm.position
+        ''', prescription_ids)
+        for prescription_id, name in cursor.fetchall():
+            medications[prescription_id].append(name)
+        
+        return {
+            prescription_id: Prescription(
+                medications=medications[prescription_id],
+                confidence=rows[prescription_id][2],
+                model_version=rows[prescription_id][3],
+                patient_id=str(rows[prescription_id][1]),
+                timestamp=rows[prescription_id][4]
+            )
+            for prescription_id in prescription_ids if prescription_id in rows
+        }
+
     def get_prescription(self, prescription_id: int) -> Optional[Prescription]:
         """Get prescription by ID"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM prescriptions WHERE id = ?', (prescription_id,))
-            row = cursor.fetchone()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                if self.migrate:
+                    return self._load_prescriptions(cursor, [prescription_id]).get(prescription_id)
+                cursor.execute('SELECT * FROM prescriptions WHERE id = ?', (prescription_id,))
+                row = cursor.fetchone()
             
             if row:
                 return Prescription(
@@ -190,55 +582,108 @@ class MedicalDatabase:
             logger.error(f"Error getting prescription: {e}")
             return None
 
+    def find_prescriptions_by_medication(self, medication: str, limit: int = 100) -> Dict[int, Prescription]:
+        """Newest prescriptions containing a medication (case-insensitive), keyed by prescription ID"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                # The dictionary is small; the link rows are found through the medication_id index
+                cursor.execute('''
+                    SELECT DISTINCT pm.prescription_id
+                    FROM medications m
+                    JOIN prescription_medications pm ON pm.medication_id = m.id
+                    WHERE m.name_key = ?
+                    ORDER BY pm.prescription_id DESC
+                    LIMIT ?
+                ''', (medication_key(medication), limit))
+                prescription_ids = [row[0] for row in cursor.fetchall()]
+                if not prescription_ids:
+                    return {}
+                return self._load_prescriptions(cursor, prescription_ids)
+        except Exception as e:
+            logger.error(f"Error finding prescriptions for {medication}: {e}")
+            return {}
+
     def get_feedback_for_training(self, limit: int = 100) -> List[Dict]:
         """Get feedback data for model training"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT pi.symptoms, pi.age, pi.gender, pi.diagnosis,
+                           df.original_prescription, df.modified_prescription, df.feedback_notes
+                    FROM doctor_feedback df
+                    JOIN prescriptions p ON df.prescription_id = p.id
+                    JOIN patient_inputs pi ON p.patient_input_id = pi.id
+                    ORDER BY df.timestamp DESC
+                    LIMIT ?
+                ''', (limit,))
+                
+                columns = [col[0] for col in cursor.description]
+                results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            
+            logger.info(f"Retrieved {len(results)} feedback records for training")
+            return results
+        except Exception as e:
+            logger.error(f"Error getting feedback for training: {e}")
+            return []
+
+    def get_feedback_page(self, after: Optional[int] = None, limit: int = 1000) -> List[TrainingRecord]:
+        """Oldest-first page of training records with ids after the cursor
+
+        The cursor is the id, not the timestamp: a row's timestamp is taken when the request is
+        handled, but write-behind (and the single writer thread) commit it later, so rows do not
+        become visible in timestamp order. Ids are assigned inside the committing write
+        transaction, so a row committed after a page was read always has a larger id than
+        anything on it and is never skipped by a cursor that moved past it.
+        """
+        with self.connection() as conn:
             cursor = conn.cursor()
+            # Keyset pagination on the primary key instead of skipping OFFSET rows
             cursor.execute('''
                 SELECT pi.symptoms, pi.age, pi.gender, pi.diagnosis,
-                       df.original_prescription, df.modified_prescription, df.feedback_notes
+                       df.original_prescription, df.modified_prescription, df.feedback_notes,
+                       df.timestamp, df.id
                 FROM doctor_feedback df
                 JOIN prescriptions p ON df.prescription_id = p.id
                 JOIN patient_inputs pi ON p.patient_input_id = pi.id
-                ORDER BY df.timestamp DESC
+                WHERE df.id > ?
+                ORDER BY df.id
                 LIMIT ?
-            ''', (limit,))
-            
-            columns = [col[0] for col in cursor.description]
-            results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-            conn.close()
-            
-            logger.info(f"Retrieved {len(results)} feedback records for training")
-            return results
-        except Exception as e:
-            logger.error(f"Error getting feedback for training: {e}")
-            return []
+            ''', (after or 0, limit))
+            return [TrainingRecord(*row) for row in cursor.fetchall()]
+
+    def iter_feedback_for_training(self, chunk_size: int = 1000,
+                                   after: Optional[int] = None) -> Iterator[TrainingRecord]:
+        """Stream the whole feedback history oldest-first, holding one chunk in memory at a time"""
+        while True:
+            page = self.get_feedback_page(after, chunk_size)
+            yield from page
+            if len(page) < chunk_size:
+                return
+            after = page[-1].key
 
     def get_model_stats(self) -> Dict:
         """Get model statistics"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Count total patients
-            cursor.execute('SELECT COUNT(*) FROM patient_inputs')
-            total_patients = cursor.fetchone()[0]
-            
-            # Count total prescriptions
-            cursor.execute('SELECT COUNT(*) FROM prescriptions')
-            total_prescriptions = cursor.fetchone()[0]
-            
-            # Count total feedback
-            cursor.execute('SELECT COUNT(*) FROM doctor_feedback')
-            total_feedback = cursor.fetchone()[0]
-            
-            # Get latest model version
-            cursor.execute('SELECT version FROM model_versions ORDER BY created_at DESC LIMIT 1')
-            latest_version = cursor.fetchone()
-            latest_version = latest_version[0] if latest_version else "1.0"
-            
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                
+                if self.migrate:
+                    # Maintained by triggers, so this is a primary-key lookup rather than three scans
+                    cursor.execute('SELECT name, row_count FROM table_counts')
+                    counts = dict(cursor.fetchall())
+                else:
+                    counts = {table: cursor.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                              for table in COUNTED_TABLES}
+                total_patients = counts.get('patient_inputs', 0)
+                total_prescriptions = counts.get('prescriptions', 0)
+                total_feedback = counts.get('doctor_feedback', 0)
+                
+                # Get latest model version (served by idx_model_versions_created_at)
+                cursor.execute('SELECT version FROM model_versions ORDER BY created_at DESC LIMIT 1')
+                latest_version = cursor.fetchone()
+                latest_version = latest_version[0] if latest_version else "1.0"
             
             return {
                 'total_patients': total_patients,
@@ -253,24 +698,23 @@ class MedicalDatabase:
     def save_model_version(self, version: str, training_data_count: int, feedback_count: int):
         """Save new model version"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO model_versions (version, training_data_count, feedback_incorporated, created_at)
-                VALUES (?, ?, ?, ?)
-            ''', (version, training_data_count, feedback_count, 
-                  datetime.now().isoformat()))
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO model_versions (version, training_data_count, feedback_incorporated, created_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (version, training_data_count, feedback_count, 
+                      datetime.now().isoformat()))
+                conn.commit()
             logger.info(f"Model version {version} saved")
         except Exception as e:
             logger.error(f"Error saving model version: {e}")
             raise
 
     def close(self):
-        """Close database connection"""
-        # SQLite connections are closed automatically in our implementation
-        pass
+        """Close database connections"""
+        if self.pool is not None:
+            self.pool.close()
 
 # Test the database
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+from typing import Dict, Iterable, Optional
+
+from .database_manager import MedicalDatabase, TrainingRecord
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("jsonl", "parquet")
+
+
+def _write_jsonl(records: Iterable[TrainingRecord], path: str) -> int:
+    count = 0
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record.to_dict()) + "\n")
+            count += 1
+    return count
+
+
+def _write_parquet(records: Iterable[TrainingRecord], path: str, row_group_size: int) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    schema = pa.schema([
+        ('symptoms', pa.string()),
+        ('age', pa.int64()),
+        ('gender', pa.string()),
+        ('diagnosis', pa.string()),
+        ('original_prescription', pa.list_(pa.string())),
+        ('modified_prescription', pa.list_(pa.string())),
+        ('feedback_notes', pa.string())
+    ])
+    count = 0
+    batch = []
+    with pq.ParquetWriter(path, schema) as writer:
+        # One row group per batch, so only row_group_size records are held at once
+        for record in records:
+            batch.append(record.to_dict())
+            if len(batch) >= row_group_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            count += len(batch)
+    return count
+
+
+def export_feedback_for_training(database: MedicalDatabase, path: str, fmt: str = "jsonl",
+                                 chunk_size: int = 1000, after: Optional[int] = None) -> Dict:
+    """Stream the feedback history into a JSONL or Parquet shard without loading it into memory"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt} (expected one of {EXPORT_FORMATS})")
+
+    last_key = after
+
+    def records():
+        nonlocal last_key
+        for record in database.iter_feedback_for_training(chunk_size, after):
+            last_key = record.key
+            yield record
+
+    # Write to a temporary name so a failed export never leaves a truncated shard behind
+    tmp_path = path + ".tmp"
+    try:
+        if fmt == "jsonl":
+            count = _write_jsonl(records(), tmp_path)
+        else:
+            count = _write_parquet(records(), tmp_path, chunk_size)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    logger.info(f"Exported {count} feedback records to {path}")
+    # 'last_key' lets the next export continue where this one stopped
+    return {'path': path, 'format': fmt, 'records': count, 'last_key': last_key}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Export doctor feedback as training data")
+    parser.add_argument("output", help="Shard path, e.g. feedback.jsonl or feedback.parquet")
+    parser.add_argument("--db-path", default="medical_mcp.db")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default=None,
+                        help="Defaults to the output file extension")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--after-id", type=int, default=0, help="Resume after this feedback id ('last_key')")
+    args = parser.parse_args()
+
+    fmt = args.format or ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    after = args.after_id or None
+    db = MedicalDatabase(args.db_path, pooled=False)
+    print(json.dumps(export_feedback_for_training(db, args.output, fmt, args.chunk_size, after)))
@@ -0,0 +1,250 @@
+import atexit
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Union
+
+from ..data_models.data_models import PatientInput, Prescription, DoctorFeedback
+from .database_manager import MedicalDatabase, link_feedback_medications, link_prescription_medications
+
+logger = logging.getLogger(__name__)
+
+# Record fields stored in NOT NULL columns; checked when a row is added so one bad row cannot
+# fail a whole group commit
+REQUIRED_FIELDS = {
+    'patient_inputs': ('symptoms', 'age', 'gender', 'diagnosis', 'timestamp'),
+    'prescriptions': ('medications', 'confidence', 'model_version', 'timestamp'),
+    'doctor_feedback': ('original_prescription', 'modified_prescription', 'doctor_id', 'timestamp')
+}
+
+
+class PendingRow:
+    """A buffered row; its id is assigned when the buffer is flushed"""
+
+    def __init__(self, table: str, record, parent: Union[int, "PendingRow", None] = None):
+        self.table = table
+        self.record = record
+        self.parent = parent
+        self.id: Optional[int] = None
+        self.future: Future = Future()
+
+
+class WriteBehindBuffer:
+    """Collects rows and writes them in one transaction per flush (group commit)"""
+
+    def __init__(self, database: MedicalDatabase, max_rows: int = 500, max_delay_ms: float = 50.0):
+        self.database = database
+        self.max_rows = max(1, max_rows)
+        self.max_delay_ms = max_delay_ms
+        self._rows: List[PendingRow] = []
+        self._oldest: Optional[float] = None
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.failed_flushes = 0
+        self.failed_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+        self._flusher = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._flusher.start()
+        # Flush-on-shutdown hook for interpreters that exit without calling close()
+        atexit.register(self.close)
+
+    def add_patient_input(self, patient_input: PatientInput) -> PendingRow:
+        return self._add(PendingRow('patient_inputs', patient_input))
+
+    def add_prescription(self, prescription: Prescription,
+                         patient_input: Union[int, PendingRow, None]) -> PendingRow:
+        return self._add(PendingRow('prescriptions', prescription, patient_input))
+
+    def add_feedback(self, feedback: DoctorFeedback,
+                     prescription: Union[int, PendingRow, None]) -> PendingRow:
+        return self._add(PendingRow('doctor_feedback', feedback, prescription))
+
+    def _add(self, row: PendingRow) -> PendingRow:
+        missing = [name for name in REQUIRED_FIELDS[row.table] if getattr(row.record, name, None) is None]
+        if missing:
+            raise ValueError(f"Cannot save {row.table} row without {', '.join(missing)}")
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Write-behind buffer is closed")
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.append(row)
+            # Wake the flusher to start the delay timer, or to flush a full buffer
+            if len(self._rows) == 1 or len(self._rows) >= self.max_rows:
+                self._condition.notify()
+        return row
+
+    def _run(self):
+        """Flush when the buffer is full or its oldest row has waited max_delay_ms"""
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if len(self._rows) >= self.max_rows:
+                        break
+                    if self._rows:
+                        remaining = self._oldest + self.max_delay_ms / 1000.0 - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    else:
+                        self._condition.wait()
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self) -> int:
+        """Write every buffered row in a single transaction; returns the number of rows written
+
+        If the group commit fails, the rows are retried one at a time, so a bad row only fails
+        its own save (and those of rows that depend on it).
+        """
+        with self._flush_lock:
+            with self._condition:
+                rows, self._rows = self._rows, []
+                self._oldest = None
+            rows = [row for row in rows if not self._reject_orphan(row)]
+            if not rows:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                self._write(rows)
+                written = rows
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"Group commit of {len(rows)} buffered rows failed ({e}), retrying one row at a time")
+                written = self._write_individually(rows)
+
+            for row in written:
+                if not row.future.done():
+                    row.future.set_result(row.id)
+
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            self.flushes += 1
+            self.rows_flushed += len(written)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+            return len(written)
+
+    def _write_individually(self, rows: List[PendingRow]) -> List[PendingRow]:
+        """Write rows in their own transactions so only the failing ones (and their children) fail
+
+        Rows are in the order they were added, so a parent is always written before its children.
+        """
+        for row in rows:
+            row.id = None
+        written = []
+        for row in rows:
+            try:
+                self._write([row])
+                written.append(row)
+            except Exception as e:
+                row.id = None
+                self.failed_rows += 1
+                logger.error(f"Error writing buffered {row.table} row: {e}")
+                if not row.future.done():
+                    row.future.set_exception(e)
+        return written
+
+    @staticmethod
+    def _reject_orphan(row: PendingRow) -> bool:
+        """Fail a row whose buffered parent failed in an earlier flush, instead of the whole batch"""
+        parent = row.parent
+        if isinstance(parent, PendingRow) and parent.future.done() and parent.future.exception() is not None:
+            row.future.set_exception(RuntimeError(f"Parent {parent.table} row was not written"))
+            return True
+        return False
+
+    @staticmethod
+    def _next_id(cursor, table: str) -> int:
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM ' + table)
+        max_id = cursor.fetchone()[0]
+        cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,))
+        seq = cursor.fetchone()
+        return max(max_id, seq[0] if seq else 0) + 1
+
+    @staticmethod
+    def _parent_id(row: PendingRow) -> Optional[int]:
+        parent = row.parent
+        if isinstance(parent, PendingRow):
+            if parent.id is None:
+                raise RuntimeError(f"Parent {parent.table} row was not written")
+            return parent.id
+        return parent
+
+    def _write(self, rows: List[PendingRow]):
+        """Assign ids up front so children can reference parents buffered in the same flush"""
+        by_table = {'patient_inputs': [], 'prescriptions': [], 'doctor_feedback': []}
+        for row in rows:
+            by_table[row.table].append(row)
+
+        with self.database.transaction() as cursor:
+            # Parents first: ids must exist before prescriptions/feedback resolve them
+            for table in ('patient_inputs', 'prescriptions', 'doctor_feedback'):
+                if by_table[table]:
+                    next_id = self._next_id(cursor, table)
+                    for offset, row in enumerate(by_table[table]):
+                        row.id = next_id + offset
+
+            cursor.executemany('''
+                INSERT INTO patient_inputs (id, symptoms, age, gender, diagnosis, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(row.id, row.record.symptoms, row.record.age, row.record.gender,
+                   row.record.diagnosis, row.record.timestamp) for row in by_table['patient_inputs']])
+
+            cursor.executemany('''
+                INSERT INTO prescriptions (id, patient_input_id, medications, confidence, model_version, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(row.id, self._parent_id(row), json.dumps(row.record.medications), row.record.confidence,
+                   row.record.model_version, row.record.timestamp) for row in by_table['prescriptions']])
+            if self.database.migrate:
+                link_prescription_medications(
+                    cursor, [(row.id, row.record.medications) for row in by_table['prescriptions']])
+
+            cursor.executemany('''
+                INSERT INTO doctor_feedback (id, prescription_id, original_prescription,
+                                           modified_prescription, feedback_notes, doctor_id, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(row.id, self._parent_id(row), json.dumps(row.record.original_prescription),
+                   json.dumps(row.record.modified_prescription), row.record.feedback_notes,
+                   row.record.doctor_id, row.record.timestamp) for row in by_table['doctor_feedback']])
+            if self.database.migrate:
+                link_feedback_medications(
+                    cursor, [(row.id, row.record.original_prescription, row.record.modified_prescription)
+                             for row in by_table['doctor_feedback']])
+
+    def get_stats(self) -> Dict:
+        return {
+            'buffer_depth': len(self._rows),
+            'max_rows': self.max_rows,
+            'max_delay_ms': self.max_delay_ms,
+            'flushes': self.flushes,
+            'rows_flushed': self.rows_flushed,
+            'failed_flushes': self.failed_flushes,
+            'failed_rows': self.failed_rows,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'avg_flush_ms': round(self._total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            'max_flush_ms': round(self.max_flush_ms, 2)
+        }
+
+    def close(self):
+        """Stop the flusher and write whatever is still buffered"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._flusher.join()
+        flushed = self.flush()
+        atexit.unregister(self.close)
+        logger.info(f"Write-behind buffer closed ({flushed} rows flushed on shutdown)")
@@ -1,20 +1,35 @@
 import asyncio
 import json
+import random
+import uuid
 import websockets
 import logging
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, Iterable, List, Optional, Union
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class MCPClient:
-    def __init__(self, uri: str = "ws://localhost:8765"):
+    def __init__(self, uri: str = "ws://localhost:8765", ping_interval: Optional[float] = 20.0,
+                 ping_timeout: Optional[float] = 20.0, on_unmatched: Optional[Callable[[dict], None]] = None):
         self.uri = uri
+        # Websocket keep-alive pings; a connection that misses ping_timeout is closed
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
         self.websocket = None
+        # request_id -> Future (single reply) or Queue (streamed replies), filled by the reader task
+        self._pending: Dict[str, object] = {}
+        self._reader: Optional[asyncio.Task] = None
+        # Called with replies that carry no request_id (e.g. server-side connection errors);
+        # they cannot be attributed to a request, so they are never matched to one
+        self.on_unmatched = on_unmatched or self._log_unmatched
     
     async def connect(self):
         """Connect to the MCP server"""
         try:
-            self.websocket = await websockets.connect(self.uri)
+            self.websocket = await websockets.connect(self.uri, ping_interval=self.ping_interval,
+                                                      ping_timeout=self.ping_timeout)
+            self._reader = asyncio.create_task(self._read_loop())
             logger.info(f"Connected to server at {self.uri}")
             return True
         except Exception as e:
@@ -25,14 +40,94 @@ class MCPClient:
         """Disconnect from the server"""
         if self.websocket:
             await self.websocket.close()
+            if self._reader is not None:
+                await asyncio.gather(self._reader, return_exceptions=True)
             logger.info("Disconnected from server")
     
-    async def generate_prescription(self, patient_data: dict, symptoms: list):
-        """Generate a prescription"""
+    @property
+    def connected(self) -> bool:
+        """True while the socket is open and the reader is routing replies"""
+        return self.websocket is not None and self._reader is not None and not self._reader.done()
+    
+    @property
+    def in_flight(self) -> int:
+        """Requests sent on this connection that are still waiting for their reply"""
+        return len(self._pending)
+    
+    async def _read_loop(self):
+        """Route every incoming message to the request it answers"""
+        try:
+            async for raw in self.websocket:
+                message = json.loads(raw)
+                request_id = message.get("request_id")
+                if request_id is None:
+                    self.on_unmatched(message)
+                    continue
+                waiter = self._pending.get(request_id)
+                if waiter is None:
+                    logger.warning(f"Dropping reply for unknown request {request_id}")
+                elif isinstance(waiter, asyncio.Queue):
+                    waiter.put_nowait(message)
+                else:
+                    self._pending.pop(request_id, None)
+                    if not waiter.done():
+                        waiter.set_result(message)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            logger.error(f"Error reading from server: {e}")
+        finally:
+            # Fail everything still waiting: no reply can arrive any more
+            pending, self._pending = self._pending, {}
+            for waiter in pending.values():
+                if isinstance(waiter, asyncio.Queue):
+                    waiter.put_nowait(None)
+                elif not waiter.done():
+                    waiter.set_exception(Exception("Connection closed"))
+    
+    @staticmethod
+    def _log_unmatched(message: dict):
+        logger.warning(f"Server message without a request_id: {message.get('message', message)}")
+    
+    async def request(self, message: dict) -> dict:
+        """Send a message tagged with a fresh request_id and wait for its reply"""
         if not self.websocket:
             raise Exception("Not connected to server")
-        
-        message = {
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await self.websocket.send(json.dumps({**message, "request_id": request_id}))
+            return await future
+        except websockets.exceptions.ConnectionClosed:
+            raise Exception("Connection closed")
+        finally:
+            self._pending.pop(request_id, None)
+    
+    async def request_stream(self, message: dict, final_types: tuple) -> AsyncIterator[dict]:
+        """Send a message and yield its replies until one whose type is in final_types (or an error)"""
+        if not self.websocket:
+            raise Exception("Not connected to server")
+        request_id = uuid.uuid4().hex
+        replies = asyncio.Queue()
+        self._pending[request_id] = replies
+        try:
+            await self.websocket.send(json.dumps({**message, "request_id": request_id}))
+            while True:
+                reply = await replies.get()
+                if reply is None:
+                    raise Exception("Connection closed")
+                yield reply
+                if reply.get("type") in final_types or reply.get("status") == "error":
+                    break
+        except websockets.exceptions.ConnectionClosed:
+            raise Exception("Connection closed")
+        finally:
+            self._pending.pop(request_id, None)
+    
+    @staticmethod
+    def _prescription_message(patient_data: dict, symptoms: list) -> dict:
+        return {
             "type": "generate_prescription",
             "patient_input": {
                 "name": patient_data.get("name", "Unknown"),  # Keep name for display
@@ -44,15 +139,14 @@ class MCPClient:
                 "allergies": patient_data.get("allergies", [])
             }
         }
+    
+    async def generate_prescription(self, patient_data: dict, symptoms: list):
+        """Generate a prescription"""
+        message = self._prescription_message(patient_data, symptoms)
         
         try:
-            # Send request
-            await self.websocket.send(json.dumps(message))
             logger.info("Prescription request sent")
-            
-            # Wait for response
-            response = await self.websocket.recv()
-            result = json.loads(response)
+            result = await self.request(message)
             
             if result.get("status") == "success":
                 logger.info("Prescription generated successfully")
@@ -61,18 +155,95 @@ class MCPClient:
                 logger.error(f"Error from server: {result.get('message', 'Unknown error')}")
                 return result
                 
-        except websockets.exceptions.ConnectionClosed:
-            logger.error("Connection closed while waiting for response")
-            raise Exception("Connection closed")
         except Exception as e:
             logger.error(f"Error generating prescription: {e}")
             raise
     
+    async def stream_prescription(self, patient_data: dict, symptoms: list) -> AsyncIterator[dict]:
+        """Generate a prescription, yielding each prescription_partial message and then the final one"""
+        message = self._prescription_message(patient_data, symptoms)
+        message["stream"] = True
+        
+        logger.info("Streaming prescription request sent")
+        async for result in self.request_stream(message, ("prescription_generated",)):
+            yield result
+    
+    async def generate_prescriptions(self, patients: Union[Iterable[dict], AsyncIterable[dict]],
+                                     batch_size: int = 64, max_in_flight: int = 2) -> AsyncIterator[dict]:
+        """Generate prescriptions for a (possibly huge) stream of patient inputs
+        
+        Inputs are read lazily and sent as generate_prescription_batch messages of batch_size;
+        at most max_in_flight batches are outstanding, so memory stays bounded. Yields
+        {'index', 'prescription_id', 'prescription'} dicts as chunks complete; 'index' is the
+        position in `patients`, and results from different batches may interleave.
+        """
+        results = asyncio.Queue(maxsize=batch_size * max_in_flight)
+        slots = asyncio.Semaphore(max_in_flight)
+        
+        async def run_batch(offset: int, batch: list):
+            try:
+                message = {"type": "generate_prescription_batch", "patient_inputs": batch, "chunk_size": batch_size}
+                async for reply in self.request_stream(message, ("prescription_batch_complete",)):
+                    if reply.get("status") == "error":
+                        raise Exception(reply.get("message", "Batch failed"))
+                    for result in reply.get("results", []):
+                        result["index"] += offset
+                        await results.put(result)
+            except Exception as e:
+                await results.put(e)
+            finally:
+                slots.release()
+        
+        async def batches():
+            batch = []
+            if hasattr(patients, "__aiter__"):
+                async for patient in patients:
+                    batch.append(patient)
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+            else:
+                for patient in patients:
+                    batch.append(patient)
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+            if batch:
+                yield batch
+        
+        async def produce():
+            tasks = set()
+            offset = 0
+            try:
+                async for batch in batches():
+                    await slots.acquire()
+                    task = asyncio.create_task(run_batch(offset, batch))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    offset += len(batch)
+                await asyncio.gather(*tasks)
+                await results.put(None)
+            except Exception as e:
+                await results.put(e)
+            finally:
+                for task in list(tasks):
+                    task.cancel()
+        
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                item = await results.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+    
     async def send_doctor_feedback(self, prescription_id: str, feedback_data: dict):
         """Send doctor feedback"""
-        if not self.websocket:
-            raise Exception("Not connected to server")
-        
         message = {
             "type": "doctor_feedback",
             "prescription_id": prescription_id,
@@ -84,13 +255,8 @@ class MCPClient:
         }
         
         try:
-            await self.websocket.send(json.dumps(message))
             logger.info("Doctor feedback sent")
-            
-            response = await self.websocket.recv()
-            result = json.loads(response)
-            
-            return result
+            return await self.request(message)
             
         except Exception as e:
             logger.error(f"Error sending feedback: {e}")
@@ -98,25 +264,141 @@ class MCPClient:
     
     async def update_model(self):
         """Request model update"""
-        if not self.websocket:
-            raise Exception("Not connected to server")
-        
         message = {
             "type": "update_model"
         }
         
         try:
-            await self.websocket.send(json.dumps(message))
             logger.info("Model update request sent")
-            
-            response = await self.websocket.recv()
-            result = json.loads(response)
-            
-            return result
+            return await self.request(message)
             
         except Exception as e:
             logger.error(f"Error updating model: {e}")
             raise
+    
+    async def swap_model(self, version: str, source: str = "adapter"):
+        """Ask the server to hot-swap to another model version (fine-tuned adapter or snapshot)"""
+        return await self.request({"type": "swap_model", "version": version, "source": source})
+    
+    async def get_model_update_status(self):
+        """Request the progress of the current fine-tuning job"""
+        return await self.request({"type": "model_update_status"})
+    
+    async def get_model_info(self):
+        """Request model, batching and database statistics"""
+        return await self.request({"type": "model_info"})
+
+class MCPClientPool:
+    """N long-lived MCPClient connections with keep-alive pings, reconnect with backoff and
+    least-busy selection; exposes the same request methods as MCPClient"""
+    
+    def __init__(self, uri: str = "ws://localhost:8765", size: int = 4, ping_interval: Optional[float] = 20.0,
+                 ping_timeout: Optional[float] = 20.0, health_check_interval: float = 5.0,
+                 backoff_initial: float = 0.5, backoff_max: float = 30.0, acquire_timeout: float = 10.0):
+        self.uri = uri
+        self.size = max(1, size)
+        self.health_check_interval = health_check_interval
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.acquire_timeout = acquire_timeout
+        self.clients: List[MCPClient] = [MCPClient(uri, ping_interval, ping_timeout) for _ in range(self.size)]
+        self._reconnecting: Dict[int, asyncio.Task] = {}
+        self._monitor: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+        self.reconnects = 0
+    
+    async def connect(self) -> bool:
+        """Open every connection; ones that fail keep retrying in the background"""
+        results = await asyncio.gather(*(client.connect() for client in self.clients))
+        if any(results):
+            self._connected.set()
+        self._monitor = asyncio.create_task(self._monitor_loop())
+        logger.info(f"Connection pool ready: {sum(results)}/{self.size} connections to {self.uri}")
+        return any(results)
+    
+    async def disconnect(self):
+        """Stop reconnecting and close every connection"""
+        tasks = list(self._reconnecting.values()) + ([self._monitor] if self._monitor else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*(client.disconnect() for client in self.clients if client.connected),
+                             return_exceptions=True)
+    
+    async def _monitor_loop(self):
+        """Health check: schedule a reconnect for every connection that has dropped"""
+        while True:
+            self._check_connections()
+            await asyncio.sleep(self.health_check_interval)
+    
+    def _check_connections(self):
+        for index, client in enumerate(self.clients):
+            if not client.connected and index not in self._reconnecting:
+                self._reconnecting[index] = asyncio.create_task(self._reconnect(index))
+        if not any(client.connected for client in self.clients):
+            self._connected.clear()
+    
+    async def _reconnect(self, index: int):
+        """Reconnect one slot with exponential backoff and jitter"""
+        delay = self.backoff_initial
+        try:
+            while True:
+                if await self.clients[index].connect():
+                    self.reconnects += 1
+                    self._connected.set()
+                    return
+                await asyncio.sleep(delay * (1 + random.random() * 0.25))
+                delay = min(delay * 2, self.backoff_max)
+        finally:
+            self._reconnecting.pop(index, None)
+    
+    async def _acquire(self) -> MCPClient:
+        """The connected client with the fewest requests in flight"""
+        while True:
+            connected = [client for client in self.clients if client.connected]
+            if connected:
+                return min(connected, key=lambda client: client.in_flight)
+            self._check_connections()
+            try:
+                await asyncio.wait_for(self._connected.wait(), self.acquire_timeout)
+            except asyncio.TimeoutError:
+                raise Exception("No connection to server")
+    
+    async def generate_prescription(self, patient_data: dict, symptoms: list):
+        return await (await self._acquire()).generate_prescription(patient_data, symptoms)
+    
+    async def stream_prescription(self, patient_data: dict, symptoms: list) -> AsyncIterator[dict]:
+        async for result in (await self._acquire()).stream_prescription(patient_data, symptoms):
+            yield result
+    
+    async def generate_prescriptions(self, patients: Union[Iterable[dict], AsyncIterable[dict]],
+                                     batch_size: int = 64, max_in_flight: int = 2) -> AsyncIterator[dict]:
+        async for result in (await self._acquire()).generate_prescriptions(patients, batch_size, max_in_flight):
+            yield result
+    
+    async def send_doctor_feedback(self, prescription_id: str, feedback_data: dict):
+        return await (await self._acquire()).send_doctor_feedback(prescription_id, feedback_data)
+    
+    async def update_model(self):
+        return await (await self._acquire()).update_model()
+    
+    async def swap_model(self, version: str, source: str = "adapter"):
+        return await (await self._acquire()).swap_model(version, source)
+    
+    async def get_model_update_status(self):
+        return await (await self._acquire()).get_model_update_status()
+    
+    async def get_model_info(self):
+        return await (await self._acquire()).get_model_info()
+    
+    def get_stats(self) -> Dict:
+        return {
+            'size': self.size,
+            'connected': sum(client.connected for client in self.clients),
+            'in_flight': [client.in_flight for client in self.clients],
+            'reconnecting': len(self._reconnecting),
+            'reconnects': self.reconnects
+        }
 
 async def main():
     """Test the client"""
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import re
+import time
+from typing import Dict, List, Optional
+
+from ..data_models.data_models import PatientInput, Prescription
+from ..models.extraction import MedicationExtractor
+from ..models.rules import default_rule_engine
+from ..transcription.service import TranscriptionService
+
+logger = logging.getLogger(__name__)
+
+AGE_RE = re.compile(r"\b(?:aged?\s*(?:is\s*)?(\d{1,3})|(\d{1,3})\s*(?:-\s*)?(?:years?|yrs?|y/?o)\b)", re.IGNORECASE)
+GENDER_WORDS = {
+    'female': 'female', 'woman': 'female', 'girl': 'female', 'she': 'female', 'her': 'female',
+    'male': 'male', 'man': 'male', 'boy': 'male', 'he': 'male', 'his': 'male', 'him': 'male'
+}
+GENDER_RE = re.compile(r"\b(" + "|".join(GENDER_WORDS) + r")\b", re.IGNORECASE)
+
+
+class PatientInputExtractor:
+    """Reads symptoms, diagnosis, age and gender out of a consultation transcript
+
+    Symptoms and diagnoses are the prescription rule keywords, matched on word boundaries with
+    the same word trie used for drug names; fields given explicitly in the request win.
+    """
+
+    def __init__(self, symptoms: List[str], diagnoses: List[str]):
+        self._symptoms = MedicationExtractor(symptoms)
+        self._diagnoses = MedicationExtractor(diagnoses)
+
+    @classmethod
+    def from_rules(cls) -> "PatientInputExtractor":
+        engine = default_rule_engine()
+        return cls(engine.symptom_keywords, engine.diagnosis_keywords)
+
+    def extract(self, text: str, hints: Optional[Dict] = None) -> PatientInput:
+        hints = hints or {}
+        symptoms = hints.get('symptoms') or self._symptoms.extract(text)
+        age = hints.get('age')
+        if age is None:
+            match = AGE_RE.search(text)
+            age = int(match.group(1) or match.group(2)) if match else 0
+        else:
+            age = int(age)
+        gender = hints.get('gender')
+        if not gender:
+            match = GENDER_RE.search(text)
+            gender = GENDER_WORDS[match.group(1).lower()] if match else 'Unknown'
+        return PatientInput(
+            symptoms=", ".join(symptoms) if isinstance(symptoms, list) else str(symptoms),
+            age=age,
+            gender=gender,
+            diagnosis=hints.get('diagnosis') or ", ".join(self._diagnoses.extract(text))
+        )
+
+
+class _Job:
+    __slots__ = ('audio_path', 'hints', 'future', 'timings', 'stage_started', 'transcription', 'patient_input')
+
+    def __init__(self, audio_path: str, hints: Dict, future: asyncio.Future):
+        self.audio_path = audio_path
+        self.hints = hints
+        self.future = future
+        self.timings: Dict[str, float] = {}
+        self.stage_started = time.perf_counter()
+        self.transcription: Optional[Dict] = None
+        self.patient_input: Optional[PatientInput] = None
+
+    def mark(self, name: str):
+        """Record the time since the previous mark under name"""
+        now = time.perf_counter()
+        self.timings[name] = round((now - self.stage_started) * 1000.0, 1)
+        self.stage_started = now
+
+
+class VoicePrescriptionPipeline:
+    """Audio in, Prescription out: transcription -> PatientInput extraction -> batched generation
+
+    Stages are joined by bounded asyncio queues and each runs as its own task(s), so one request's
+    transcription overlaps another's generation. Each input goes through
+    model_manager.generate_prescription, so it is served from the prescription cache, shares
+    in-flight work with identical requests, and is batched by the manager's own MicroBatcher.
+    """
+
+    def __init__(self, transcription: TranscriptionService, model_manager, max_queue_size: int = 16,
+                 max_in_flight: int = 64):
+        self.transcription = transcription
+        self.model_manager = model_manager
+        self.extractor = PatientInputExtractor.from_rules()
+        self.max_queue_size = max_queue_size
+        # Bounds every job between submit() and its result, whichever stage it is in
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._audio_queue: Optional[asyncio.Queue] = None
+        self._text_queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._generating = set()
+        # Every job between submit() and its result, so close() can fail the ones still pending
+        self._jobs = set()
+        self._closed = False
+        self.completed = 0
+        self.failed = 0
+        self._total_timings: Dict[str, float] = {}
+
+    async def start(self):
+        if not self.transcription.started:
+            await self.transcription.start()
+        self._audio_queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._text_queue = asyncio.Queue(maxsize=self.max_queue_size)
+        # One transcription stage task per whisper worker keeps every worker busy
+        self._tasks = [asyncio.create_task(self._transcribe_stage()) for _ in range(self.transcription.workers)]
+        self._tasks.append(asyncio.create_task(self._extract_stage()))
+        logger.info(f"Voice prescription pipeline ready ({self.transcription.workers} transcription workers)")
+
+    async def submit(self, audio_path: str, hints: Optional[Dict] = None) -> Dict:
+        """Run one recording through the pipeline
+
+        Returns the transcription, the extracted PatientInput, the Prescription and per-stage
+        timings in ms (queue waits included in the stage that follows them).
+        """
+        if self._audio_queue is None:
+            raise RuntimeError("Voice prescription pipeline is not started")
+        async with self._slots:
+            if self._closed:
+                raise RuntimeError("Voice prescription pipeline is closed")
+            job = _Job(audio_path, hints or {}, asyncio.get_running_loop().create_future())
+            self._jobs.add(job)
+            try:
+                await self._audio_queue.put(job)
+                return await job.future
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self._jobs.discard(job)
+
+    async def _transcribe_stage(self):
+        while True:
+            job = await self._audio_queue.get()
+            try:
+                job.mark('audio_queue_ms')
+                job.transcription = await self.transcription.transcribe(job.audio_path, block=True)
+                job.mark('transcription_ms')
+                await self._text_queue.put(job)
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+
+    async def _extract_stage(self):
+        while True:
+            job = await self._text_queue.get()
+            try:
+                job.mark('text_queue_ms')
+                job.patient_input = self.extractor.extract(job.transcription['text'], job.hints)
+                job.mark('extraction_ms')
+                # The manager's bounded batch queue is the last stage boundary; don't wait for the result here
+                task = asyncio.create_task(self._generate_stage(job))
+                self._generating.add(task)
+                task.add_done_callback(self._generating.discard)
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+
+    async def _generate_stage(self, job: _Job):
+        try:
+            prescription: Prescription = await self.model_manager.generate_prescription(job.patient_input)
+            job.mark('generation_ms')
+            job.timings['total_ms'] = round(sum(job.timings.values()), 1)
+            self.completed += 1
+            for name, ms in job.timings.items():
+                self._total_timings[name] = self._total_timings.get(name, 0.0) + ms
+            if not job.future.done():
+                job.future.set_result({
+                    'transcription': job.transcription,
+                    'patient_input': job.patient_input,
+                    'prescription': prescription,
+                    'timings': job.timings
+                })
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+
+    def get_stats(self) -> Dict:
+        return {
+            'completed': self.completed,
+            'failed': self.failed,
+            'audio_queue_depth': self._audio_queue.qsize() if self._audio_queue else 0,
+            'text_queue_depth': self._text_queue.qsize() if self._text_queue else 0,
+            'generating': len(self._generating),
+            'avg_timings_ms': {name: round(ms / self.completed, 1) for name, ms in self._total_timings.items()}
+                              if self.completed else {},
+            'transcription': self.transcription.get_stats()
+        }
+
+    async def close(self):
+        """Stop the stages and fail every job still queued or in flight, so no submit() waits forever"""
+        self._closed = True
+        tasks = self._tasks + list(self._generating)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for queue in (self._audio_queue, self._text_queue):
+            while queue is not None and not queue.empty():
+                queue.get_nowait()
+        for job in list(self._jobs):
+            if not job.future.done():
+                job.future.set_exception(RuntimeError("Voice prescription pipeline closed"))
+        await self.transcription.close()
@@ -1,27 +1,67 @@
 import asyncio
 import json
 import logging
+import os
 import websockets
-from typing import Set
+from collections import OrderedDict
+from typing import Optional, Set
 from datetime import datetime
 from dataclasses import asdict
 from ..data_models.data_models import PatientInput, Prescription, DoctorFeedback, MCPResponse
 from ..Database.database_manager import MedicalDatabase
+from ..Database.async_database import AsyncMedicalDatabase
 from ..models.model import BioGPTModelManager
+from ..models.paths import validate_version
+from ..transcription.service import TranscriptionService
+from .pipeline import VoicePrescriptionPipeline
+from ..utils import PhaseTimer
 
 logger = logging.getLogger(__name__)
 
 class MCPMedicalServer:
-    def __init__(self, host: str = "localhost", port: int = 8765):
+    def __init__(self, host: str = "localhost", port: int = 8765, replicas: int = 0, load_mode: str = "adapter",
+                 max_requests_per_connection: int = 256, ping_interval: Optional[float] = 20.0,
+                 ping_timeout: Optional[float] = 20.0, close_timeout: float = 10.0,
+                 voice_pipeline: bool = False, whisper_model: str = "base", transcription_workers: int = 1):
         self.host = host
         self.port = port
+        # Keep-alive tuning: pooled clients hold connections open, idle ones are pinged
+        # every ping_interval and dropped after ping_timeout without a pong (None disables)
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.close_timeout = close_timeout
+        # Messages on one connection are handled concurrently, up to this many at a time
+        self.max_requests_per_connection = max_requests_per_connection
+        # Upper bound for the chunk_size a batch request may ask for
+        self.max_batch_chunk_size = 256
         self.database = MedicalDatabase()
-        self.model_manager = BioGPTModelManager()
+        # All persistence from the event loop goes through the async facade, group-committed
+        self.async_database = AsyncMedicalDatabase(self.database, write_behind=True)
+        # Response prescription_id -> background save task, so feedback can link to the DB row
+        self._prescription_records = OrderedDict()
+        self._max_prescription_records = 10000
+        if replicas > 0:
+            # Replica-pool mode: K worker processes sharing one copy of the base weights
+            self.model_manager = BioGPTModelManager(executor_type="replicas", inference_workers=replicas,
+                                                    load_mode=load_mode)
+        else:
+            self.model_manager = BioGPTModelManager(load_mode=load_mode)
+        # Optional in-process audio -> prescription pipeline; Whisper is only loaded when enabled
+        self.voice_pipeline: Optional[VoicePrescriptionPipeline] = None
+        if voice_pipeline:
+            self.voice_pipeline = VoicePrescriptionPipeline(
+                TranscriptionService(whisper_model, workers=transcription_workers), self.model_manager
+            )
         self.connected_clients = set()
         
     async def start_server(self):
         """Start the MCP server"""
-        await self.model_manager.load_model()
+        timer = PhaseTimer()
+        with timer.phase('model_load'):
+            await self.model_manager.load_model()
+        if self.voice_pipeline is not None:
+            with timer.phase('voice_pipeline'):
+                await self.voice_pipeline.start()
         logger.info(f"Starting MCP Medical Server on {self.host}:{self.port}")
         
         # Fix: Create a wrapper function that properly handles the method call
@@ -29,13 +69,18 @@ class MCPMedicalServer:
             # Handle both cases: with path and without path
             return await self.handle_client(websocket, path or "/")
         
-        server = await websockets.serve(
-            handler,
-            self.host,
-            self.port
-        )
+        with timer.phase('socket_bind'):
+            server = await websockets.serve(
+                handler,
+                self.host,
+                self.port,
+                ping_interval=self.ping_interval,
+                ping_timeout=self.ping_timeout,
+                close_timeout=self.close_timeout
+            )
         
         logger.info(f"Server started successfully on ws://{self.host}:{self.port}")
+        logger.info(f"Startup time breakdown: {timer.summary()}")
         return server
     
     async def handle_client(self, websocket, path):
@@ -43,9 +88,21 @@ class MCPMedicalServer:
         self.connected_clients.add(websocket)
         logger.info(f"Client connected from {websocket.remote_address} on path: {path}")
         
+        # Each message runs as its own task; replies carry the request_id so the client can match them
+        slots = asyncio.Semaphore(self.max_requests_per_connection)
+        tasks = set()
+        
+        def _task_done(task):
+            tasks.discard(task)
+            slots.release()
+        
         try:
             async for message in websocket:
-                await self.process_message(websocket, message)
+                # Stop reading (backpressure) while the connection has too many requests in flight
+                await slots.acquire()
+                task = asyncio.create_task(self.process_message(websocket, message))
+                tasks.add(task)
+                task.add_done_callback(_task_done)
         except websockets.exceptions.ConnectionClosed:
             logger.info("Client disconnected")
         except Exception as e:
@@ -53,75 +110,184 @@ class MCPMedicalServer:
             await self.send_error(websocket, f"Connection error: {str(e)}")
         finally:
             self.connected_clients.discard(websocket)  # Use discard instead of remove to avoid KeyError
+            # Nobody is left to receive the replies
+            for task in list(tasks):
+                task.cancel()
     
     async def process_message(self, websocket, message: str):
         """Process incoming messages from clients"""
+        data = {}
         try:
             data = json.loads(message)
+            if not isinstance(data, dict):
+                data = {}
+                raise ValueError("Message must be a JSON object")
             message_type = data.get('type')
             
             if message_type == 'generate_prescription':
                 await self.handle_prescription_request(websocket, data)
+            elif message_type == 'generate_prescription_batch':
+                await self.handle_prescription_batch(websocket, data)
+            elif message_type == 'voice_prescription':
+                await self.handle_voice_prescription(websocket, data)
             elif message_type == 'doctor_feedback':
                 await self.handle_doctor_feedback(websocket, data)
             elif message_type == 'update_model':
                 await self.handle_model_update(websocket, data)
+            elif message_type == 'swap_model':
+                await self.handle_model_swap(websocket, data)
+            elif message_type == 'model_update_status':
+                await self.handle_model_update_status(websocket, data)
+            elif message_type == 'model_info':
+                await self.handle_model_info(websocket, data)
             else:
-                await self.send_error(websocket, "Unknown message type")
+                await self.send_error(websocket, "Unknown message type", data)
                 
         except json.JSONDecodeError:
             await self.send_error(websocket, "Invalid JSON format")
         except Exception as e:
             logger.error(f"Error processing message: {e}")
-            await self.send_error(websocket, str(e))
+            await self.send_error(websocket, str(e), data)
+    
+    async def send_message(self, websocket, data: dict, response: dict):
+        """Send a reply, tagged with the request_id of the message it answers (if it had one)"""
+        if data.get('request_id') is not None:
+            response['request_id'] = data['request_id']
+        await websocket.send(json.dumps(response))
+    
+    @staticmethod
+    def _parse_patient_input(patient_input: dict) -> PatientInput:
+        """Create PatientInput object matching the data model from a request's patient_input"""
+        symptoms = patient_input.get('symptoms', [])
+        return PatientInput(
+            symptoms=", ".join(symptoms) if isinstance(symptoms, list) else str(symptoms),
+            age=patient_input.get('age', 0),
+            gender=patient_input.get('gender', 'Unknown'),
+            diagnosis=patient_input.get('diagnosis', '')
+        )
+    
+    def _record_prescription(self, patient_input_obj: PatientInput, prescription_obj: Prescription,
+                             patient_name: str, prescription_id: str) -> dict:
+        """Persist off the response path and build the prescription_generated message"""
+        record_task = self.async_database.persist_in_background(
+            self.async_database.save_prescription_record(patient_input_obj, prescription_obj)
+        )
+        self._remember_prescription(prescription_id, record_task)
+        
+        # Convert to dictionary for JSON response
+        prescription_dict = asdict(prescription_obj)
+        
+        # Add patient info to response (since it's not in the data model)
+        prescription_dict['patient_name'] = patient_name
+        prescription_dict['patient_id'] = f'patient_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+        
+        return {
+            'type': 'prescription_generated',
+            'prescription_id': prescription_id,
+            'prescription': prescription_dict,
+            'status': 'success',
+            'message': 'Prescription generated successfully'
+        }
     
     async def handle_prescription_request(self, websocket, data):
-        """Handle prescription generation requests"""
-        try:  # ← REMOVE the extra spaces before 'try'
+        """Handle prescription generation requests (streamed as prescription_partial messages if 'stream' is set)"""
+        try:
             # Extract patient input data
             patient_input = data.get('patient_input', {})
             patient_name = patient_input.get('name', 'Unknown Patient')
-            patient_age = patient_input.get('age', 0)
-            symptoms = patient_input.get('symptoms', [])
-            
-            logger.info(f"Processing prescription request for {patient_name}, age {patient_age}")
-            logger.info(f"Symptoms: {symptoms}")
-            
-            # Create PatientInput object matching your data model
-            patient_input_obj = PatientInput(
-                symptoms=", ".join(symptoms) if isinstance(symptoms, list) else str(symptoms),
-                age=patient_age,
-                gender=patient_input.get('gender', 'Unknown'),
-                diagnosis=patient_input.get('diagnosis', '')
-            )
             
-            # Store patient name separately in database if needed
-            patient_id = f'patient_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+            logger.info(f"Processing prescription request for {patient_name}, age {patient_input.get('age', 0)}")
+            logger.info(f"Symptoms: {patient_input.get('symptoms', [])}")
             
-            # Use your actual model to generate prescription
-            prescription_obj = await self.model_manager.generate_prescription(patient_input_obj)
+            patient_input_obj = self._parse_patient_input(patient_input)
+            prescription_id = f'rx_{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}'
             
-            # Convert to dictionary for JSON response
-            prescription_dict = asdict(prescription_obj)
+            if data.get('stream'):
+                prescription_obj = None
+                async for kind, payload in self.model_manager.stream_prescription(patient_input_obj):
+                    if kind == 'partial':
+                        await self.send_message(websocket, data, {
+                            'type': 'prescription_partial',
+                            'prescription_id': prescription_id,
+                            'text': payload
+                        })
+                    else:
+                        prescription_obj = payload
+            else:
+                # Use your actual model to generate prescription
+                prescription_obj = await self.model_manager.generate_prescription(patient_input_obj)
             
-            # Add patient info to response (since it's not in the data model)
-            prescription_dict['patient_name'] = patient_name
-            prescription_dict['patient_id'] = patient_id
+            response = self._record_prescription(patient_input_obj, prescription_obj, patient_name, prescription_id)
+            await self.send_message(websocket, data, response)
+            logger.info(f"Prescription generated for {patient_name}")
             
-            response = {
-                'type': 'prescription_generated',
-                'prescription_id': f'rx_{datetime.now().strftime("%Y%m%d_%H%M%S")}',
-                'prescription': prescription_dict,
+        except Exception as e:
+            logger.error(f"Error generating prescription: {e}")
+            await self.send_error(websocket, f"Error generating prescription: {e}", data)
+    
+    async def handle_prescription_batch(self, websocket, data):
+        """Handle bulk requests: results go back in prescription_batch_chunk messages as each chunk finishes"""
+        try:
+            patient_inputs = data.get('patient_inputs') or []
+            chunk_size = max(1, min(int(data.get('chunk_size', 32)), self.max_batch_chunk_size))
+            logger.info(f"Processing prescription batch of {len(patient_inputs)} (chunks of {chunk_size})")
+            
+            for offset in range(0, len(patient_inputs), chunk_size):
+                chunk = patient_inputs[offset:offset + chunk_size]
+                patient_input_objs = [self._parse_patient_input(p) for p in chunk]
+                prescriptions = await self.model_manager.generate_prescription_batch(patient_input_objs)
+                
+                results = []
+                for index, (patient_input, patient_input_obj, prescription_obj) in enumerate(
+                        zip(chunk, patient_input_objs, prescriptions), start=offset):
+                    record = self._record_prescription(
+                        patient_input_obj, prescription_obj, patient_input.get('name', 'Unknown Patient'),
+                        f'rx_{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}_{index}'
+                    )
+                    results.append({'index': index, 'prescription_id': record['prescription_id'],
+                                    'prescription': record['prescription']})
+                
+                await self.send_message(websocket, data, {
+                    'type': 'prescription_batch_chunk',
+                    'status': 'success',
+                    'results': results
+                })
+            
+            await self.send_message(websocket, data, {
+                'type': 'prescription_batch_complete',
                 'status': 'success',
-                'message': 'Prescription generated successfully'
-            }
+                'count': len(patient_inputs),
+                'message': 'Prescription batch generated successfully'
+            })
+            logger.info(f"Prescription batch of {len(patient_inputs)} generated")
             
-            await websocket.send(json.dumps(response))
-            logger.info(f"Prescription generated for {patient_name}")
+        except Exception as e:
+            logger.error(f"Error generating prescription batch: {e}")
+            await self.send_error(websocket, f"Error generating prescription batch: {e}", data)
+    
+    async def handle_voice_prescription(self, websocket, data):
+        """Handle audio-in prescription requests through the voice pipeline, with per-stage timings"""
+        try:
+            if self.voice_pipeline is None:
+                raise RuntimeError("Voice pipeline is not enabled on this server")
+            audio_path = data['audio_path']
+            hints = data.get('patient_input') or {}
+            logger.info(f"Processing voice prescription request for {audio_path}")
+            
+            result = await self.voice_pipeline.submit(audio_path, hints)
+            response = self._record_prescription(
+                result['patient_input'], result['prescription'], hints.get('name', 'Unknown Patient'),
+                f'rx_{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}'
+            )
+            response['transcription'] = result['transcription']['text']
+            response['patient_input'] = result['patient_input'].to_dict()
+            response['timings'] = result['timings']
+            await self.send_message(websocket, data, response)
+            logger.info(f"Voice prescription generated ({result['timings']['total_ms']}ms)")
             
         except Exception as e:
-            logger.error(f"Error generating prescription: {e}")
-            await self.send_error(websocket, f"Error generating prescription: {e}")
+            logger.error(f"Error generating voice prescription: {e}")
+            await self.send_error(websocket, f"Error generating voice prescription: {e}", data)
     
     async def handle_doctor_feedback(self, websocket, data):
         """Handle doctor feedback"""
@@ -132,6 +298,15 @@ class MCPMedicalServer:
             
             logger.info(f"Processing doctor feedback from {doctor_id} for prescription {prescription_id}")
             
+            feedback = DoctorFeedback(
+                original_prescription=data.get('original_prescription') or [],
+                modified_prescription=data.get('modified_prescription') or [],
+                feedback_notes=feedback_notes or '',
+                doctor_id=doctor_id or 'unknown',
+                patient_input=self._parse_patient_input(data.get('patient_input') or {})
+            )
+            self.async_database.persist_in_background(self._persist_feedback(prescription_id, feedback))
+            
             response = {
                 'type': 'feedback_saved',
                 'prescription_id': prescription_id,
@@ -140,36 +315,119 @@ class MCPMedicalServer:
                 'feedback_id': f'fb_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
             }
             
-            await websocket.send(json.dumps(response))
+            await self.send_message(websocket, data, response)
             logger.info(f"Doctor feedback processed for prescription {prescription_id}")
             
         except Exception as e:
             logger.error(f"Error saving feedback: {e}")
-            await self.send_error(websocket, f"Error saving feedback: {e}")
+            await self.send_error(websocket, f"Error saving feedback: {e}", data)
+    
+    def _remember_prescription(self, prescription_id: str, record_task: asyncio.Task):
+        """Keep recent save tasks so feedback can be linked to the stored prescription"""
+        self._prescription_records[prescription_id] = record_task
+        while len(self._prescription_records) > self._max_prescription_records:
+            self._prescription_records.popitem(last=False)
+    
+    async def _persist_feedback(self, prescription_id, feedback: DoctorFeedback):
+        """Save feedback once the prescription it refers to has been stored"""
+        record_task = self._prescription_records.get(prescription_id)
+        if record_task is not None:
+            _, db_prescription_id = await record_task
+        elif str(prescription_id).isdigit():
+            db_prescription_id = int(prescription_id)
+        else:
+            db_prescription_id = None
+        return await self.async_database.save_doctor_feedback(feedback, db_prescription_id)
     
     async def handle_model_update(self, websocket, data):
-        """Handle model update requests"""
+        """Handle model update requests: start a background fine-tuning job (mock mode updates in place)"""
         try:
             logger.info("Processing model update request")
             
-            response = {
-                'type': 'model_updated',
-                'new_version': '1.0.1',
-                'feedback_samples_used': 0,
-                'status': 'success',
-                'message': 'Model updated successfully',
-                'updated_at': datetime.now().isoformat()
-            }
+            if self.model_manager.use_mock:
+                feedback = await self.async_database.get_feedback_for_training()
+                new_version = await self.model_manager.update_model_with_feedback(feedback)
+                response = {
+                    'type': 'model_updated',
+                    'new_version': new_version,
+                    'feedback_samples_used': len(feedback),
+                    'status': 'success',
+                    'message': 'Model updated successfully',
+                    'updated_at': datetime.now().isoformat()
+                }
+            else:
+                # Training runs in its own process; progress is polled with model_update_status
+                # With 'swap' (default) the trained version replaces the serving one when the job completes
+                job = self.model_manager.start_fine_tune(self.database.db_path, swap=data.get('swap', True),
+                                                         options=data.get('options'))
+                response = {
+                    'type': 'model_update_started',
+                    'job': job.get_status(),
+                    'status': 'success',
+                    'message': 'Fine-tuning started'
+                }
             
-            await websocket.send(json.dumps(response))
+            await self.send_message(websocket, data, response)
             logger.info("Model update processed")
             
         except Exception as e:
             logger.error(f"Error updating model: {e}")
-            await self.send_error(websocket, f"Error updating model: {e}")
+            await self.send_error(websocket, f"Error updating model: {e}", data)
+    
+    async def handle_model_swap(self, websocket, data):
+        """Handle hot-swap requests: serve another version without dropping connected clients"""
+        try:
+            version = validate_version(data.get('version'))
+            swap = await self.model_manager.hot_swap(version, data.get('source', 'adapter'))
+            await self.send_message(websocket, data, {
+                'type': 'model_swapped',
+                'status': 'success',
+                'swap': swap,
+                'current_version': self.model_manager.current_version,
+                'message': f"Now serving version {self.model_manager.current_version}"
+            })
+            
+        except Exception as e:
+            logger.error(f"Error swapping model: {e}")
+            await self.send_error(websocket, f"Error swapping model: {e}", data)
+    
+    async def handle_model_update_status(self, websocket, data):
+        """Handle fine-tuning progress queries"""
+        job = self.model_manager.fine_tune_job
+        await self.send_message(websocket, data, {
+            'type': 'model_update_status',
+            'status': 'success',
+            'job': job.get_status() if job else None,
+            'current_version': self.model_manager.current_version
+        })
+    
+    async def handle_model_info(self, websocket, data):
+        """Handle model info requests (batching, executor and replica stats)"""
+        try:
+            response = {
+                'type': 'model_info',
+                'status': 'success',
+                'model_info': self.model_manager.get_model_info(),
+                'database': self.async_database.get_stats(),
+                'voice_pipeline': self.voice_pipeline.get_stats() if self.voice_pipeline else None,
+                'timestamp': datetime.now().isoformat()
+            }
+            await self.send_message(websocket, data, response)
+            
+        except Exception as e:
+            logger.error(f"Error getting model info: {e}")
+            await self.send_error(websocket, f"Error getting model info: {e}", data)
+    
+    async def shutdown(self):
+        """Flush pending writes and release model workers"""
+        if self.voice_pipeline is not None:
+            await self.voice_pipeline.close()
+        await self.async_database.close()
+        await self.model_manager.close()
+        logger.info("Server resources released")
     
-    async def send_error(self, websocket, error_message: str):
-        """Send error response to client"""
+    async def send_error(self, websocket, error_message: str, data: dict = None):
+        """Send error response to client, tagged like any other reply to data"""
         try:
             response = {
                 'type': 'error',
@@ -177,7 +435,7 @@ class MCPMedicalServer:
                 'status': 'error',
                 'timestamp': datetime.now().isoformat()
             }
-            await websocket.send(json.dumps(response))
+            await self.send_message(websocket, data or {}, response)
         except Exception as e:
             logger.error(f"Failed to send error message: {e}")
 
@@ -185,7 +443,15 @@ class MCPMedicalServer:
 # Main function to run the server
 async def main():
     logging.basicConfig(level=logging.INFO)
-    server = MCPMedicalServer()
+    server = MCPMedicalServer(
+        replicas=int(os.getenv('MCP_MODEL_REPLICAS', '0')),
+        load_mode=os.getenv('MCP_MODEL_LOAD_MODE', 'adapter'),
+        ping_interval=float(os.getenv('MCP_PING_INTERVAL', '20')) or None,
+        ping_timeout=float(os.getenv('MCP_PING_TIMEOUT', '20')) or None,
+        voice_pipeline=os.getenv('MCP_VOICE_PIPELINE', '0') == '1',
+        whisper_model=os.getenv('WHISPER_MODEL', 'base'),
+        transcription_workers=int(os.getenv('TRANSCRIPTION_WORKERS', '1'))
+    )
     
     try:
         websocket_server = await server.start_server()
@@ -196,6 +462,8 @@ async def main():
         
     except Exception as e:
         logger.error(f"Failed to start server: {e}")
+    finally:
+        await server.shutdown()
 
 if __name__ == "__main__":
     try:
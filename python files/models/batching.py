@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Groups concurrent requests into batches for a single batched call"""
+
+    def __init__(self, process_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+                 max_batch_size: int = 8, max_wait_ms: float = 10.0, max_queue_size: int = 256,
+                 max_concurrent_batches: int = 1):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        self.max_queue_size = max_queue_size
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = set()
+        # Items taken off the queue for the batch being collected, so close() can fail them
+        self._collecting: List[tuple] = []
+        self._closed = False
+
+        # Counters for get_stats()
+        self.batches_processed = 0
+        self.items_processed = 0
+        self.last_batch_size = 0
+        self.last_batch_latency_ms = 0.0
+        self._total_queue_wait_ms = 0.0
+
+    def _ensure_worker(self):
+        """Start the scheduler task on the running event loop"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        """Queue a single item and wait for its result from a batched call"""
+        if self._closed:
+            raise RuntimeError("Batcher closed")
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        if self._closed:
+            # Closed while this call waited for queue space; nothing will collect it now
+            self._fail_pending()
+        return await future
+
+    async def _collect_batch(self) -> List[tuple]:
+        """Wait for one item, then fill the batch until it is full or the wait expires"""
+        batch = self._collecting = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        # Pick up anything that is already waiting without extending the deadline
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        """Scheduler loop: collect a batch, run it, resolve each waiting future"""
+        while True:
+            # Only start collecting once a worker is free, so batches fill up under load
+            await self._slots.acquire()
+            try:
+                batch = await self._collect_batch()
+            except BaseException:
+                self._slots.release()
+                raise
+            self._collecting = []
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        self._slots.release()
+
+    async def _dispatch(self, batch: List[tuple]):
+        """Run one batch and hand each result back to its awaiting coroutine"""
+        items = [item for item, _, _ in batch]
+        started = time.perf_counter()
+        self._total_queue_wait_ms += sum((started - queued) * 1000.0 for _, _, queued in batch)
+
+        try:
+            results = await self.process_batch(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"Batch returned {len(results)} results for {len(items)} items")
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            logger.error(f"Error processing batch of {len(items)}: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.batches_processed += 1
+            self.items_processed += len(items)
+            self.last_batch_size = len(items)
+            self.last_batch_latency_ms = (time.perf_counter() - started) * 1000.0
+
+    def get_stats(self) -> Dict:
+        """Get batching configuration and throughput counters"""
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait_ms,
+            'max_queue_size': self.max_queue_size,
+            'max_concurrent_batches': self.max_concurrent_batches,
+            'batches_in_flight': len(self._in_flight),
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'batches_processed': self.batches_processed,
+            'items_processed': self.items_processed,
+            'avg_batch_size': self.items_processed / self.batches_processed if self.batches_processed else 0.0,
+            'last_batch_size': self.last_batch_size,
+            'last_batch_latency_ms': round(self.last_batch_latency_ms, 2),
+            'avg_queue_wait_ms': round(self._total_queue_wait_ms / self.items_processed, 2) if self.items_processed else 0.0
+        }
+
+    def _fail_pending(self):
+        """Fail the partly collected batch and everything still queued"""
+        pending, self._collecting = self._collecting, []
+        while self._queue and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future, _ in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher closed"))
+
+    async def close(self):
+        """Stop accepting items, let running batches finish and fail everything not yet dispatched"""
+        self._closed = True
+        if self._worker and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+        # Callers are not left waiting forever: collected and queued items fail, dispatched ones complete
+        self._fail_pending()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
@@ -0,0 +1,127 @@
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from ..data_models.data_models import PatientInput
+
+
+def canonicalize_patient_input(patient_input: PatientInput, age_bucket_size: int = 0) -> PatientInput:
+    """Normalize a patient input so near-identical requests map to the same cache key"""
+    symptoms = sorted({s.strip() for s in patient_input.symptoms.lower().split(',') if s.strip()})
+    age = patient_input.age
+    if age_bucket_size > 0:
+        age = (age // age_bucket_size) * age_bucket_size
+    return PatientInput(
+        symptoms=", ".join(re.sub(r"\s+", " ", s) for s in symptoms),
+        age=age,
+        gender=patient_input.gender.strip().lower(),
+        diagnosis=re.sub(r"\s+", " ", patient_input.diagnosis.strip().lower()),
+        timestamp=patient_input.timestamp
+    )
+
+
+class PrescriptionCache:
+    """LRU cache with per-entry TTL for generated prescriptions"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None on a miss or an expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any):
+        """Store a value, evicting the least recently used entry when full"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry (e.g. after the model version changes)"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def get_stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations
+        }
+
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one in-progress computation"""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn() for key, or wait for the run already in progress for it
+
+        The work runs as its own task and every caller (the first included) waits on it through
+        shield, so a caller that is cancelled (e.g. its client disconnected) only stops waiting;
+        the others still get the result.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.leaders += 1
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the outcome as retrieved even when every caller has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> Dict:
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'coalesced_requests': self.coalesced
+        }
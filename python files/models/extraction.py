@@ -0,0 +1,156 @@
+import logging
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "drug_lexicon.txt")
+
+# Names and texts are compared as lowercase alphanumeric words, so "B-Complex" matches "b complex"
+WORD_RE = re.compile(r"[a-z0-9]+")
+_END = ""
+
+
+def load_lexicon(path: str = DEFAULT_LEXICON_PATH) -> List[str]:
+    """Drug names from a lexicon file: one per line, blank lines and '#' comments ignored"""
+    names = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            name = line.strip()
+            if name and not name.startswith("#"):
+                names.append(name)
+    return names
+
+
+class MedicationExtractor:
+    """Trie of lexicon names over word tokens; one left-to-right pass finds every (multi-word) name"""
+
+    def __init__(self, names: Iterable[str]):
+        # Canonical spelling per tokenized name; the first occurrence in the lexicon wins
+        self.names: List[str] = []
+        self._trie: Dict = {}
+        for name in names:
+            words = tuple(WORD_RE.findall(name.lower()))
+            if not words:
+                continue
+            node = self._trie
+            for word in words:
+                node = node.setdefault(word, {})
+            if _END not in node:
+                node[_END] = len(self.names)
+                self.names.append(name.strip())
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_LEXICON_PATH) -> "MedicationExtractor":
+        extractor = cls(load_lexicon(path))
+        logger.info(f"Loaded {len(extractor.names)} drug names from {path}")
+        return extractor
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """Non-overlapping (start, end, name) matches on word boundaries, longest match first"""
+        tokens = list(WORD_RE.finditer(text.lower()))
+        words = [token.group() for token in tokens]
+        trie = self._trie
+        matches = []
+        i, count = 0, len(words)
+        while i < count:
+            node = trie.get(words[i])
+            if node is None:
+                i += 1
+                continue
+            # Walk forward while the words still spell a lexicon prefix, remembering the longest full name
+            best_end, best_index = (i + 1, node[_END]) if _END in node else (None, None)
+            j = i + 1
+            while j < count:
+                node = node.get(words[j])
+                if node is None:
+                    break
+                j += 1
+                if _END in node:
+                    best_end, best_index = j, node[_END]
+            if best_end is None:
+                i += 1
+                continue
+            matches.append((tokens[i].start(), tokens[best_end - 1].end(), self.names[best_index]))
+            i = best_end
+        return matches
+
+    def extract(self, text: str) -> List[str]:
+        """Distinct medication names in order of first appearance"""
+        return list(dict.fromkeys(name for _, _, name in self.find(text)))
+
+    def extract_many(self, texts: Iterable[str]) -> List[List[str]]:
+        """extract() for a batch of generated texts"""
+        extract = self.extract
+        return [extract(text) for text in texts]
+
+
+_default_extractor: Optional[MedicationExtractor] = None
+
+
+def default_extractor() -> MedicationExtractor:
+    """Process-wide extractor for the bundled lexicon, built on first use"""
+    global _default_extractor
+    if _default_extractor is None:
+        _default_extractor = MedicationExtractor.from_file()
+    return _default_extractor
+
+
+def legacy_extract_medications(generated_text: str) -> List[str]:
+    """The previous word-scanning extractor, kept as the benchmark baseline"""
+    medications = []
+    medication_keywords = ['prescribe', 'medication', 'drug', 'treatment', 'therapy']
+    for line in generated_text.split('\n'):
+        line_lower = line.lower()
+        if any(keyword in line_lower for keyword in medication_keywords):
+            for word in line.split():
+                if (word.istitle() and len(word) > 3 and
+                        not word.lower() in ['the', 'and', 'for', 'with', 'patient']):
+                    medications.append(word)
+    if not medications:
+        common_meds = ['Aspirin', 'Ibuprofen', 'Acetaminophen', 'Lisinopril', 'Metformin', 'Amlodipine', 'Simvastatin']
+        for med in common_meds:
+            if med.lower() in generated_text.lower():
+                medications.append(med)
+    return medications if medications else ['Generated Medication']
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Micro-benchmark the lexicon extractor against the legacy scanner")
+    parser.add_argument("--texts", type=int, default=10000)
+    parser.add_argument("--lexicon", default=DEFAULT_LEXICON_PATH)
+    args = parser.parse_args()
+
+    extractor = MedicationExtractor.from_file(args.lexicon)
+    rng = random.Random(0)
+    filler = ("symptoms:back pain, fatigue, age:45, gender:female, diagnosis:hypertension. "
+              "The patient was assessed and the recommended treatment plan is").split()
+    texts = []
+    for _ in range(args.texts):
+        words = filler + rng.sample(extractor.names, 3) + rng.sample(filler, 10)
+        texts.append(" ".join(words) + "\nFollow up in two weeks.")
+
+    started = time.perf_counter()
+    legacy = [legacy_extract_medications(text) for text in texts]
+    legacy_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for text in texts:
+        [name for name in extractor.names if name.lower() in text.lower()]
+    scan_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    extracted = extractor.extract_many(texts)
+    lexicon_s = time.perf_counter() - started
+
+    found = sum(len(meds) for meds in extracted)
+    print(f"legacy:  {legacy_s * 1e6 / len(texts):.1f} us/text (7 common names only)")
+    print(f"scan:    {scan_s * 1e6 / len(texts):.1f} us/text (legacy fallback over the full lexicon)")
+    print(f"lexicon: {lexicon_s * 1e6 / len(texts):.1f} us/text ({found} names found in {len(texts)} texts)")
@@ -0,0 +1,349 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import shutil
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+import torch.multiprocessing as torch_mp
+
+from ..Database.database_manager import MedicalDatabase, TrainingRecord
+from .inference import BASE_MODEL_NAME, _auth_kwargs, configure_torch_threads, format_patient_prompt
+from .paths import VERSION_RE, contained_path, replace_directory, safe_model_name, validate_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADAPTER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "adapters")
+MANIFEST_FILE = "manifest.json"
+TRAINER_STATE_FILE = "trainer_state.json"
+OPTIMIZER_FILE = "optimizer.pt"
+# Label value the causal LM loss ignores; used for prompt and padding positions
+IGNORE_INDEX = -100
+TERMINAL_STATES = ("completed", "failed", "cancelled")
+# fine_tune() hyperparameters a caller (e.g. a websocket client) may set: name -> (type, min, max)
+TRAINING_OPTIONS = {
+    'batch_size': (int, 1, 64),
+    'accumulation_steps': (int, 1, 256),
+    'learning_rate': (float, 1e-7, 1e-2),
+    'max_length': (int, 16, 1024),
+    'chunk_size': (int, 1, 10000),
+    'checkpoint_every': (int, 0, 100000),
+    'max_records': (int, 0, 10 ** 9)
+}
+
+
+def adapter_path(model_name: str, version: str, adapter_dir: str = DEFAULT_ADAPTER_DIR) -> str:
+    """Directory of the fine-tuned LoRA adapter for a model name and version (always inside adapter_dir)"""
+    return contained_path(adapter_dir, safe_model_name(model_name), validate_version(version))
+
+
+def latest_adapter(model_name: str, adapter_dir: str = DEFAULT_ADAPTER_DIR) -> Optional[Dict]:
+    """Manifest of the most recent fine-tuned adapter for model_name, if there is one"""
+    model_dir = contained_path(adapter_dir, safe_model_name(model_name))
+    if not os.path.isdir(model_dir):
+        return None
+    manifests = []
+    for version in os.listdir(model_dir):
+        if not VERSION_RE.match(version):
+            continue  # .tmp/.old directories of a save in progress
+        manifest_path = os.path.join(model_dir, version, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifests.append(json.load(f))
+    return max(manifests, key=lambda m: m['created_at']) if manifests else None
+
+
+def validate_training_options(options: Optional[Dict]) -> Dict:
+    """Checked copy of user-supplied hyperparameters; unknown keys, wrong types and out-of-range values raise"""
+    validated = {}
+    for name, value in (options or {}).items():
+        if name not in TRAINING_OPTIONS:
+            raise ValueError(f"Unknown training option: {name} (allowed: {', '.join(TRAINING_OPTIONS)})")
+        kind, low, high = TRAINING_OPTIONS[name]
+        # bool is an int subclass; ints are accepted where a float is expected
+        allowed = (int, float) if kind is float else (int,)
+        if isinstance(value, bool) or not isinstance(value, allowed):
+            raise ValueError(f"Training option {name} must be {kind.__name__}, got {type(value).__name__}")
+        if not low <= value <= high:
+            raise ValueError(f"Training option {name} must be between {low} and {high}, got {value}")
+        validated[name] = kind(value)
+    return validated
+
+
+def training_example(record: TrainingRecord) -> Tuple[str, str]:
+    """(prompt, target) pair: the doctor's modified prescription is what the model should have produced"""
+    prompt = format_patient_prompt(record.symptoms, record.age, record.gender, record.diagnosis)
+    return prompt, " prescription: " + ", ".join(record.modified_prescription)
+
+
+def encode_batch(tokenizer, examples: List[Tuple[str, str]], max_length: int) -> Dict[str, torch.Tensor]:
+    """Right-padded input ids with the loss restricted to the target tokens"""
+    rows = []
+    for prompt, target in examples:
+        prompt_ids = tokenizer(prompt)['input_ids']
+        target_ids = tokenizer(target, add_special_tokens=False)['input_ids'] + [tokenizer.eos_token_id]
+        input_ids = (prompt_ids + target_ids)[:max_length]
+        labels = ([IGNORE_INDEX] * len(prompt_ids) + target_ids)[:max_length]
+        rows.append((input_ids, labels))
+
+    width = max(len(input_ids) for input_ids, _ in rows)
+    batch = {
+        'input_ids': torch.full((len(rows), width), tokenizer.pad_token_id, dtype=torch.long),
+        'attention_mask': torch.zeros((len(rows), width), dtype=torch.long),
+        'labels': torch.full((len(rows), width), IGNORE_INDEX, dtype=torch.long)
+    }
+    for i, (input_ids, labels) in enumerate(rows):
+        batch['input_ids'][i, :len(input_ids)] = torch.tensor(input_ids)
+        batch['attention_mask'][i, :len(input_ids)] = 1
+        batch['labels'][i, :len(labels)] = torch.tensor(labels)
+    return batch
+
+
+def load_trainable_biogpt(model_name: str, hf_token: str = "", adapter: Optional[str] = None) -> Tuple:
+    """BioGPT base model with a trainable LoRA adapter: a local checkpoint/adapter directory, or model_name"""
+    from peft import PeftModel
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    if hf_token:
+        from huggingface_hub import login
+        login(token=hf_token)
+    tokenizer = AutoTokenizer.from_pretrained(model_name, **_auth_kwargs(hf_token))
+    base_model = AutoModelForCausalLM.from_pretrained(BASE_MODEL_NAME, **_auth_kwargs(hf_token))
+    if adapter is not None:
+        model = PeftModel.from_pretrained(base_model, adapter, is_trainable=True)
+    else:
+        model = PeftModel.from_pretrained(base_model, model_name, is_trainable=True, **_auth_kwargs(hf_token))
+    # Only the adapter weights train; the base model stays frozen
+    for name, parameter in model.named_parameters():
+        parameter.requires_grad = 'lora_' in name
+    model.train()
+    return tokenizer, model
+
+
+def _save_checkpoint(model, optimizer, state: Dict, path: str):
+    """Adapter, optimizer and trainer state, swapped into place so a crash never leaves a partial one"""
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    model.save_pretrained(tmp_path)
+    torch.save(optimizer.state_dict(), os.path.join(tmp_path, OPTIMIZER_FILE))
+    with open(os.path.join(tmp_path, TRAINER_STATE_FILE), 'w') as f:
+        json.dump(state, f)
+    replace_directory(tmp_path, path)
+
+
+def fine_tune(db_path: str, model_name: str, version: str, hf_token: str = "",
+              adapter_dir: str = DEFAULT_ADAPTER_DIR, batch_size: int = 4, accumulation_steps: int = 8,
+              learning_rate: float = 1e-4, max_length: int = 128, chunk_size: int = 256,
+              checkpoint_every: int = 50, max_records: int = 0,
+              report: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """Incrementally fine-tune the LoRA adapter on doctor feedback and record the new model version
+
+    Training starts from the latest fine-tuned adapter and only reads feedback added after the
+    records it was trained on (by id, so rows committed late by the write-behind buffer are still
+    picked up; see MedicalDatabase.get_feedback_page), streamed from the database one chunk at a time. Memory is bounded
+    by batch_size x max_length, with gradients accumulated over accumulation_steps micro-batches.
+    A checkpoint is written every checkpoint_every optimizer steps; rerunning the same version
+    resumes from it. A version that already has an adapter is never trained (or overwritten) again.
+    """
+    report = report or (lambda update: None)
+    output_path = adapter_path(model_name, version, adapter_dir)
+    checkpoint_path = output_path + ".ckpt"
+    if os.path.exists(output_path):
+        raise FileExistsError(f"An adapter for {model_name}@{version} already exists at {output_path}")
+    parent = latest_adapter(model_name, adapter_dir)
+
+    state = {'step': 0, 'records': 0, 'loss': None, 'last_key': parent['last_key'] if parent else None}
+    start_adapter = adapter_path(model_name, parent['version'], adapter_dir) if parent else None
+    if os.path.exists(os.path.join(checkpoint_path, TRAINER_STATE_FILE)):
+        with open(os.path.join(checkpoint_path, TRAINER_STATE_FILE)) as f:
+            state = json.load(f)
+        start_adapter = checkpoint_path
+        logger.info(f"Resuming fine-tune of {version} from step {state['step']}")
+
+    report({'state': 'loading', 'version': version, 'parent_version': parent['version'] if parent else None})
+    tokenizer, model = load_trainable_biogpt(model_name, hf_token, start_adapter)
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=learning_rate)
+    if start_adapter == checkpoint_path and os.path.exists(os.path.join(checkpoint_path, OPTIMIZER_FILE)):
+        optimizer.load_state_dict(torch.load(os.path.join(checkpoint_path, OPTIMIZER_FILE)))
+
+    database = MedicalDatabase(db_path, pooled=False)
+    # Cursors written before paging moved to ids were (timestamp, id) pairs
+    if isinstance(state['last_key'], list):
+        state['last_key'] = state['last_key'][-1]
+    after = state['last_key']
+    micro_batch: List[Tuple[Tuple[str, str], int]] = []
+    accumulated = 0
+    started = time.perf_counter()
+
+    def optimizer_step():
+        nonlocal accumulated
+        torch.nn.utils.clip_grad_norm_([p for p in model.parameters() if p.requires_grad], 1.0)
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+        accumulated = 0
+        state['step'] += 1
+        if checkpoint_every and state['step'] % checkpoint_every == 0:
+            _save_checkpoint(model, optimizer, state, checkpoint_path)
+        report({'state': 'training', 'step': state['step'], 'records': state['records'], 'loss': state['loss'],
+                'records_per_s': round(state['records'] / max(time.perf_counter() - started, 1e-9), 2)})
+
+    def train_micro_batch():
+        nonlocal accumulated
+        batch = encode_batch(tokenizer, [example for example, _ in micro_batch], max_length)
+        loss = model(**batch).loss
+        (loss / accumulation_steps).backward()
+        accumulated += 1
+        state['records'] += len(micro_batch)
+        # The cursor only moves past records whose gradients are in the next optimizer step
+        state['last_key'] = micro_batch[-1][1]
+        state['loss'] = round(loss.item() if state['loss'] is None else 0.9 * state['loss'] + 0.1 * loss.item(), 4)
+        micro_batch.clear()
+        if accumulated == accumulation_steps:
+            optimizer_step()
+
+    report({'state': 'training', 'step': state['step'], 'records': state['records'], 'loss': state['loss']})
+    for record in database.iter_feedback_for_training(chunk_size, after):
+        micro_batch.append((training_example(record), record.key))
+        if len(micro_batch) == batch_size:
+            train_micro_batch()
+        if max_records and state['records'] >= max_records:
+            break
+    if micro_batch:
+        train_micro_batch()
+    if accumulated:
+        optimizer_step()
+
+    if state['records'] == 0:
+        database.close()
+        shutil.rmtree(checkpoint_path, ignore_errors=True)
+        logger.info("No new feedback since the last fine-tune; nothing to train")
+        return {'state': 'completed', 'version': None, 'records': 0, 'message': 'No new feedback to train on'}
+
+    report({'state': 'saving', 'step': state['step'], 'records': state['records'], 'loss': state['loss']})
+    tmp_path = output_path + ".tmp"
+    model.save_pretrained(tmp_path)
+    manifest = {
+        'model_name': model_name,
+        'version': version,
+        'parent_version': parent['version'] if parent else None,
+        'path': output_path,
+        'records': state['records'],
+        'total_records': state['records'] + (parent['total_records'] if parent else 0),
+        'steps': state['step'],
+        'loss': state['loss'],
+        'last_key': state['last_key'],
+        'created_at': datetime.now().isoformat()
+    }
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, output_path)
+    shutil.rmtree(checkpoint_path, ignore_errors=True)
+
+    database.save_model_version(version, manifest['total_records'], state['records'])
+    database.close()
+    logger.info(f"Fine-tuned {model_name}@{version} on {state['records']} feedback records "
+                f"({state['step']} steps, loss {state['loss']})")
+    return {'state': 'completed', 'version': version, 'adapter_path': output_path, 'records': state['records'],
+            'steps': state['step'], 'loss': state['loss']}
+
+
+def run_fine_tune_process(options: Dict, updates):
+    """Process entry point: low priority, few torch threads, progress reported through the updates queue"""
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+    configure_torch_threads(options.pop('torch_threads', 1))
+    try:
+        updates.put(fine_tune(report=updates.put, **options))
+    except Exception as e:
+        logger.error(f"Fine-tuning failed: {e}")
+        updates.put({'state': 'failed', 'error': str(e)})
+
+
+class FineTuneJob:
+    """A fine_tune() run in a separate process, so training never competes with serving on the event loop"""
+
+    def __init__(self, options: Dict):
+        self.options = options
+        self.job_id = f'ft_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+        self.status: Dict = {'job_id': self.job_id, 'state': 'pending', 'version': options.get('version')}
+        self._process = None
+        self._updates = None
+        self._watcher: Optional[asyncio.Task] = None
+        self._started = None
+
+    def start(self):
+        context = torch_mp.get_context("spawn")
+        self._updates = context.Queue()
+        self._process = context.Process(target=run_fine_tune_process, args=(dict(self.options), self._updates),
+                                        daemon=True)
+        self._process.start()
+        self._started = time.perf_counter()
+        self.status.update({'state': 'starting', 'pid': self._process.pid, 'started_at': datetime.now().isoformat()})
+        self._watcher = asyncio.create_task(self._watch())
+        logger.info(f"Fine-tuning job {self.job_id} started (pid {self._process.pid})")
+
+    async def _watch(self) -> Dict:
+        """Fold progress updates from the training process into status until it finishes"""
+        loop = asyncio.get_running_loop()
+        while self.status['state'] not in TERMINAL_STATES:
+            try:
+                update = await loop.run_in_executor(None, self._updates.get, True, 1.0)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    self.status.update({'state': 'failed',
+                                        'error': f"Training process exited with code {self._process.exitcode}"})
+                continue
+            self.status.update(update)
+        await loop.run_in_executor(None, self._process.join)
+        logger.info(f"Fine-tuning job {self.job_id} {self.status['state']}")
+        return self.get_status()
+
+    @property
+    def running(self) -> bool:
+        return self.status['state'] not in TERMINAL_STATES
+
+    def get_status(self) -> Dict:
+        status = dict(self.status)
+        if self._started is not None:
+            status['elapsed_s'] = round(time.perf_counter() - self._started, 1)
+        return status
+
+    async def wait(self) -> Dict:
+        return await self._watcher
+
+    async def cancel(self):
+        if self._process is not None and self._process.is_alive():
+            self._process.terminate()
+            await asyncio.get_running_loop().run_in_executor(None, self._process.join)
+        self.status['state'] = 'cancelled'
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Fine-tune the LoRA adapter on new doctor feedback")
+    parser.add_argument("version", help="Version to record for the fine-tuned adapter, e.g. 1.1")
+    parser.add_argument("--db-path", default="medical_mcp.db")
+    parser.add_argument("--model-name", default="santanukumar07/biogpt-finetune")
+    parser.add_argument("--adapter-dir", default=DEFAULT_ADAPTER_DIR)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--accumulation-steps", type=int, default=8)
+    parser.add_argument("--learning-rate", type=float, default=1e-4)
+    parser.add_argument("--max-records", type=int, default=0)
+    args = parser.parse_args()
+
+    result = fine_tune(args.db_path, args.model_name, args.version, os.getenv('HUGGINGFACE_TOKEN', ''),
+                       args.adapter_dir, args.batch_size, args.accumulation_steps, args.learning_rate,
+                       max_records=args.max_records, report=lambda update: print(json.dumps(update)))
+    print(json.dumps(result))
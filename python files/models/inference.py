@@ -0,0 +1,291 @@
+import logging
+import os
+import multiprocessing
+import weakref
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import torch
+
+from ..utils import PhaseTimer
+from .extraction import default_extractor
+
+logger = logging.getLogger(__name__)
+
+BASE_MODEL_NAME = "microsoft/biogpt"
+
+# Per-process model replica used by process pool workers
+_worker_state = {}
+
+# Lexicon token sequences per tokenizer, built once; entries go away with their tokenizer
+_medication_token_sequences = weakref.WeakKeyDictionary()
+
+
+def resolve_torch_threads(workers: int, torch_threads: int = 0) -> int:
+    """Intra-op threads per worker so that workers x threads matches the core count"""
+    if torch_threads > 0:
+        return torch_threads
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def configure_torch_threads(torch_threads: int):
+    """Set torch intra-op threads for the current process"""
+    torch.set_num_threads(torch_threads)
+    logger.info(f"Torch intra-op threads set to {torch_threads}")
+
+
+def _auth_kwargs(hf_token: str) -> dict:
+    return {'use_auth_token': True if hf_token or os.getenv('HUGGINGFACE_TOKEN') else None}
+
+
+def format_patient_prompt(symptoms: str, age: int, gender: str, diagnosis: str) -> str:
+    """Prompt text for one patient; shared by inference and fine-tuning so both see the same format"""
+    return f"symptoms:{symptoms}, age:{age}, gender:{gender}, diagnosis:{diagnosis}"
+
+
+def load_biogpt(model_name: str, hf_token: str = "", device: Optional[torch.device] = None,
+                timer: Optional[PhaseTimer] = None, adapter: str = "") -> Tuple:
+    """Load tokenizer and BioGPT base model with the LoRA adapter applied
+
+    adapter is a local fine-tuned adapter directory (models/finetune.py) used instead of model_name's.
+    """
+    from huggingface_hub import login
+    from peft import PeftModel
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    timer = timer or PhaseTimer()
+    with timer.phase('hf_login'):
+        if hf_token:
+            logger.info("Authenticating with Hugging Face...")
+            login(token=hf_token)
+        elif os.getenv('HUGGINGFACE_TOKEN'):
+            logger.info("Using HF token from environment...")
+            login(token=os.getenv('HUGGINGFACE_TOKEN'))
+
+    logger.info(f"Loading BioGPT model: {model_name}")
+    with timer.phase('tokenizer'):
+        tokenizer = AutoTokenizer.from_pretrained(model_name, **_auth_kwargs(hf_token))
+    with timer.phase('base_model'):
+        base_model = AutoModelForCausalLM.from_pretrained(BASE_MODEL_NAME, **_auth_kwargs(hf_token))
+    with timer.phase('peft_wrap'):
+        if adapter:
+            model = PeftModel.from_pretrained(base_model, adapter)
+        else:
+            model = PeftModel.from_pretrained(base_model, model_name, **_auth_kwargs(hf_token))
+
+    # Decoder-only models must be left padded for batched generation
+    tokenizer.padding_side = "left"
+    with timer.phase('to_device'):
+        model.to(device or torch.device('cpu'))
+        model.eval()  # Set to evaluation mode
+    return tokenizer, model
+
+
+def load_for_inference(model_name: str, hf_token: str = "", device: Optional[torch.device] = None,
+                       load_mode: str = "adapter", quantization: str = "none", cache_dir: str = "",
+                       snapshot_dir: str = "", version: str = "1.0", timer: Optional[PhaseTimer] = None,
+                       adapter: str = "") -> Tuple:
+    """Load the model in the requested mode: unmerged LoRA adapter, merged (optionally quantized) or snapshot"""
+    if load_mode == "snapshot":
+        from .snapshot import load_snapshot, DEFAULT_SNAPSHOT_DIR
+        return load_snapshot(model_name, version, snapshot_dir or DEFAULT_SNAPSHOT_DIR, device, quantization, timer)
+    if load_mode == "merged":
+        from .optimize import load_merged_biogpt, DEFAULT_CACHE_DIR
+        return load_merged_biogpt(model_name, hf_token, device, quantization, cache_dir or DEFAULT_CACHE_DIR,
+                                  version, adapter, timer)
+    return load_biogpt(model_name, hf_token, device, timer, adapter)
+
+
+def medication_token_sequences(tokenizer, names: Optional[Iterable[str]] = None) -> Dict[int, torch.Tensor]:
+    """Whole-name token sequences of the drug names (default: the extraction lexicon), grouped by
+    length into (count, length) tensors"""
+    if names is None and tokenizer in _medication_token_sequences:
+        return _medication_token_sequences[tokenizer]
+    sequences = set()
+    for name in names if names is not None else default_extractor().names:
+        # With and without a leading space, since BPE vocabularies mark word starts
+        for variant in (name, " " + name, name.lower(), " " + name.lower()):
+            ids = tuple(tokenizer(variant, add_special_tokens=False).input_ids)
+            if ids:
+                sequences.add(ids)
+    by_length = {}
+    for ids in sorted(sequences):
+        by_length.setdefault(len(ids), []).append(ids)
+    grouped = {length: torch.tensor(group, dtype=torch.long) for length, group in by_length.items()}
+    if names is None:
+        _medication_token_sequences[tokenizer] = grouped
+    return grouped
+
+
+def medication_token_mask(generated: torch.Tensor, sequences: Dict[int, torch.Tensor]) -> torch.Tensor:
+    """True at every position covered by a complete drug-name token sequence
+
+    Matching whole sequences keeps subword pieces that drug names share with ordinary words
+    from counting on their own.
+    """
+    batch, steps = generated.shape
+    mask = torch.zeros_like(generated, dtype=torch.bool)
+    for length, patterns in sequences.items():
+        if length > steps:
+            continue
+        # (batch, windows, length) against (patterns, length) -> windows that equal some pattern
+        windows = generated.unfold(1, length, 1)
+        starts = (windows.unsqueeze(2) == patterns.to(generated.device)).all(-1).any(-1)
+        for offset in range(length):
+            mask[:, offset:offset + starts.shape[1]] |= starts
+    return mask
+
+
+def sequence_confidence(sequences: torch.Tensor, scores: Tuple[torch.Tensor, ...], prompt_length: int,
+                        eos_token_id: Optional[int], medication_sequences: Dict[int, torch.Tensor]) -> List[Dict]:
+    """Confidence from the per-step scores generate() already produced, for every row at once
+
+    scores[t] holds the (processed) logits that token t was sampled from, so the chosen tokens'
+    log-probabilities come from one log_softmax + gather over a (batch, steps, vocab) tensor.
+    """
+    generated = sequences[:, prompt_length:]
+    steps = torch.stack(scores, dim=1).float()
+    log_probs = torch.log_softmax(steps, dim=-1).gather(-1, generated.unsqueeze(-1)).squeeze(-1)
+
+    # Tokens after the first EOS are padding from rows that finished early
+    if eos_token_id is not None:
+        is_eos = generated == eos_token_id
+        valid = (torch.cumsum(is_eos.long(), dim=1) - is_eos.long()) == 0
+    else:
+        valid = torch.ones_like(generated, dtype=torch.bool)
+    valid &= torch.isfinite(log_probs)
+    log_probs = torch.where(valid, log_probs, torch.zeros_like(log_probs))
+    probs = torch.exp(log_probs) * valid
+
+    medication = valid & medication_token_mask(generated, medication_sequences)
+    valid_counts = valid.sum(dim=1)
+    medication_counts = medication.sum(dim=1)
+
+    sequence_logprob = log_probs.sum(dim=1)
+    mean_token_prob = probs.sum(dim=1) / valid_counts.clamp(min=1)
+    medication_prob = (probs * medication).sum(dim=1) / medication_counts.clamp(min=1)
+    # Rows without any medication token fall back to the mean over all generated tokens
+    confidence = torch.where(medication_counts > 0, medication_prob, mean_token_prob)
+
+    return [
+        {
+            'confidence': round(float(confidence[i]), 4),
+            'sequence_logprob': round(float(sequence_logprob[i]), 4),
+            'mean_token_prob': round(float(mean_token_prob[i]), 4),
+            'medication_tokens': int(medication_counts[i]),
+            'generated_tokens': int(valid_counts[i])
+        }
+        for i in range(generated.shape[0])
+    ]
+
+
+class TextDeltaStreamer:
+    """generate() streamer that reports newly decoded text as tokens are produced
+
+    Implements the put()/end() interface of transformers' BaseStreamer. on_text is called from
+    the generating thread, so callers on an event loop should hand it a thread-safe callback.
+    """
+
+    def __init__(self, tokenizer, on_text: Callable[[str], None]):
+        self.tokenizer = tokenizer
+        self.on_text = on_text
+        self._token_ids: List[int] = []
+        self._sent = ""
+        self._prompt_skipped = False
+
+    def put(self, value: torch.Tensor):
+        # The first call carries the prompt
+        if not self._prompt_skipped:
+            self._prompt_skipped = True
+            return
+        self._token_ids.extend(value.view(-1).tolist())
+        self._emit(final=False)
+
+    def end(self):
+        self._emit(final=True)
+
+    def _emit(self, final: bool):
+        text = self.tokenizer.decode(self._token_ids, skip_special_tokens=True)
+        # Hold back text that is still changing (an incomplete multi-byte character or a
+        # detokenizer rewrite of earlier words) until it settles or generation ends
+        if not text.startswith(self._sent) or (text.endswith("\ufffd") and not final):
+            return
+        delta = text[len(self._sent):]
+        if delta:
+            self._sent = text
+            self.on_text(delta)
+
+
+def run_generation(tokenizer, model, device, input_texts: List[str], max_new_tokens: int = 50,
+                   temperature: float = 0.7, streamer: Optional[TextDeltaStreamer] = None) -> List[Tuple[str, Dict]]:
+    """Tokenize, run one padded generate call and decode every row with its confidence (blocking)"""
+    inputs = tokenizer(input_texts, return_tensors="pt", padding=True).to(device)
+    pad_token_id = tokenizer.pad_token_id
+    if pad_token_id is None:
+        pad_token_id = tokenizer.eos_token_id
+
+    with torch.no_grad():
+        outputs = model.generate(
+            inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            do_sample=True,
+            pad_token_id=pad_token_id,
+            num_return_sequences=1,
+            output_scores=True,
+            return_dict_in_generate=True,
+            streamer=streamer
+        )
+        # Scored from the same generate pass; no second forward
+        confidences = sequence_confidence(outputs.sequences, outputs.scores, inputs.input_ids.shape[1],
+                                          tokenizer.eos_token_id, medication_token_sequences(tokenizer))
+
+    texts = tokenizer.batch_decode(outputs.sequences, skip_special_tokens=True)
+    return list(zip(texts, confidences))
+
+
+def stream_generation(tokenizer, model, device, input_text: str, on_text: Callable[[str], None],
+                      max_new_tokens: int = 50, temperature: float = 0.7) -> Tuple[str, Dict]:
+    """Generate for a single input, reporting decoded text deltas while it runs (blocking)"""
+    streamer = TextDeltaStreamer(tokenizer, on_text)
+    return run_generation(tokenizer, model, device, [input_text], max_new_tokens, temperature, streamer)[0]
+
+
+def _init_process_worker(model_name: str, hf_token: str, torch_threads: int, load_options: dict):
+    """Process pool initializer: load a private model replica once per worker"""
+    configure_torch_threads(torch_threads)
+    device = torch.device('cpu')
+    timer = PhaseTimer()
+    tokenizer, model = load_for_inference(model_name, hf_token, device, timer=timer, **load_options)
+    _worker_state.update(tokenizer=tokenizer, model=model, device=device)
+    logger.info(f"Inference worker {os.getpid()} ready ({timer.summary()})")
+
+
+def process_worker_ready() -> int:
+    """Return the worker pid once its replica is loaded"""
+    if 'model' not in _worker_state:
+        raise RuntimeError("Inference worker has no model loaded")
+    return os.getpid()
+
+
+def process_worker_generate(input_texts: List[str]) -> List[Tuple[str, Dict]]:
+    """Run generation on this worker's model replica"""
+    return run_generation(_worker_state['tokenizer'], _worker_state['model'],
+                          _worker_state['device'], input_texts)
+
+
+def create_inference_executor(executor_type: str, workers: int, torch_threads: int,
+                              model_name: str = "", hf_token: str = "", load_options: dict = None) -> Executor:
+    """Create the executor that runs blocking inference off the event loop"""
+    if executor_type == "thread":
+        configure_torch_threads(torch_threads)
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="biogpt-inference")
+    if executor_type == "process":
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process_worker,
+            initargs=(model_name, hf_token, torch_threads, load_options or {})
+        )
+    raise ValueError(f"Unknown executor type: {executor_type}")
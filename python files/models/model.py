@@ -1,15 +1,29 @@
 import asyncio
+import functools
+import gc
 import logging
 import torch
-from typing import List, Dict
+from datetime import datetime
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 import sys
 import os
-from huggingface_hub import login
-from peft import PeftModel
 
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 from ..data_models.data_models import PatientInput, Prescription
+from .batching import MicroBatcher
+from .inference import (create_inference_executor, resolve_torch_threads, load_for_inference,
+                        format_patient_prompt, run_generation, stream_generation, process_worker_ready,
+                        process_worker_generate)
+from .optimize import LOAD_MODES, QUANTIZATIONS, DEFAULT_CACHE_DIR, ensure_merged_model, run_parity_check
+from .replica_pool import ReplicaPoolExecutor
+from .snapshot import DEFAULT_SNAPSHOT_DIR, snapshot_exists, build_snapshot
+from .paths import validate_version
+from .finetune import DEFAULT_ADAPTER_DIR, FineTuneJob, adapter_path, latest_adapter, validate_training_options
+from .cache import PrescriptionCache, SingleFlight, canonicalize_patient_input
+from .extraction import default_extractor
+from .rules import default_rule_engine
+from ..utils import PhaseTimer
 
 try:
     from transformers import AutoTokenizer, AutoModelForCausalLM
@@ -20,10 +34,23 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Run through a newly loaded model before it takes traffic during a hot swap
+WARMUP_INPUTS = [
+    PatientInput(symptoms="back pain, fatigue", age=45, gender="female", diagnosis="hypertension"),
+    PatientInput(symptoms="cough, shortness of breath", age=8, gender="male", diagnosis="asthma"),
+    PatientInput(symptoms="headache, dizziness", age=72, gender="male", diagnosis="diabetes")
+]
+
 class BioGPTModelManager:
     """BioGPT model manager for prescription generation"""
     
-    def __init__(self, model_name: str = "santanukumar07/biogpt-finetune", use_mock: bool = False, hf_token: str = ""):
+    def __init__(self, model_name: str = "santanukumar07/biogpt-finetune", use_mock: bool = False, hf_token: str = "",
+                 max_batch_size: int = 8, max_batch_wait_ms: float = 10.0, max_queue_size: int = 256,
+                 executor_type: str = "thread", inference_workers: int = 1, torch_threads: int = 0,
+                 load_mode: str = "adapter", quantization: str = "none", optimized_cache_dir: str = DEFAULT_CACHE_DIR,
+                 verify_parity: bool = False, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+                 cache_max_entries: int = 1024, cache_ttl_seconds: float = 3600.0, cache_age_bucket: int = 0,
+                 mock_latency_s: float = 0.0, adapter_dir: str = DEFAULT_ADAPTER_DIR):
         self.model_name = model_name
         self.current_version = "1.0"
         self.tokenizer = None
@@ -32,6 +59,69 @@ class BioGPTModelManager:
         self.use_mock = use_mock or not TRANSFORMERS_AVAILABLE
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         
+        # Blocking tokenize/generate/decode runs on this executor, never on the event loop.
+        # "thread" shares one model; "process" gives every worker its own replica;
+        # "replicas" shares the base weights across worker processes via shared memory.
+        if executor_type not in ("thread", "process", "replicas"):
+            raise ValueError(f"executor_type must be 'thread', 'process' or 'replicas', got {executor_type}")
+        self.executor_type = executor_type
+        self.inference_workers = max(1, inference_workers)
+        self.torch_threads = resolve_torch_threads(self.inference_workers, torch_threads)
+        self.executor = None
+        
+        # "merged" folds the LoRA adapter into the base weights (cached on disk) and can
+        # additionally apply dynamic int8 quantization or bf16 weights. "snapshot" loads a
+        # versioned local snapshot (see models/snapshot.py) with no network calls.
+        if load_mode not in LOAD_MODES:
+            raise ValueError(f"load_mode must be one of {LOAD_MODES}, got {load_mode}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"quantization must be one of {QUANTIZATIONS}, got {quantization}")
+        if quantization != "none" and load_mode == "adapter":
+            raise ValueError("quantization requires load_mode='merged' or 'snapshot'")
+        self.load_mode = load_mode
+        self.quantization = quantization
+        self.optimized_cache_dir = optimized_cache_dir
+        self.verify_parity = verify_parity
+        self.parity_report = None
+        self.snapshot_dir = snapshot_dir
+        self.startup_timer = PhaseTimer()
+        
+        # Results for canonically identical inputs are served from an LRU/TTL cache.
+        # cache_age_bucket > 0 groups ages into bands of that many years for the key.
+        self.cache = PrescriptionCache(max_entries=cache_max_entries, ttl_seconds=cache_ttl_seconds)
+        self.cache_age_bucket = cache_age_bucket
+        # Concurrent requests with the same cache key share one generation
+        self.single_flight = SingleFlight()
+        # Drug lexicon trie, built once and shared by every extraction
+        self.extractor = default_extractor()
+        # Compiled rules for the mock/fallback path; mock_latency_s > 0 simulates model latency
+        self.rule_engine = default_rule_engine()
+        self.mock_latency_s = mock_latency_s
+        # Fine-tuned adapters land here; at most one training job runs at a time
+        self.adapter_dir = adapter_dir
+        self.fine_tune_job = None
+        # Local fine-tuned adapter being served ("" = model_name's own adapter); after a restart
+        # the server resumes on the most recently trained version rather than the base adapter
+        self.adapter = ""
+        latest = latest_adapter(self.model_name, self.adapter_dir)
+        if latest is not None:
+            self.current_version = latest['version']
+            self.adapter = adapter_path(self.model_name, latest['version'], self.adapter_dir)
+            logger.info(f"Resuming on fine-tuned version {self.current_version} ({self.adapter})")
+        # Hot-swap state
+        self._swap_lock = asyncio.Lock()
+        self._swap_task = None
+        self.last_swap = None
+        
+        # Concurrent real-inference requests are padded into one generate call
+        self.batcher = MicroBatcher(
+            self._generate_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_batch_wait_ms,
+            max_queue_size=max_queue_size,
+            max_concurrent_batches=self.inference_workers
+        )
+        
         logger.info(f"BioGPT Manager initialized - Mock mode: {self.use_mock}")
         logger.info(f"Using device: {self.device}")
     
@@ -42,55 +132,160 @@ class BioGPTModelManager:
             return
             
         try:
-            if self.hf_token:
-                logger.info("Authenticating with Hugging Face...")
-                login(token=self.hf_token)
-            elif os.getenv('HUGGINGFACE_TOKEN'):
-                logger.info("Using HF token from environment...")
-                login(token=os.getenv('HUGGINGFACE_TOKEN'))
+            loop = asyncio.get_running_loop()
+            timer = self.startup_timer
+            if self.load_mode == "merged":
+                with timer.phase('prepare_merged'):
+                    await self._prepare_merged_model(loop)
+            elif self.load_mode == "snapshot":
+                with timer.phase('prepare_snapshot'):
+                    await self._prepare_snapshot(loop)
             
-            logger.info(f"Loading BioGPT model: {self.model_name}")
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                self.model_name,
-                use_auth_token=True if self.hf_token or os.getenv('HUGGINGFACE_TOKEN') else None
-            )
-            base_model = AutoModelForCausalLM.from_pretrained(
-                    "microsoft/biogpt",
-                    use_auth_token=True if self.hf_token or os.getenv('HUGGINGFACE_TOKEN') else None
-                )
-            self.model = PeftModel.from_pretrained(
-                        base_model,
-                        self.model_name,
-                        use_auth_token=True if self.hf_token or os.getenv('HUGGINGFACE_TOKEN') else None
-                    )
-            self.model.to(self.device)
-            self.model.eval()  # Set to evaluation mode
-            logger.info("BioGPT model loaded successfully")
+            self.executor, self.tokenizer, self.model = await self._build_engine(self._load_options(), timer)
+            logger.info(f"BioGPT model loaded successfully ({self.executor_type} executor, "
+                        f"{self.inference_workers} workers x {self.torch_threads} torch threads, "
+                        f"{self.load_mode} weights, quantization={self.quantization})")
+            logger.info(f"Model startup breakdown: {timer.summary()}")
         except Exception as e:
             logger.error(f"Error loading model: {e}")
             logger.info("Falling back to mock model")
+            self._shutdown_executor()
             self.use_mock = True
     
+    async def _build_engine(self, load_options: Dict, timer: PhaseTimer) -> Tuple:
+        """Create an inference executor and load a model into it: (executor, tokenizer, model)
+        
+        tokenizer and model are None for process/replica executors, whose workers hold their own copies.
+        """
+        loop = asyncio.get_running_loop()
+        if self.executor_type == "replicas":
+            executor = ReplicaPoolExecutor(
+                self.model_name,
+                hf_token=self.hf_token,
+                replicas=self.inference_workers,
+                torch_threads=self.torch_threads,
+                load_options=load_options
+            )
+            with timer.phase('replicas_start'):
+                await loop.run_in_executor(None, executor.start)
+        else:
+            executor = create_inference_executor(
+                self.executor_type,
+                self.inference_workers,
+                self.torch_threads,
+                model_name=self.model_name,
+                hf_token=self.hf_token,
+                load_options=load_options
+            )
+        
+        try:
+            if self.executor_type in ("process", "replicas"):
+                # Each worker loads its own replica in its initializer; wait until all are up
+                with timer.phase('workers_ready'):
+                    pids = await asyncio.gather(*[
+                        loop.run_in_executor(executor, process_worker_ready)
+                        for _ in range(self.inference_workers)
+                    ])
+                logger.info(f"Inference worker processes ready: {sorted(set(pids))}")
+                return executor, None, None
+            tokenizer, model = await loop.run_in_executor(
+                executor,
+                functools.partial(load_for_inference, self.model_name, self.hf_token, self.device,
+                                  timer=timer, **load_options)
+            )
+            return executor, tokenizer, model
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    
+    def _load_options(self) -> Dict:
+        return {
+            'load_mode': self.load_mode,
+            'quantization': self.quantization,
+            'cache_dir': self.optimized_cache_dir,
+            'snapshot_dir': self.snapshot_dir,
+            'version': self.current_version,
+            'adapter': self.adapter
+        }
+    
+    async def _prepare_snapshot(self, loop, version: Optional[str] = None):
+        """Build the snapshot for a version (default: current) if missing; warm starts skip this
+        
+        A fine-tuned version is built from its adapter in adapter_dir. Only the version currently
+        served from model_name's own adapter may fall back to that adapter; any other version
+        without a snapshot or adapter raises FileNotFoundError rather than being built from the
+        base adapter under the wrong label.
+        """
+        version = version or self.current_version
+        if snapshot_exists(self.model_name, version, self.snapshot_dir):
+            return
+        adapter = adapter_path(self.model_name, version, self.adapter_dir)
+        if not os.path.isdir(adapter):
+            if version != self.current_version or self.adapter:
+                raise FileNotFoundError(f"No snapshot or fine-tuned adapter for {self.model_name}@{version} "
+                                        f"in {self.snapshot_dir} or {self.adapter_dir}")
+            adapter = ""
+        logger.info(f"No snapshot for {self.model_name}@{version}, building one")
+        await loop.run_in_executor(
+            None, functools.partial(build_snapshot, self.model_name, version, self.hf_token, self.snapshot_dir,
+                                    adapter=adapter)
+        )
+    
+    async def _prepare_merged_model(self, loop):
+        """Build the merged cache once before any worker loads it, and optionally check parity"""
+        await loop.run_in_executor(
+            None, ensure_merged_model, self.model_name, self.hf_token, self.quantization, self.optimized_cache_dir,
+            self.current_version, self.adapter
+        )
+        if not self.verify_parity:
+            return
+        
+        self.parity_report = await loop.run_in_executor(
+            None, run_parity_check, self.model_name, self.hf_token, self.quantization, self.optimized_cache_dir,
+            self.current_version, self.adapter
+        )
+        if not self.parity_report['passed']:
+            logger.warning(f"Optimized model failed parity check {self.parity_report}, "
+                           f"falling back to unmerged adapter")
+            self.load_mode = "adapter"
+            self.quantization = "none"
+    
     def format_input(self, patient_input: PatientInput) -> str:
         """Format patient input for BioGPT"""
-        return (f"symptoms:{patient_input.symptoms}, "
-                f"age:{patient_input.age}, "
-                f"gender:{patient_input.gender}, "
-                f"diagnosis:{patient_input.diagnosis}")
+        return format_patient_prompt(patient_input.symptoms, patient_input.age, patient_input.gender,
+                                     patient_input.diagnosis)
+    
+    def cache_key(self, patient_input: PatientInput) -> str:
+        """Cache key: model version plus the canonicalized format_input() string"""
+        canonical = canonicalize_patient_input(patient_input, self.cache_age_bucket)
+        return f"{self.current_version}|{self.format_input(canonical)}"
     
     async def generate_prescription(self, patient_input: PatientInput) -> Prescription:
         """Generate prescription using BioGPT model"""
+        # Read once, so a request that straddles a hot swap reports the version its cache key used
+        return await self._prescription(patient_input, self.current_version)
+    
+    async def _prescription(self, patient_input: PatientInput, version: str, cache_key: Optional[str] = None,
+                            cached: Optional[tuple] = None) -> Prescription:
+        """Cached or (coalesced) generated prescription
+        
+        A caller that already looked the key up passes cache_key and the result it got, so the
+        lookup is not repeated and counted as a second hit or miss.
+        """
         try:
-            if self.use_mock:
-                medications = await self._mock_generate_prescription(patient_input)
-                confidence = self._calculate_mock_confidence(patient_input)
-            else:
-                medications, confidence = await self._real_generate_prescription(patient_input)
+            if cache_key is None:
+                cache_key = self.cache_key(patient_input)
+                cached = self.cache.get(cache_key)
+            if cached is None:
+                cached = await self.single_flight.do(
+                    cache_key, lambda: self._generate_uncached(patient_input, cache_key)
+                )
+            medications, confidence = cached
             
             return Prescription(
-                medications=medications,
+                medications=list(medications),
                 confidence=confidence,
-                model_version=self.current_version
+                model_version=version
             )
             
         except Exception as e:
@@ -98,92 +293,140 @@ class BioGPTModelManager:
             return Prescription(
                 medications=["Error: Unable to generate prescription"],
                 confidence=0.0,
-                model_version=self.current_version
+                model_version=version
             )
     
-    async def _real_generate_prescription(self, patient_input: PatientInput) -> tuple:
-        """Real BioGPT inference"""
-        try:
-            input_text = self.format_input(patient_input)
-            logger.info(f"Generating prescription for: {input_text}")
-            
-            inputs = self.tokenizer(input_text, return_tensors="pt").to(self.device)
-            
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    inputs.input_ids,
-                    max_length=inputs.input_ids.shape[1] + 50,
-                    temperature=0.7,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    num_return_sequences=1
-                )
-            
-            generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            medications = self._extract_medications(generated_text)
-            confidence = self._calculate_confidence(outputs, inputs)
-            
-            logger.info(f"Generated medications: {medications}")
-            return medications, confidence
-            
-        except Exception as e:
-            logger.error(f"Error in real prescription generation: {e}")
-            # Fallback to mock
-            medications = await self._mock_generate_prescription(patient_input)
-            confidence = 0.5
-            return medications, confidence
+    async def generate_prescription_batch(self, patient_inputs: List[PatientInput]) -> List[Prescription]:
+        """Generate prescriptions for many inputs, in input order
+        
+        Real inference submits every miss at once so the micro-batcher packs them into full
+        generate batches; the mock path evaluates all misses with the vectorized rule engine.
+        """
+        if not self.use_mock:
+            return list(await asyncio.gather(*(self.generate_prescription(p) for p in patient_inputs)))
+        
+        version = self.current_version
+        keys = [self.cache_key(p) for p in patient_inputs]
+        results = [self.cache.get(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            if self.mock_latency_s > 0:
+                await asyncio.sleep(self.mock_latency_s)
+            medications = self.rule_engine.prescribe_batch([patient_inputs[i] for i in misses])
+            for i, meds in zip(misses, medications):
+                results[i] = (tuple(meds), self._calculate_mock_confidence(patient_inputs[i]))
+                self.cache.put(keys[i], results[i])
+        
+        return [
+            Prescription(medications=list(meds), confidence=confidence, model_version=version)
+            for meds, confidence in results
+        ]
     
-    async def _mock_generate_prescription(self, patient_input: PatientInput) -> List[str]:
-        """Mock prescription generation for demonstration"""
-        # Add small delay to simulate processing
-        await asyncio.sleep(0.5)
-        
-        medications = []
-        symptoms = patient_input.symptoms.lower()
-        diagnosis = patient_input.diagnosis.lower()
-        age = patient_input.age
-        
-        symptom_mapping = {
-            'back pain': ['Ibuprofen', 'Acetaminophen'],
-            'pain': ['Acetaminophen', 'Ibuprofen'],
-            'constipation': ['Docusate Sodium', 'Senna'],
-            'loss of appetite': ['Multivitamin', 'B-Complex'],
-            'fatigue': ['Iron Supplement', 'Vitamin B12'],
-            'headache': ['Acetaminophen', 'Ibuprofen'],
-            'nausea': ['Ondansetron', 'Ginger Extract'],
-            'dizziness': ['Meclizine'],
-            'chest pain': ['Nitroglycerin'],
-            'shortness of breath': ['Albuterol'],
-            'cough': ['Dextromethorphan', 'Guaifenesin']
-        }
+    @property
+    def streaming_supported(self) -> bool:
+        """Whether stream_prescription can stream: only a model in this process (thread executor) reports tokens"""
+        return self.use_mock or self.executor_type == "thread"
+    
+    async def stream_prescription(self, patient_input: PatientInput) -> AsyncIterator[Tuple[str, object]]:
+        """Yield ('partial', text) while generating, then ('final', Prescription)
         
-        for symptom, meds in symptom_mapping.items():
-            if symptom in symptoms:
-                medications.extend(meds)
-        
-        diagnosis_mapping = {
-            'hypertension': ['Lisinopril', 'Amlodipine'],
-            'diabetes': ['Metformin', 'Glipizide'],
-            'depression': ['Sertraline', 'Fluoxetine'],
-            'anxiety': ['Lorazepam', 'Alprazolam'],
-            'arthritis': ['Celecoxib', 'Naproxen'],
-            'asthma': ['Albuterol', 'Fluticasone'],
-            'heart disease': ['Aspirin', 'Metoprolol']
-        }
+        Real tokens are streamed when the model runs in this process (thread executor); streamed
+        requests run alone rather than in a micro-batch. Real-model cache hits yield only the final
+        message, and the mock path streams one medication per chunk. Process and replica workers cannot
+        report tokens back while generating, so streaming is refused for them (ValueError)
+        rather than imitated with a single final message.
+        """
+        if not self.streaming_supported:
+            raise ValueError(f"Streaming is not supported with the {self.executor_type} executor; "
+                             f"request the prescription without 'stream'")
+        version = self.current_version
+        cache_key = self.cache_key(patient_input)
+        cached = self.cache.get(cache_key)
+        if cached is None and not self.use_mock and self.model is not None:
+            loop = asyncio.get_running_loop()
+            chunks = asyncio.Queue()
+            future = loop.run_in_executor(
+                self.executor, stream_generation, self.tokenizer, self.model, self.device,
+                self.format_input(patient_input),
+                lambda text: loop.call_soon_threadsafe(chunks.put_nowait, text)
+            )
+            # Runs on the loop after every queued chunk, so it always arrives last
+            future.add_done_callback(lambda _: loop.call_soon(chunks.put_nowait, None))
+            while True:
+                text = await chunks.get()
+                if text is None:
+                    break
+                yield 'partial', text
+            try:
+                generated_text, scores = await future
+                medications = self._extract_medications(generated_text)
+                confidence = self._calculate_confidence(scores)
+                self.cache.put(cache_key, (tuple(medications), confidence))
+                yield 'final', Prescription(medications=medications, confidence=confidence,
+                                            model_version=version)
+                return
+            except Exception as e:
+                logger.error(f"Error in streamed generation, falling back: {e}")
         
-        for condition, meds in diagnosis_mapping.items():
-            if condition in diagnosis:
-                medications.extend(meds)
+        prescription = await self._prescription(patient_input, version, cache_key, cached)
+        if self.use_mock:
+            for medication in prescription.medications:
+                yield 'partial', medication + "\n"
+        yield 'final', prescription
+    
+    async def _generate_uncached(self, patient_input: PatientInput, cache_key: str) -> tuple:
+        """Run the model (or mock) for a cache miss and store the result"""
+        cacheable = True
+        if self.use_mock:
+            medications = await self._mock_generate_prescription(patient_input)
+            confidence = self._calculate_mock_confidence(patient_input)
+        else:
+            try:
+                medications, confidence = await self._real_generate_prescription(patient_input)
+            except Exception as e:
+                logger.error(f"Error in real prescription generation: {e}")
+                # Fallback to mock; never cache a fallback answer
+                medications = await self._mock_generate_prescription(patient_input)
+                confidence = 0.5
+                cacheable = False
         
-        if age > 65:
-            medications.extend(['Vitamin D', 'Calcium'])
-        elif age < 18:
-            medications = [med for med in medications if 'Aspirin' not in med]
+        result = (tuple(medications), confidence)
+        if cacheable:
+            self.cache.put(cache_key, result)
+        return result
+    
+    async def _real_generate_prescription(self, patient_input: PatientInput) -> tuple:
+        """Real BioGPT inference, batched with other concurrent requests"""
+        return await self.batcher.submit(patient_input)
+    
+    async def _generate_batch(self, patient_inputs: List[PatientInput]) -> List[tuple]:
+        """Run a single padded generate call for a batch of patient inputs on the executor"""
+        input_texts = [self.format_input(patient_input) for patient_input in patient_inputs]
+        logger.info(f"Generating prescriptions for batch of {len(input_texts)}")
         
-        medications = list(set(medications))
-        if not medications:
-            medications = ['General Supportive Care', 'Multivitamin']
+        loop = asyncio.get_running_loop()
+        if self.executor_type in ("process", "replicas"):
+            generations = await loop.run_in_executor(self.executor, process_worker_generate, input_texts)
+        else:
+            generations = await loop.run_in_executor(
+                self.executor, run_generation, self.tokenizer, self.model, self.device, input_texts
+            )
         
+        results = []
+        for generated_text, scores in generations:
+            medications = self._extract_medications(generated_text)
+            confidence = self._calculate_confidence(scores)
+            logger.info(f"Generated medications: {medications} (confidence {confidence})")
+            results.append((medications, confidence))
+        return results
+    
+    async def _mock_generate_prescription(self, patient_input: PatientInput) -> List[str]:
+        """Mock prescription generation for demonstration (also the fallback when inference fails)"""
+        if self.mock_latency_s > 0:
+            # Opt-in latency simulator for demos and load tests
+            await asyncio.sleep(self.mock_latency_s)
+        
+        medications = self.rule_engine.prescribe(patient_input)
         logger.info(f"Mock generated medications: {medications}")
         return medications
     
@@ -206,93 +449,259 @@ class BioGPTModelManager:
     
     def _extract_medications(self, generated_text: str) -> List[str]:
         """Extract medication names from generated text"""
-
-        
-        medications = []
-        lines = generated_text.split('\n')
-        
-        medication_keywords = [
-            'prescribe', 'medication', 'drug', 'treatment', 'therapy'
-        ]
-        
-        for line in lines:
-            line_lower = line.lower()
-            if any(keyword in line_lower for keyword in medication_keywords):
-                # Extract potential medication names (capitalized words)
-                words = line.split()
-                for word in words:
-                    if (word.istitle() and len(word) > 3 and 
-                        not word.lower() in ['the', 'and', 'for', 'with', 'patient']):
-                        medications.append(word)
-        
-        if not medications:
-            common_meds = [
-                'Aspirin', 'Ibuprofen', 'Acetaminophen', 'Lisinopril', 
-                'Metformin', 'Amlodipine', 'Simvastatin'
-            ]
-            for med in common_meds:
-                if med.lower() in generated_text.lower():
-                    medications.append(med)
-        
+        medications = self.extractor.extract(generated_text)
         return medications if medications else ['Generated Medication']
     
-    def _calculate_confidence(self, outputs, inputs) -> float:
-        """Calculate confidence score from model outputs"""
+    def _calculate_confidence(self, scores: Dict) -> float:
+        """Confidence from the generate-time scores: mean probability of the medication tokens"""
         try:
-            return 0.85  
-        except:
+            return float(scores['confidence'])
+        except (KeyError, TypeError, ValueError):
             return 0.5
     
-    async def update_model_with_feedback(self, feedback_data: List[Dict]) -> str:
-        """Update/fine-tune model with doctor feedback"""
+    async def update_model_with_feedback(self, feedback_data: List[Dict], db_path: str = "medical_mcp.db") -> str:
+        """Update/fine-tune model with doctor feedback
+        
+        The real path trains on the feedback stored in db_path (see start_fine_tune) and waits for it;
+        feedback_data is only used by the mock.
+        """
         logger.info(f"Starting model update with {len(feedback_data)} feedback samples")
         
         if self.use_mock:
             return await self._mock_update_model(feedback_data)
         else:
-            return await self._real_update_model(feedback_data)
+            return await self._real_update_model(db_path)
+    
+    def _next_version(self) -> str:
+        version_parts = self.current_version.split('.')
+        version_parts[-1] = str(int(version_parts[-1]) + 1)
+        return '.'.join(version_parts)
+    
+    def _bump_version(self):
+        """Increment the patch version and drop cached results from the old model"""
+        self.current_version = self._next_version()
+        self.cache.clear()
+    
+    def _next_training_version(self) -> str:
+        """Next patch version that has no adapter on disk yet (after a rollback the next one may)"""
+        version = self._next_version()
+        while os.path.exists(adapter_path(self.model_name, version, self.adapter_dir)):
+            parts = version.split('.')
+            parts[-1] = str(int(parts[-1]) + 1)
+            version = '.'.join(parts)
+        return version
+    
+    def start_fine_tune(self, db_path: str, swap: bool = False, options: Optional[Dict] = None) -> FineTuneJob:
+        """Start LoRA fine-tuning on new feedback in a background process (see models/finetune.py)
+        
+        options are fine_tune() hyperparameters (batch_size, accumulation_steps, learning_rate, ...),
+        checked against finetune.TRAINING_OPTIONS; paths and names are never taken from them.
+        The job trains the next version; serving continues on the current weights meanwhile, and
+        with swap=True the trained version is hot-swapped in when the job completes.
+        """
+        options = validate_training_options(options)
+        if self.use_mock:
+            raise RuntimeError("Fine-tuning needs the real model (transformers and peft)")
+        if self.fine_tune_job is not None and self.fine_tune_job.running:
+            raise RuntimeError(f"Fine-tuning job {self.fine_tune_job.job_id} is already running")
+        job_options = {
+            'db_path': db_path,
+            'model_name': self.model_name,
+            'version': self._next_training_version(),
+            'hf_token': self.hf_token,
+            'adapter_dir': self.adapter_dir,
+            # Training gets a quarter of the cores so inference workers keep theirs
+            'torch_threads': max(1, (os.cpu_count() or 1) // 4)
+        }
+        job_options.update(options)
+        self.fine_tune_job = FineTuneJob(job_options)
+        self.fine_tune_job.start()
+        if swap:
+            self._swap_task = asyncio.create_task(self._swap_when_trained(self.fine_tune_job))
+        return self.fine_tune_job
+    
+    async def _swap_when_trained(self, job: FineTuneJob):
+        status = await job.wait()
+        if status['state'] != 'completed' or status.get('version') is None:
+            return
+        try:
+            await self.hot_swap(status['version'])
+        except Exception as e:
+            logger.error(f"Hot swap to fine-tuned version {status['version']} failed: {e}")
+    
+    def _swap_load_options(self, version: str, source: str) -> Dict:
+        """Load options for version; the configured load_mode and quantization are kept for adapters"""
+        options = self._load_options()
+        options['version'] = version
+        if source == "adapter":
+            path = adapter_path(self.model_name, version, self.adapter_dir)
+            if not os.path.isdir(path):
+                raise FileNotFoundError(f"No fine-tuned adapter for {self.model_name}@{version} in {self.adapter_dir}")
+            options['adapter'] = path
+        else:
+            options.update(load_mode="snapshot", adapter="")
+        return options
+    
+    async def _prepare_swap(self, loop, load_options: Dict, timer: PhaseTimer):
+        """Build the merged weights or snapshot the new version's load mode needs, once, before any worker loads"""
+        if load_options['load_mode'] == "merged":
+            with timer.phase('prepare_merged'):
+                await loop.run_in_executor(
+                    None, ensure_merged_model, self.model_name, self.hf_token, load_options['quantization'],
+                    self.optimized_cache_dir, load_options['version'], load_options['adapter']
+                )
+        elif load_options['load_mode'] == "snapshot":
+            with timer.phase('prepare_snapshot'):
+                await self._prepare_snapshot(loop, load_options['version'])
+    
+    async def _warm_up(self, executor, tokenizer, model, patient_inputs: List[PatientInput]):
+        """Run sample inputs through a freshly loaded model before it takes traffic"""
+        loop = asyncio.get_running_loop()
+        input_texts = [self.format_input(patient_input) for patient_input in patient_inputs]
+        if self.executor_type in ("process", "replicas"):
+            # One call per worker, so each replica has generated once
+            await asyncio.gather(*[
+                loop.run_in_executor(executor, process_worker_generate, input_texts)
+                for _ in range(self.inference_workers)
+            ])
+        else:
+            await loop.run_in_executor(executor, run_generation, tokenizer, model, self.device, input_texts)
+    
+    async def hot_swap(self, version: str, source: str = "adapter",
+                       warmup_inputs: Optional[List[PatientInput]] = None) -> Dict:
+        """Switch serving to another model version without a restart
+        
+        source "adapter" loads the fine-tuned adapter for version from adapter_dir in the configured
+        load_mode and quantization: merged and snapshot deployments merge the new adapter first, so a
+        swap never downgrades them to an unmerged fp32 adapter. "snapshot" loads the merged snapshot
+        for version (built first if missing, from its adapter). The new model is loaded on its
+        own executor and warmed up while the old one keeps serving, then both are switched in a
+        single step. Generate calls already running finish on the old executor, which is then
+        shut down so its weights can be freed.
+        """
+        if source not in ("adapter", "snapshot"):
+            raise ValueError(f"source must be 'adapter' or 'snapshot', got {source}")
+        validate_version(version)
+        async with self._swap_lock:
+            timer = PhaseTimer()
+            old_version = self.current_version
+            if self.use_mock:
+                # No weights to load; only the version (and the cache keyed by it) changes
+                self.current_version = version
+                self.cache.clear()
+            else:
+                loop = asyncio.get_running_loop()
+                load_options = self._swap_load_options(version, source)
+                await self._prepare_swap(loop, load_options, timer)
+                with timer.phase('load'):
+                    engine = await self._build_engine(load_options, PhaseTimer())
+                try:
+                    with timer.phase('warmup'):
+                        await self._warm_up(*engine, warmup_inputs or WARMUP_INPUTS)
+                except BaseException:
+                    engine[0].shutdown(wait=False, cancel_futures=True)
+                    raise
+                
+                # No await between these lines: every call submitted after this sees only the new model
+                old_engine = (self.executor, self.tokenizer, self.model)
+                self.executor, self.tokenizer, self.model = engine
+                self.current_version = version
+                self.load_mode = load_options['load_mode']
+                self.quantization = load_options['quantization']
+                self.adapter = load_options['adapter']
+                self.cache.clear()
+                del engine
+                
+                with timer.phase('drain'):
+                    await loop.run_in_executor(None, functools.partial(old_engine[0].shutdown, wait=True))
+                del old_engine
+                gc.collect()
+            
+            self.last_swap = {
+                'from_version': old_version,
+                'to_version': version,
+                'source': source,
+                'swapped_at': datetime.now().isoformat(),
+                'timings_ms': timer.to_dict()
+            }
+            logger.info(f"Hot-swapped model {old_version} -> {version} ({timer.summary()})")
+            return self.last_swap
     
     async def _mock_update_model(self, feedback_data: List[Dict]) -> str:
         """Mock model update for demonstration"""
         await asyncio.sleep(2)
         
         old_version = self.current_version
-        version_parts = self.current_version.split('.')
-        version_parts[-1] = str(int(version_parts[-1]) + 1)
-        self.current_version = '.'.join(version_parts)
+        self._bump_version()
         
         logger.info(f"Mock model updated from {old_version} to {self.current_version}")
         logger.info(f"Processed {len(feedback_data)} feedback samples")
         
         return self.current_version
     
-    async def _real_update_model(self, feedback_data: List[Dict]) -> str:
-        """Real model fine-tuning with feedback data"""
-        try:            
-            logger.info("Real model update not implemented in this demo")
-            logger.info("Would fine-tune BioGPT with feedback data")
-            
-            old_version = self.current_version
-            version_parts = self.current_version.split('.')
-            version_parts[-1] = str(int(version_parts[-1]) + 1)
-            self.current_version = '.'.join(version_parts)
-            
-            logger.info(f"Model version updated from {old_version} to {self.current_version}")
+    async def _real_update_model(self, db_path: str) -> str:
+        """Real model fine-tuning with the stored feedback, hot-swapped in; returns the serving version"""
+        try:
+            status = await self.start_fine_tune(db_path).wait()
+            if status['state'] != 'completed':
+                raise RuntimeError(status.get('error', status['state']))
+            if status.get('version') is None:
+                logger.info("No new feedback, model version unchanged")
+                return self.current_version
+            await self.hot_swap(status['version'])
             return self.current_version
             
         except Exception as e:
             logger.error(f"Error in real model update: {e}")
-            return await self._mock_update_model(feedback_data)
+            return self.current_version
     
     def get_model_info(self) -> Dict:
         """Get current model information"""
-        return {
+        info = {
             'model_name': self.model_name,
             'version': self.current_version,
             'device': str(self.device),
             'mock_mode': self.use_mock,
-            'loaded': self.model is not None or self.use_mock
+            'loaded': self.executor is not None or self.use_mock,
+            'batching': self.batcher.get_stats(),
+            'cache': self.cache.get_stats(),
+            'coalescing': self.single_flight.get_stats(),
+            'executor': {
+                'type': self.executor_type,
+                'workers': self.inference_workers,
+                'torch_threads_per_worker': self.torch_threads
+            },
+            'optimization': {
+                'load_mode': self.load_mode,
+                'quantization': self.quantization,
+                'parity': self.parity_report,
+                'adapter': self.adapter or None
+            },
+            'startup_ms': self.startup_timer.to_dict(),
+            'fine_tune': self.fine_tune_job.get_status() if self.fine_tune_job else None,
+            'hot_swap': {
+                'in_progress': self._swap_lock.locked(),
+                'last': self.last_swap
+            }
         }
+        if isinstance(self.executor, ReplicaPoolExecutor):
+            info['replicas'] = self.executor.get_stats()
+        return info
+    
+    def _shutdown_executor(self):
+        """Release the inference executor and any worker processes"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+    
+    async def close(self):
+        """Stop batching, release inference workers and stop any fine-tuning job"""
+        if self.fine_tune_job is not None and self.fine_tune_job.running:
+            await self.fine_tune_job.cancel()
+        if self._swap_task is not None and not self._swap_task.done():
+            self._swap_task.cancel()
+        await self.batcher.close()
+        self._shutdown_executor()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
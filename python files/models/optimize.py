@@ -0,0 +1,121 @@
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+from ..utils import PhaseTimer
+
+logger = logging.getLogger(__name__)
+
+LOAD_MODES = ("adapter", "merged", "snapshot")
+QUANTIZATIONS = ("none", "int8", "bf16")
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_cache")
+
+# Prompts used to compare the optimized model against the unmerged adapter model
+PARITY_PROMPTS = [
+    "symptoms:back pain, loss of appetite, constipation, age:74, gender:male, diagnosis:hypertension diabetes",
+    "symptoms:headache, nausea, age:30, gender:female, diagnosis:",
+    "symptoms:cough, shortness of breath, age:12, gender:male, diagnosis:asthma",
+    "symptoms:fatigue, dizziness, age:58, gender:female, diagnosis:heart disease",
+]
+
+
+def merged_snapshot_dir(cache_dir: str = DEFAULT_CACHE_DIR, dtype: str = "float32") -> str:
+    """Snapshot directory (see models/snapshot.py) holding merged weights of one dtype"""
+    return os.path.join(cache_dir, dtype)
+
+
+def quantize_model(model, quantization: str):
+    """Apply dynamic int8 quantization or bf16 weights to a merged model"""
+    if quantization == "int8":
+        # Linear layers get int8 weights; activations are quantized on the fly
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif quantization == "bf16":
+        model = model.to(torch.bfloat16)
+    elif quantization != "none":
+        raise ValueError(f"Unknown quantization: {quantization}")
+    return model
+
+
+def ensure_merged_model(model_name: str, hf_token: str = "", quantization: str = "none",
+                        cache_dir: str = DEFAULT_CACHE_DIR, version: str = "1.0", adapter: str = "") -> str:
+    """Build the merged snapshot if it is missing and return its path
+
+    Merged weights are stored as snapshots, so both load modes share one on-disk format and
+    one loader; adapter is a local fine-tuned adapter to merge instead of model_name's own.
+    """
+    from .snapshot import build_snapshot, snapshot_exists, snapshot_path
+
+    # bf16 is cached as bf16 so startup skips the cast; int8 is quantized from fp32 at load time
+    dtype = "bfloat16" if quantization == "bf16" else "float32"
+    snapshot_dir = merged_snapshot_dir(cache_dir, dtype)
+    if not snapshot_exists(model_name, version, snapshot_dir):
+        logger.info(f"No merged model cached for {model_name}@{version}, merging adapter")
+        build_snapshot(model_name, version, hf_token, snapshot_dir, dtype, adapter=adapter)
+    return snapshot_path(model_name, version, snapshot_dir)
+
+
+def load_merged_biogpt(model_name: str, hf_token: str = "", device: Optional[torch.device] = None,
+                       quantization: str = "none", cache_dir: str = DEFAULT_CACHE_DIR, version: str = "1.0",
+                       adapter: str = "", timer: Optional[PhaseTimer] = None) -> Tuple:
+    """Load the merged model from the disk cache (building it on first use) and quantize it"""
+    from .snapshot import load_snapshot
+
+    path = ensure_merged_model(model_name, hf_token, quantization, cache_dir, version, adapter)
+    logger.info(f"Loading merged model from cache: {path}")
+    dtype = "bfloat16" if quantization == "bf16" else "float32"
+    return load_snapshot(model_name, version, merged_snapshot_dir(cache_dir, dtype), device, quantization, timer)
+
+
+def parity_check(reference_model, candidate_model, tokenizer, prompts: List[str] = None,
+                 min_top1_agreement: float = 0.9) -> Dict:
+    """Compare next-token predictions of an optimized model against the unmerged reference"""
+    prompts = prompts or PARITY_PROMPTS
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+    mask = inputs.attention_mask.bool()
+
+    with torch.no_grad():
+        reference_logits = reference_model(**inputs).logits.float()
+        candidate_logits = candidate_model(**inputs).logits.float()
+
+    # Only compare real (non-padding) positions
+    diff = (reference_logits - candidate_logits).abs()[mask]
+    top1_agreement = (reference_logits.argmax(-1) == candidate_logits.argmax(-1))[mask].float().mean().item()
+
+    report = {
+        'prompts': len(prompts),
+        'max_abs_logit_diff': round(diff.max().item(), 4),
+        'mean_abs_logit_diff': round(diff.mean().item(), 4),
+        'top1_agreement': round(top1_agreement, 4),
+        'passed': top1_agreement >= min_top1_agreement
+    }
+    logger.info(f"Parity check: {report}")
+    return report
+
+
+def run_parity_check(model_name: str, hf_token: str = "", quantization: str = "none",
+                     cache_dir: str = DEFAULT_CACHE_DIR, version: str = "1.0", adapter: str = "") -> Dict:
+    """Load both the unmerged and the optimized model and compare them"""
+    from .inference import load_biogpt
+
+    tokenizer, reference_model = load_biogpt(model_name, hf_token, adapter=adapter)
+    _, candidate_model = load_merged_biogpt(model_name, hf_token, quantization=quantization, cache_dir=cache_dir,
+                                            version=version, adapter=adapter)
+    return parity_check(reference_model, candidate_model, tokenizer)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Merge, quantize and parity-check the BioGPT adapter")
+    parser.add_argument("--model-name", default="santanukumar07/biogpt-finetune")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="none")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    report = run_parity_check(args.model_name, os.getenv('HUGGINGFACE_TOKEN', ''), args.quantization, args.cache_dir)
+    print(f"Parity report: {report}")
@@ -0,0 +1,43 @@
+import os
+import re
+import shutil
+
+# Model versions are dotted numbers ("1.0", "1.12.3"); anything else is rejected before it
+# becomes part of a filesystem path
+VERSION_RE = re.compile(r"^\d+(\.\d+)*$")
+
+
+def validate_version(version: str) -> str:
+    if not isinstance(version, str) or not VERSION_RE.match(version):
+        raise ValueError(f"Invalid model version: {version!r} (expected dotted numbers, e.g. 1.2)")
+    return version
+
+
+def safe_model_name(model_name: str) -> str:
+    """Hub model name ("org/name") as a single directory name"""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "--", model_name)
+
+
+def contained_path(root: str, *parts: str) -> str:
+    """root joined with parts, refusing any result that resolves outside root"""
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, *parts))
+    if os.path.commonpath([root, path]) != root or path == root:
+        raise ValueError(f"Path {os.path.join(*parts)!r} escapes {root}")
+    return path
+
+
+def replace_directory(new_path: str, path: str):
+    """Move the finished directory new_path to path, replacing any existing one
+
+    A directory cannot be renamed over a non-empty one, so the old one is renamed aside first
+    and deleted afterwards: readers see the old directory, briefly none, then the new one, but
+    never a half-deleted or half-written directory.
+    """
+    old_path = path + ".old"
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(new_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
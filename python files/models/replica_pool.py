@@ -0,0 +1,171 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import torch
+import torch.multiprocessing as torch_mp
+
+from . import inference
+
+logger = logging.getLogger(__name__)
+
+
+def load_shared_base_weights(model_name: str, hf_token: str = "", load_options: dict = None) -> Tuple:
+    """Load the base weights once (microsoft/biogpt, or the merged model) and move them into shared memory"""
+    from transformers import AutoModelForCausalLM
+
+    load_options = load_options or {}
+    if load_options.get('load_mode') == "merged":
+        # Quantization is applied per replica; only the merged float weights are shared
+        from .optimize import load_merged_biogpt, DEFAULT_CACHE_DIR
+        quantization = "bf16" if load_options.get('quantization') == "bf16" else "none"
+        _, base_model = load_merged_biogpt(model_name, hf_token, quantization=quantization,
+                                           cache_dir=load_options.get('cache_dir') or DEFAULT_CACHE_DIR,
+                                           version=load_options.get('version', "1.0"),
+                                           adapter=load_options.get('adapter', ""))
+    else:
+        base_model = AutoModelForCausalLM.from_pretrained(inference.BASE_MODEL_NAME, **inference._auth_kwargs(hf_token))
+    config = base_model.config
+    state_dict = base_model.state_dict()
+    for tensor in state_dict.values():
+        # Tied weights share a storage; share_memory_ is a no-op the second time
+        tensor.share_memory_()
+    shared_bytes = sum(t.numel() * t.element_size() for t in {t.data_ptr(): t for t in state_dict.values()}.values())
+    logger.info(f"Base weights moved to shared memory ({shared_bytes / 1e6:.1f} MB)")
+    return config, state_dict
+
+
+def _init_replica_worker(model_name: str, hf_token: str, torch_threads: int, config, shared_state_dict: Dict,
+                         load_options: dict):
+    """Replica initializer: build BioGPT around the shared base weights and attach LoRA"""
+    from peft import PeftModel
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    inference.configure_torch_threads(torch_threads)
+    if shared_state_dict is None:
+        # Snapshot mode: every replica maps the same safetensors file, so pages are shared by the OS
+        tokenizer, model = inference.load_for_inference(model_name, hf_token, **load_options)
+        inference._worker_state.update(tokenizer=tokenizer, model=model, device=torch.device('cpu'))
+        logger.info(f"Model replica {os.getpid()} ready (mmap snapshot)")
+        return
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name, **inference._auth_kwargs(hf_token))
+    tokenizer.padding_side = "left"
+
+    base_model = AutoModelForCausalLM.from_config(config)
+    # assign=True keeps the shared-memory tensors instead of copying into fresh ones
+    base_model.load_state_dict(shared_state_dict, assign=True)
+    base_model.tie_weights()
+    if load_options.get('load_mode') == "merged":
+        # Adapter is already folded into the shared weights
+        from .optimize import quantize_model
+        model = base_model
+        if load_options.get('quantization') == "int8":
+            model = quantize_model(model, "int8")
+    else:
+        adapter = load_options.get('adapter')
+        if adapter:
+            model = PeftModel.from_pretrained(base_model, adapter)
+        else:
+            model = PeftModel.from_pretrained(base_model, model_name, **inference._auth_kwargs(hf_token))
+    model.eval()
+
+    inference._worker_state.update(tokenizer=tokenizer, model=model, device=torch.device('cpu'))
+    logger.info(f"Model replica {os.getpid()} ready")
+
+
+class _Replica:
+    """One worker process plus its load and latency counters"""
+
+    def __init__(self, index: int, executor: ProcessPoolExecutor):
+        self.index = index
+        self.executor = executor
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_latency_ms = 0.0
+        self.last_latency_ms = 0.0
+
+
+class ReplicaPoolExecutor(Executor):
+    """K single-process model replicas sharing base weights, with least-loaded routing"""
+
+    def __init__(self, model_name: str, hf_token: str = "", replicas: int = 2, torch_threads: int = 1,
+                 load_options: dict = None):
+        self.model_name = model_name
+        self.load_options = load_options or {}
+        self.hf_token = hf_token
+        self.num_replicas = max(1, replicas)
+        self.torch_threads = torch_threads
+        self._replicas: List[_Replica] = []
+        self._shared_state_dict: Optional[Dict] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Load the shared base weights and spawn the replica processes (blocking)"""
+        if self.load_options.get('load_mode') == "snapshot":
+            config, self._shared_state_dict = None, None
+        else:
+            config, self._shared_state_dict = load_shared_base_weights(self.model_name, self.hf_token,
+                                                                       self.load_options)
+        context = torch_mp.get_context("spawn")
+        for index in range(self.num_replicas):
+            executor = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=context,
+                initializer=_init_replica_worker,
+                initargs=(self.model_name, self.hf_token, self.torch_threads, config, self._shared_state_dict,
+                          self.load_options)
+            )
+            self._replicas.append(_Replica(index, executor))
+        logger.info(f"Started {self.num_replicas} model replicas")
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        """Route a call to the replica with the fewest requests in flight"""
+        with self._lock:
+            if not self._replicas:
+                raise RuntimeError("Replica pool is not running")
+            replica = min(self._replicas, key=lambda r: (r.in_flight, r.completed))
+            replica.in_flight += 1
+        started = time.perf_counter()
+
+        def _on_done(future: Future):
+            latency_ms = (time.perf_counter() - started) * 1000.0
+            with self._lock:
+                replica.in_flight -= 1
+                if future.cancelled() or future.exception() is not None:
+                    replica.failed += 1
+                else:
+                    replica.completed += 1
+                    replica.total_latency_ms += latency_ms
+                    replica.last_latency_ms = latency_ms
+
+        future = replica.executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(_on_done)
+        return future
+
+    def get_stats(self) -> List[Dict]:
+        """Per-replica queue depth and latency"""
+        with self._lock:
+            return [
+                {
+                    'replica': r.index,
+                    'queue_depth': r.in_flight,
+                    'completed': r.completed,
+                    'failed': r.failed,
+                    'avg_latency_ms': round(r.total_latency_ms / r.completed, 2) if r.completed else 0.0,
+                    'last_latency_ms': round(r.last_latency_ms, 2)
+                }
+                for r in self._replicas
+            ]
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        """Stop every replica and release the shared weights"""
+        with self._lock:
+            replicas, self._replicas = self._replicas, []
+        for replica in replicas:
+            replica.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+        self._shared_state_dict = None
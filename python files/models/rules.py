@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from ..data_models.data_models import PatientInput
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "prescription_rules.json")
+
+
+class _FieldMatcher:
+    """All rule keywords of one field compiled into a single regex
+
+    A lookahead alternation (longest keyword first) reports the longest keyword starting at each
+    position; keywords contained in a matched one (e.g. 'pain' in 'back pain') are added from a
+    precomputed table, so every substring hit is found in one scan of the text.
+    """
+
+    def __init__(self, keywords: Sequence[str]):
+        self.keywords = list(keywords)
+        index = {keyword: i for i, keyword in enumerate(self.keywords)}
+        ordered = sorted(self.keywords, key=len, reverse=True)
+        self._pattern = re.compile("(?=(" + "|".join(re.escape(k) for k in ordered) + "))") if ordered else None
+        self._implied: Dict[str, List[int]] = {
+            keyword: [index[other] for other in self.keywords if other in keyword]
+            for keyword in self.keywords
+        }
+
+    def match(self, text: str) -> set:
+        """Indices of every keyword that occurs in the (lowercased) text"""
+        hits = set()
+        if self._pattern is not None:
+            for m in self._pattern.finditer(text):
+                hits.update(self._implied[m.group(1)])
+        return hits
+
+    def match_batch(self, texts: np.ndarray) -> np.ndarray:
+        """(len(texts), len(keywords)) boolean matrix, one vectorized substring test per keyword"""
+        matrix = np.zeros((len(texts), len(self.keywords)), dtype=bool)
+        for i, keyword in enumerate(self.keywords):
+            matrix[:, i] = np.char.find(texts, keyword) >= 0
+        return matrix
+
+
+class PrescriptionRuleEngine:
+    """Symptom/diagnosis/age rules for the mock and fallback prescription path, compiled once"""
+
+    def __init__(self, config: Dict):
+        symptom_rules: Dict[str, List[str]] = {k.lower(): v for k, v in config.get('symptom_rules', {}).items()}
+        diagnosis_rules: Dict[str, List[str]] = {k.lower(): v for k, v in config.get('diagnosis_rules', {}).items()}
+        age_rules = config.get('age_rules', {})
+        self.default: List[str] = list(config.get('default', []))
+        # Rule keywords double as the vocabulary for reading symptoms/diagnoses out of free text
+        self.symptom_keywords: List[str] = list(symptom_rules)
+        self.diagnosis_keywords: List[str] = list(diagnosis_rules)
+        self.older_than: Optional[int] = age_rules.get('older_than')
+        self.younger_than: Optional[int] = age_rules.get('younger_than')
+
+        # Output order is the order medications first appear in the config, so it is stable
+        # and identical between the single and batch paths
+        rule_meds = list(symptom_rules.values()) + list(diagnosis_rules.values())
+        self.medications: List[str] = list(dict.fromkeys(
+            [med for meds in rule_meds for med in meds] + list(age_rules.get('older_add', []))
+        ))
+        column = {med: i for i, med in enumerate(self.medications)}
+
+        self._symptoms = _FieldMatcher(self.symptom_keywords)
+        self._diagnosis = _FieldMatcher(self.diagnosis_keywords)
+        # Rule -> medication incidence matrix; symptom rules first, then diagnosis rules
+        self._rule_meds = np.zeros((len(rule_meds), len(self.medications)), dtype=bool)
+        for rule, meds in enumerate(rule_meds):
+            self._rule_meds[rule, [column[med] for med in meds]] = True
+        self._rule_columns = [np.flatnonzero(row).tolist() for row in self._rule_meds]
+        self._older_add = np.zeros(len(self.medications), dtype=bool)
+        self._older_add[[column[med] for med in age_rules.get('older_add', [])]] = True
+        self._older_columns = np.flatnonzero(self._older_add).tolist()
+        excluded = age_rules.get('younger_exclude', [])
+        self._younger_keep = np.array([not any(word in med for word in excluded) for med in self.medications],
+                                      dtype=bool)
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_RULES_PATH) -> "PrescriptionRuleEngine":
+        with open(path, encoding="utf-8") as f:
+            engine = cls(json.load(f))
+        logger.info(f"Loaded prescription rules from {path} ({engine._rule_meds.shape[0]} rules)")
+        return engine
+
+    def _apply_age(self, selected: np.ndarray, ages: np.ndarray) -> np.ndarray:
+        if self.older_than is not None:
+            selected |= (ages > self.older_than)[:, None] & self._older_add
+        if self.younger_than is not None:
+            younger = ages < self.younger_than
+            if self.older_than is not None:
+                younger &= ~(ages > self.older_than)
+            selected &= ~younger[:, None] | self._younger_keep
+        return selected
+
+    def prescribe(self, patient_input: PatientInput) -> List[str]:
+        """Medications for one patient input"""
+        columns = set()
+        for rule in self._symptoms.match(patient_input.symptoms.lower()):
+            columns.update(self._rule_columns[rule])
+        offset = len(self._symptoms.keywords)
+        for rule in self._diagnosis.match(patient_input.diagnosis.lower()):
+            columns.update(self._rule_columns[offset + rule])
+
+        age = patient_input.age
+        if self.older_than is not None and age > self.older_than:
+            columns.update(self._older_columns)
+        elif self.younger_than is not None and age < self.younger_than:
+            columns = {column for column in columns if self._younger_keep[column]}
+
+        medications = [self.medications[column] for column in sorted(columns)]
+        return medications if medications else list(self.default)
+
+    def prescribe_batch(self, patient_inputs: Iterable[PatientInput]) -> List[List[str]]:
+        """Medications for many patient inputs, evaluated as boolean matrices instead of per input"""
+        patient_inputs = list(patient_inputs)
+        if not patient_inputs:
+            return []
+        symptoms = np.char.lower(np.array([p.symptoms for p in patient_inputs], dtype=str))
+        diagnoses = np.char.lower(np.array([p.diagnosis for p in patient_inputs], dtype=str))
+        ages = np.array([p.age for p in patient_inputs])
+
+        matched = np.hstack([self._symptoms.match_batch(symptoms), self._diagnosis.match_batch(diagnoses)])
+        # (inputs x rules) @ (rules x medications): which medications any matched rule prescribes
+        selected = (matched.astype(np.uint8) @ self._rule_meds.astype(np.uint8)) > 0
+        selected = self._apply_age(selected, ages)
+
+        rows, columns = np.nonzero(selected)
+        results = [[] for _ in patient_inputs]
+        for row, col in zip(rows.tolist(), columns.tolist()):
+            results[row].append(self.medications[col])
+        return [medications if medications else list(self.default) for medications in results]
+
+
+_default_engine: Optional[PrescriptionRuleEngine] = None
+
+
+def default_rule_engine() -> PrescriptionRuleEngine:
+    """Process-wide engine for the bundled rules file, built on first use"""
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = PrescriptionRuleEngine.from_file()
+    return _default_engine
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Time the rule engine on synthetic patient inputs")
+    parser.add_argument("--inputs", type=int, default=10000)
+    parser.add_argument("--rules", default=DEFAULT_RULES_PATH)
+    args = parser.parse_args()
+
+    engine = PrescriptionRuleEngine.from_file(args.rules)
+    rng = random.Random(0)
+    symptoms = ["back pain", "fatigue", "cough", "nausea", "chest pain", "fever", "dizziness", "constipation"]
+    diagnoses = ["hypertension", "diabetes", "asthma", "flu", "heart disease", "anxiety"]
+    inputs = [PatientInput(", ".join(rng.sample(symptoms, 2)), rng.randint(1, 95), "female", rng.choice(diagnoses))
+              for _ in range(args.inputs)]
+
+    started = time.perf_counter()
+    single = [engine.prescribe(p) for p in inputs]
+    single_s = time.perf_counter() - started
+    started = time.perf_counter()
+    batch = engine.prescribe_batch(inputs)
+    batch_s = time.perf_counter() - started
+
+    print(f"single: {single_s * 1e6 / len(inputs):.1f} us/input")
+    print(f"batch:  {batch_s * 1e6 / len(inputs):.1f} us/input (identical results: {single == batch})")
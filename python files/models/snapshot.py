@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+from ..utils import PhaseTimer
+from .paths import VERSION_RE, contained_path, replace_directory, safe_model_name, validate_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots")
+MANIFEST_FILE = "manifest.json"
+WEIGHTS_FILE = "model.safetensors"
+
+
+def snapshot_path(model_name: str, version: str, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR) -> str:
+    """Directory of the snapshot for a model name and version"""
+    return contained_path(snapshot_dir, safe_model_name(model_name), validate_version(version))
+
+
+def snapshot_exists(model_name: str, version: str, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR) -> bool:
+    path = snapshot_path(model_name, version, snapshot_dir)
+    return (os.path.exists(os.path.join(path, MANIFEST_FILE))
+            and os.path.exists(os.path.join(path, WEIGHTS_FILE)))
+
+
+def list_snapshots(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR) -> List[Dict]:
+    """Manifests of every snapshot on disk"""
+    manifests = []
+    if not os.path.isdir(snapshot_dir):
+        return manifests
+    for model_dir in sorted(os.listdir(snapshot_dir)):
+        for version in sorted(os.listdir(os.path.join(snapshot_dir, model_dir))):
+            if not VERSION_RE.match(version):
+                continue  # .tmp/.old directories of a build in progress
+            manifest_path = os.path.join(snapshot_dir, model_dir, version, MANIFEST_FILE)
+            if os.path.exists(manifest_path):
+                with open(manifest_path) as f:
+                    manifests.append(json.load(f))
+    return manifests
+
+
+def build_snapshot(model_name: str, version: str, hf_token: str = "", snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+                   dtype: str = "float32", model=None, tokenizer=None, adapter: str = "") -> str:
+    """Merge the adapter and write weights (safetensors), config, tokenizer and manifest
+
+    adapter is a local fine-tuned adapter directory to merge instead of model_name's own.
+    """
+    from .inference import BASE_MODEL_NAME, load_biogpt
+
+    timer = PhaseTimer()
+    if model is None or tokenizer is None:
+        with timer.phase('download_and_wrap'):
+            tokenizer, model = load_biogpt(model_name, hf_token, adapter=adapter)
+    with timer.phase('merge'):
+        merged = model.merge_and_unload() if hasattr(model, 'merge_and_unload') else model
+        merged = merged.to(getattr(torch, dtype))
+
+    path = snapshot_path(model_name, version, snapshot_dir)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        # Left over from an interrupted build
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    with timer.phase('write'):
+        merged.save_pretrained(tmp_path, safe_serialization=True, max_shard_size="100GB")
+        tokenizer.save_pretrained(tmp_path)
+        manifest = {
+            'model_name': model_name,
+            'version': version,
+            'base_model': BASE_MODEL_NAME,
+            'dtype': dtype,
+            'weights': WEIGHTS_FILE,
+            'created_at': datetime.now().isoformat()
+        }
+        with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    # Swap the finished snapshot into place so readers never see a partial one
+    replace_directory(tmp_path, path)
+    logger.info(f"Snapshot {model_name}@{version} written to {path} ({timer.summary()})")
+    return path
+
+
+def load_snapshot(model_name: str, version: str, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+                  device: Optional[torch.device] = None, quantization: str = "none",
+                  timer: Optional[PhaseTimer] = None) -> Tuple:
+    """Load a snapshot with no network calls and memory-mapped weights"""
+    from safetensors.torch import load_file
+    from transformers import AutoConfig, AutoTokenizer, AutoModelForCausalLM
+
+    from .optimize import quantize_model
+
+    timer = timer or PhaseTimer()
+    path = snapshot_path(model_name, version, snapshot_dir)
+    if not snapshot_exists(model_name, version, snapshot_dir):
+        raise FileNotFoundError(f"No snapshot for {model_name}@{version} in {snapshot_dir}")
+
+    with timer.phase('manifest'):
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        config = AutoConfig.from_pretrained(path, local_files_only=True)
+    with timer.phase('tokenizer'):
+        tokenizer = AutoTokenizer.from_pretrained(path, local_files_only=True)
+        tokenizer.padding_side = "left"
+    with timer.phase('weights_mmap'):
+        # safetensors maps the file; tensors stay backed by page cache until written to
+        state_dict = load_file(os.path.join(path, manifest['weights']))
+    with timer.phase('model_build'):
+        with torch.device('meta'):
+            model = AutoModelForCausalLM.from_config(config, torch_dtype=getattr(torch, manifest['dtype']))
+        model.load_state_dict(state_dict, strict=False, assign=True)
+        model.tie_weights()
+        if any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+            # Something was not in the weights file (e.g. a non-persistent buffer); take the slow path
+            logger.warning("Snapshot weights incomplete for meta init, loading with from_pretrained")
+            model = AutoModelForCausalLM.from_pretrained(path, local_files_only=True,
+                                                         torch_dtype=getattr(torch, manifest['dtype']))
+    with timer.phase('quantize'):
+        model = quantize_model(model, quantization)
+        model.to(device or torch.device('cpu'))
+        model.eval()
+
+    logger.info(f"Loaded snapshot {model_name}@{version} ({timer.summary()})")
+    return tokenizer, model
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Build or inspect local BioGPT model snapshots")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Download, merge and write a snapshot")
+    build_parser.add_argument("--model-name", default="santanukumar07/biogpt-finetune")
+    build_parser.add_argument("--version", default="1.0")
+    build_parser.add_argument("--dtype", choices=["float32", "bfloat16"], default="float32")
+    build_parser.add_argument("--snapshot-dir", default=DEFAULT_SNAPSHOT_DIR)
+
+    list_parser = subparsers.add_parser("list", help="List snapshots on disk")
+    list_parser.add_argument("--snapshot-dir", default=DEFAULT_SNAPSHOT_DIR)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_snapshot(args.model_name, args.version, os.getenv('HUGGINGFACE_TOKEN', ''),
+                       args.snapshot_dir, args.dtype)
+    else:
+        for manifest in list_snapshots(args.snapshot_dir):
+            print(json.dumps(manifest))
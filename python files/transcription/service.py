@@ -0,0 +1,441 @@
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import websockets
+
+from ..utils import PhaseTimer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 8766
+SAMPLE_RATE = 16000  # Whisper's input rate
+# Whisper transcribe() options a client may set: name -> allowed values (a tuple) or (type, min, max)
+TRANSCRIBE_OPTIONS = {
+    'language': (str, 2, 16),
+    'task': ('transcribe', 'translate'),
+    'temperature': (float, 0.0, 1.0),
+    'initial_prompt': (str, 0, 1000),
+    'condition_on_previous_text': (bool, False, True)
+}
+
+
+class TranscriptionQueueFull(Exception):
+    """Raised when the bounded job queue cannot take another job"""
+
+
+def validate_transcribe_options(options: Optional[Dict]) -> Dict:
+    """Checked copy of client-supplied Whisper options; unknown keys, wrong types and bad values raise
+
+    Anything else (block, decoder internals, ...) stays under the server's control.
+    """
+    if options is None:
+        return {}
+    if not isinstance(options, dict):
+        raise ValueError(f"options must be an object, got {type(options).__name__}")
+    validated = {}
+    for name, value in options.items():
+        if name not in TRANSCRIBE_OPTIONS:
+            raise ValueError(f"Unknown transcription option: {name} (allowed: {', '.join(TRANSCRIBE_OPTIONS)})")
+        allowed = TRANSCRIBE_OPTIONS[name]
+        if all(isinstance(choice, str) for choice in allowed):
+            if value not in allowed:
+                raise ValueError(f"Transcription option {name} must be one of {', '.join(allowed)}, got {value!r}")
+        else:
+            kind, low, high = allowed
+            # bool is an int subclass; ints are accepted where a float is expected
+            types = (int, float) if kind is float else (kind,)
+            if (isinstance(value, bool) and kind is not bool) or not isinstance(value, types):
+                raise ValueError(f"Transcription option {name} must be {kind.__name__}, got {type(value).__name__}")
+            size = len(value) if kind is str else value
+            if kind is not bool and not low <= size <= high:
+                unit = " characters" if kind is str else ""
+                raise ValueError(f"Transcription option {name} must be between {low} and {high}{unit}, got {value!r}")
+            value = kind(value)
+        validated[name] = value
+    return validated
+
+
+class AudioWindows:
+    """Streams audio through ffmpeg as overlapping float32 windows of (offset_s, samples, is_last)
+
+    Only the current window (plus one read ahead to flag the last) is held in memory, so memory
+    is bounded by window_s rather than by the length of the recording.
+    """
+
+    def __init__(self, audio_path: str, window_s: float = 30.0, overlap_s: float = 2.0,
+                 sample_rate: int = SAMPLE_RATE):
+        if not 0 <= overlap_s < window_s:
+            raise ValueError(f"overlap_s must be in [0, window_s), got {overlap_s}")
+        self.audio_path = audio_path
+        self.sample_rate = sample_rate
+        self.window = int(window_s * sample_rate)
+        self.hop = self.window - int(overlap_s * sample_rate)
+        self._process: Optional[subprocess.Popen] = None
+        self._stderr_reader: Optional[threading.Thread] = None
+        # Last lines ffmpeg wrote to stderr, for the error message if it fails
+        self._stderr_tail = deque(maxlen=20)
+        self._closed = False
+
+    def _read(self, samples: int) -> bytes:
+        # Pipe reads can come back short; keep reading until the window is full or ffmpeg is done
+        wanted = samples * 2
+        chunks = []
+        while wanted > 0:
+            chunk = self._process.stdout.read(wanted)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            wanted -= len(chunk)
+        return b"".join(chunks)
+
+    def _drain_stderr(self, stderr):
+        # Read continuously so ffmpeg never blocks on a full stderr pipe while stdout is being read
+        for line in stderr:
+            self._stderr_tail.append(line.decode(errors='replace').rstrip())
+        stderr.close()
+
+    def _check_exit(self):
+        """Raise if ffmpeg failed (called once stdout is exhausted, before the last window goes out)"""
+        returncode = self._process.wait()
+        self._stderr_reader.join()
+        if returncode != 0 and not self._closed:
+            raise RuntimeError(f"ffmpeg could not decode {self.audio_path} (exit code {returncode}): "
+                               f"{' '.join(self._stderr_tail)}")
+
+    def __iter__(self) -> Iterator[Tuple[float, np.ndarray, bool]]:
+        self._process = subprocess.Popen(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", self.audio_path,
+             "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(self.sample_rate), "-"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        self._stderr_reader = threading.Thread(target=self._drain_stderr, args=(self._process.stderr,),
+                                               name="ffmpeg-stderr", daemon=True)
+        self._stderr_reader.start()
+        try:
+            buffer = np.zeros(0, dtype=np.float32)
+            offset = 0
+            pending = None
+            while True:
+                raw = self._read(self.window - len(buffer))
+                raw = raw[:len(raw) // 2 * 2]
+                if not raw and pending is not None:
+                    # Only the overlap of the previous window is left
+                    break
+                samples = np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+                buffer = np.concatenate([buffer, samples])
+                if not len(buffer):
+                    break
+                if pending is not None:
+                    yield pending + (False,)
+                pending = (offset / self.sample_rate, buffer)
+                if len(buffer) < self.window:
+                    break
+                buffer = buffer[self.hop:].copy()
+                offset += self.hop
+            # A decode error part way through fails the stream rather than silently truncating it
+            self._check_exit()
+            if pending is not None:
+                yield pending + (True,)
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop decoding; safe to call from another thread while a read is blocked"""
+        self._closed = True
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+
+
+def stitch_segments(segments: List[Dict], offset_s: float, window_s: float, overlap_s: float,
+                    first: bool, last: bool) -> List[Dict]:
+    """Shift a window's segments to absolute time and drop those owned by a neighbouring window
+
+    Each overlap is split at its midpoint: a segment belongs to the window its midpoint falls in.
+    """
+    lower = float("-inf") if first else offset_s + overlap_s / 2
+    upper = float("inf") if last else offset_s + window_s - overlap_s / 2
+    stitched = []
+    for segment in segments:
+        start, end = segment['start'] + offset_s, segment['end'] + offset_s
+        if lower <= (start + end) / 2 < upper:
+            stitched.append({'start': round(start, 2), 'end': round(end, 2), 'text': segment['text']})
+    return stitched
+
+
+class TranscriptionService:
+    """Resident Whisper transcription: models load once, jobs run from a bounded queue on a worker pool"""
+
+    def __init__(self, model_name: str = "base", workers: int = 1, max_queue_size: int = 32,
+                 device: Optional[str] = None):
+        self.model_name = model_name
+        self.workers = max(1, workers)
+        self.max_queue_size = max_queue_size
+        self.device = device
+        # Whisper installs per-call hooks on the model, so each worker owns its own copy
+        self._models: List = []
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="whisper")
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._total_inference_ms = 0.0
+        self.startup_ms: Dict[str, float] = {}
+
+    def _load_model(self):
+        import whisper
+        return whisper.load_model(self.model_name, device=self.device)
+
+    async def start(self):
+        """Load one model per worker and start the workers"""
+        loop = asyncio.get_running_loop()
+        timer = PhaseTimer()
+        with timer.phase('model_load'):
+            self._models = list(await asyncio.gather(
+                *(loop.run_in_executor(self._executor, self._load_model) for _ in range(self.workers))
+            ))
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._worker_tasks = [asyncio.create_task(self._worker(model)) for model in self._models]
+        self.startup_ms = timer.to_dict()
+        logger.info(f"Transcription service ready: {self.workers} x whisper-{self.model_name} ({timer.summary()})")
+
+    async def _worker(self, model):
+        loop = asyncio.get_running_loop()
+        while True:
+            audio, label, options, future, enqueued = await self._queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                started = time.perf_counter()
+                result = await loop.run_in_executor(self._executor, self._transcribe, model, audio, options)
+                inference_ms = (time.perf_counter() - started) * 1000.0
+                self.completed += 1
+                self._total_inference_ms += inference_ms
+                result['timings'] = {
+                    'queue_wait_ms': round((started - enqueued) * 1000.0, 1),
+                    'inference_ms': round(inference_ms, 1)
+                }
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error transcribing {label}: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def _transcribe(model, audio, options: Dict) -> Dict:
+        # audio is a file path or, for streamed windows, a float32 sample array
+        result = model.transcribe(audio, **options)
+        return {
+            'text': result["text"],
+            'language': result.get("language"),
+            'segments': [
+                {'start': round(segment["start"], 2), 'end': round(segment["end"], 2), 'text': segment["text"]}
+                for segment in result.get("segments", [])
+            ]
+        }
+
+    def _check_ready(self, audio_path: str):
+        if self._queue is None:
+            raise RuntimeError("Transcription service is not started")
+        if not os.path.exists(audio_path):
+            raise FileNotFoundError(f"Audio file not found: {audio_path}")
+
+    async def transcribe(self, audio_path: str, block: bool = False, **options) -> Dict:
+        """Queue a file for transcription and wait for the result
+
+        A full queue raises TranscriptionQueueFull, unless block is set (in-process callers that
+        apply their own backpressure), in which case this waits for space.
+        """
+        self._check_ready(audio_path)
+        future = asyncio.get_running_loop().create_future()
+        job = (audio_path, audio_path, options, future, time.perf_counter())
+        if block:
+            await self._queue.put(job)
+        else:
+            try:
+                self._queue.put_nowait(job)
+            except asyncio.QueueFull:
+                self.rejected += 1
+                raise TranscriptionQueueFull(f"Transcription queue is full ({self.max_queue_size} jobs)")
+        return await future
+
+    @property
+    def started(self) -> bool:
+        return self._queue is not None
+
+    async def transcribe_stream(self, audio_path: str, window_s: float = 30.0, overlap_s: float = 2.0,
+                                **options) -> AsyncIterator[Dict]:
+        """Transcribe a long recording window by window, yielding segments with absolute timestamps in order
+
+        Up to one window per worker is in flight, and decoding only reads that far ahead. Windows
+        wait for queue space instead of being rejected, so a stream is never cut off halfway.
+        """
+        self._check_ready(audio_path)
+        loop = asyncio.get_running_loop()
+        windows = AudioWindows(audio_path, window_s, overlap_s)
+        window_iter = iter(windows)
+        in_flight = deque()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(in_flight) < self.workers:
+                    # Decoding blocks on the ffmpeg pipe, so it runs off the loop (and off the whisper pool)
+                    window = await loop.run_in_executor(None, next, window_iter, None)
+                    if window is None:
+                        exhausted = True
+                        break
+                    offset, samples, last = window
+                    future = loop.create_future()
+                    label = f"{audio_path} @ {offset:.1f}s"
+                    await self._queue.put((samples, label, options, future, time.perf_counter()))
+                    in_flight.append((offset, last, future))
+                    exhausted = last
+                if not in_flight:
+                    break
+                offset, last, future = in_flight.popleft()
+                result = await future
+                for segment in stitch_segments(result['segments'], offset, window_s, overlap_s, offset == 0, last):
+                    yield segment
+        finally:
+            for _, _, future in in_flight:
+                future.cancel()
+            windows.close()
+
+    def get_stats(self) -> Dict:
+        return {
+            'model': self.model_name,
+            'workers': self.workers,
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'max_queue_size': self.max_queue_size,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'avg_inference_ms': round(self._total_inference_ms / self.completed, 1) if self.completed else 0.0,
+            'startup_ms': self.startup_ms
+        }
+
+    async def close(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+
+
+class TranscriptionServer:
+    """Websocket front end for TranscriptionService, using the MCP server's message conventions"""
+
+    def __init__(self, service: TranscriptionService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        self.service = service
+        self.host = host
+        self.port = port
+
+    async def start_server(self):
+        await self.service.start()
+        server = await websockets.serve(self.handle_client, self.host, self.port)
+        logger.info(f"Transcription server started on ws://{self.host}:{self.port}")
+        return server
+
+    async def handle_client(self, websocket, path=None):
+        tasks = set()
+        try:
+            async for message in websocket:
+                # Jobs from one connection run concurrently; replies carry the request_id
+                task = asyncio.create_task(self.process_message(websocket, message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            for task in list(tasks):
+                task.cancel()
+
+    async def process_message(self, websocket, message: str):
+        request_id = None
+        try:
+            data = json.loads(message)
+            request_id = data.get('request_id')
+            message_type = data.get('type')
+            if message_type == 'transcribe':
+                result = await self.service.transcribe(data['audio_path'],
+                                                       **validate_transcribe_options(data.get('options')))
+                response = {'type': 'transcription', 'status': 'success', **result}
+            elif message_type == 'transcribe_stream':
+                response = await self._stream_transcription(websocket, data, request_id)
+            elif message_type == 'stats':
+                response = {'type': 'stats', 'status': 'success', 'stats': self.service.get_stats()}
+            else:
+                response = {'type': 'error', 'status': 'error', 'message': 'Unknown message type'}
+        except TranscriptionQueueFull as e:
+            response = {'type': 'error', 'status': 'busy', 'message': str(e)}
+        except Exception as e:
+            logger.error(f"Error processing transcription message: {e}")
+            response = {'type': 'error', 'status': 'error', 'message': str(e)}
+        if request_id is not None:
+            response['request_id'] = request_id
+        try:
+            await websocket.send(json.dumps(response))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+
+    async def _stream_transcription(self, websocket, data: Dict, request_id: Optional[str]) -> Dict:
+        """Send each segment as a transcription_segment message as soon as its window is done"""
+        started = time.perf_counter()
+        count = 0
+        duration = 0.0
+        async for segment in self.service.transcribe_stream(
+                data['audio_path'], data.get('window_s', 30.0), data.get('overlap_s', 2.0),
+                **validate_transcribe_options(data.get('options'))):
+            message = {'type': 'transcription_segment', 'status': 'success', **segment}
+            if request_id is not None:
+                message['request_id'] = request_id
+            await websocket.send(json.dumps(message))
+            count += 1
+            duration = segment['end']
+        return {'type': 'transcription_complete', 'status': 'success', 'segments': count, 'duration': duration,
+                'timings': {'total_ms': round((time.perf_counter() - started) * 1000.0, 1)}}
+
+
+async def main():
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Resident Whisper transcription service")
+    parser.add_argument("--model", default=os.getenv('WHISPER_MODEL', 'base'))
+    parser.add_argument("--workers", type=int, default=int(os.getenv('TRANSCRIPTION_WORKERS', '1')))
+    parser.add_argument("--max-queue-size", type=int, default=32)
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    service = TranscriptionService(args.model, args.workers, args.max_queue_size)
+    server = TranscriptionServer(service, args.host, args.port)
+    websocket_server = await server.start_server()
+    try:
+        await websocket_server.wait_closed()
+    finally:
+        await service.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Transcription server stopped by user")
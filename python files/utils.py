@@ -0,0 +1,29 @@
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+class PhaseTimer:
+    """Records wall-clock duration of named phases (e.g. startup steps)"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - start) * 1000.0
+
+    def total_ms(self) -> float:
+        return sum(self.phases.values())
+
+    def to_dict(self) -> Dict[str, float]:
+        result = {name: round(ms, 1) for name, ms in self.phases.items()}
+        result['total'] = round(self.total_ms(), 1)
+        return result
+
+    def summary(self) -> str:
+        return ", ".join(f"{name}={ms:.0f}ms" for name, ms in self.to_dict().items())
@@ -0,0 +1,15 @@
+import importlib.util
+import os
+import sys
+
+# The Python sources live in "python files/", which is not an importable name; expose it as
+# the package "pyfiles" so the tests can use the same relative imports as the server
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python files")
+
+if "pyfiles" not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        "pyfiles", os.path.join(PACKAGE_DIR, "__init__.py"), submodule_search_locations=[PACKAGE_DIR]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["pyfiles"] = package
+    spec.loader.exec_module(package)
@@ -0,0 +1,71 @@
+import os
+import stat
+import threading
+
+import numpy as np
+import pytest
+
+from pyfiles.transcription.service import AudioWindows
+
+SAMPLE_RATE = 100
+
+# Stands in for ffmpeg: the "audio" file already holds raw s16le samples. FFMPEG_NOISE bytes of
+# stderr are written first (more than a pipe buffer holds), and FFMPEG_EXIT sets the exit code.
+FAKE_FFMPEG = """#!/bin/sh
+while [ "$1" != "-i" ]; do shift; done
+head -c "${FFMPEG_NOISE:-0}" /dev/zero | tr '\\0' 'e' >&2
+echo "decode error near the end" >&2
+cat "$2"
+exit "${FFMPEG_EXIT:-0}"
+"""
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    script = tmp_path / "bin" / "ffmpeg"
+    script.parent.mkdir()
+    script.write_text(FAKE_FFMPEG)
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{script.parent}{os.pathsep}{os.environ['PATH']}")
+    audio = tmp_path / "audio.raw"
+    audio.write_bytes(np.arange(250, dtype=np.int16).tobytes())
+    return str(audio)
+
+
+def _collect(windows):
+    result = {}
+
+    def run():
+        try:
+            result['windows'] = list(windows)
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive(), "AudioWindows blocked on the ffmpeg pipes"
+    return result
+
+
+def test_windows_cover_the_recording(fake_ffmpeg):
+    result = _collect(AudioWindows(fake_ffmpeg, window_s=1.0, overlap_s=0.2, sample_rate=SAMPLE_RATE))
+    windows = result['windows']
+    assert [(offset, len(samples), last) for offset, samples, last in windows] == [
+        (0.0, 100, False), (0.8, 100, False), (1.6, 90, True)]
+    assert windows[-1][1][-1] == pytest.approx(249 / 32768.0)
+
+
+def test_chatty_ffmpeg_does_not_block(fake_ffmpeg, monkeypatch):
+    monkeypatch.setenv("FFMPEG_NOISE", str(256 * 1024))
+    result = _collect(AudioWindows(fake_ffmpeg, window_s=1.0, overlap_s=0.2, sample_rate=SAMPLE_RATE))
+    assert len(result['windows']) == 3
+
+
+def test_failed_decode_raises_with_stderr(fake_ffmpeg, monkeypatch):
+    monkeypatch.setenv("FFMPEG_NOISE", str(256 * 1024))
+    monkeypatch.setenv("FFMPEG_EXIT", "1")
+    result = _collect(AudioWindows(fake_ffmpeg, window_s=1.0, overlap_s=0.2, sample_rate=SAMPLE_RATE))
+    assert isinstance(result['error'], RuntimeError)
+    assert "exit code 1" in str(result['error'])
+    assert "decode error near the end" in str(result['error'])
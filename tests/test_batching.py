@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from pyfiles.models.batching import MicroBatcher
+
+
+def test_close_fails_items_collected_into_an_unfinished_batch():
+    async def scenario():
+        async def process(items):
+            return [item * 2 for item in items]
+
+        # A long wait keeps the first items in the batch being collected
+        batcher = MicroBatcher(process, max_batch_size=8, max_wait_ms=10_000)
+        calls = [asyncio.create_task(batcher.submit(n)) for n in range(3)]
+        await asyncio.sleep(0.01)
+        assert batcher.get_stats()['queue_depth'] == 0
+        await batcher.close()
+        return await asyncio.wait_for(asyncio.gather(*calls, return_exceptions=True), timeout=1)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_close_lets_a_running_batch_finish_and_fails_the_rest():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def process(items):
+            await release.wait()
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(process, max_batch_size=2, max_wait_ms=0, max_queue_size=2)
+        running = [asyncio.create_task(batcher.submit(n)) for n in (1, 2)]
+        await asyncio.sleep(0.01)
+        # Two items fill the queue, the third waits for queue space
+        waiting = [asyncio.create_task(batcher.submit(n)) for n in (3, 4, 5)]
+        await asyncio.sleep(0.01)
+        closing = asyncio.create_task(batcher.close())
+        await asyncio.sleep(0.01)
+        release.set()
+        await closing
+        results = await asyncio.wait_for(asyncio.gather(*running, *waiting, return_exceptions=True), timeout=1)
+        with pytest.raises(RuntimeError):
+            await batcher.submit(6)
+        return results
+
+    results = asyncio.run(scenario())
+    assert results[:2] == [2, 4]
+    assert all(isinstance(result, RuntimeError) for result in results[2:])
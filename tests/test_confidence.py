@@ -0,0 +1,65 @@
+import gc
+
+import torch
+
+from pyfiles.models import inference
+from pyfiles.models.inference import medication_token_mask, medication_token_sequences, sequence_confidence
+
+# Toy subword tokenizations: "Metformin" is "Met" + "formin", and "Met" (1) also starts ordinary words
+TOKENIZATIONS = {"metformin": [1, 2], "aspirin": [4]}
+
+
+class Encoding:
+    def __init__(self, input_ids):
+        self.input_ids = input_ids
+
+
+class SubwordTokenizer:
+    def __call__(self, text, add_special_tokens=False):
+        return Encoding(TOKENIZATIONS[text.strip().lower()])
+
+
+def test_only_whole_names_are_medication_tokens():
+    sequences = medication_token_sequences(SubwordTokenizer(), ["Metformin", "Aspirin"])
+    assert {length: patterns.tolist() for length, patterns in sequences.items()} == {1: [[4]], 2: [[1, 2]]}
+
+    # Metabolic, Metformin, daily, Aspirin
+    generated = torch.tensor([[1, 3, 1, 2, 5, 4]])
+    assert medication_token_mask(generated, sequences).tolist() == [[False, False, True, True, False, True]]
+
+
+def test_confidence_averages_medication_tokens():
+    sequences = medication_token_sequences(SubwordTokenizer(), ["Metformin"])
+    prompt = torch.tensor([[5, 5]])
+    generated = [1, 3, 1, 2, 0]
+    sequences_tensor = torch.cat([prompt, torch.tensor([generated])], dim=1)
+    # Each chosen token gets probability 1/2, except the second "Met"+"formin" pair at 0.9 each
+    scores = []
+    for step, token in enumerate(generated):
+        logits = torch.full((1, 6), -1e9)
+        high = 0.9 if step in (2, 3) else 0.5
+        logits[0, token] = torch.log(torch.tensor(high))
+        logits[0, (token + 1) % 6] = torch.log(torch.tensor(1 - high))
+        scores.append(logits)
+
+    result = sequence_confidence(sequences_tensor, tuple(scores), prompt.shape[1], 0, sequences)[0]
+    assert result['medication_tokens'] == 2
+    assert result['generated_tokens'] == 5  # the EOS counts, padding after it would not
+    assert abs(result['confidence'] - 0.9) < 1e-4
+
+
+def test_lexicon_sequences_are_cached_per_tokenizer(monkeypatch):
+    class Lexicon:
+        names = ["Aspirin"]
+
+    monkeypatch.setattr(inference, "default_extractor", lambda: Lexicon)
+    tokenizer = SubwordTokenizer()
+    first = medication_token_sequences(tokenizer)
+    assert medication_token_sequences(tokenizer) is first
+    # Explicit name lists are not cached under the tokenizer
+    assert medication_token_sequences(tokenizer, ["Metformin"]) is not first
+    assert medication_token_sequences(tokenizer) is first
+
+    del tokenizer
+    gc.collect()
+    assert len(inference._medication_token_sequences) == 0
@@ -0,0 +1,103 @@
+import json
+import sqlite3
+
+import pytest
+
+from pyfiles.Database.database_manager import MedicalDatabase
+from pyfiles.data_models.data_models import DoctorFeedback, PatientInput, Prescription
+
+
+def _patient():
+    return PatientInput(symptoms="cough", age=40, gender="female", diagnosis="bronchitis")
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    """A database with the original schema (no migrations) and some legacy rows"""
+    path = str(tmp_path / "medical.db")
+    database = MedicalDatabase(path, migrate=False)
+    patient_id = database.save_patient_input(_patient())
+    first = database.save_prescription(Prescription(["Metformin", "Aspirin"], 0.9, "1.0"), patient_id)
+    second = database.save_prescription(Prescription(["metformin"], 0.8, "1.0"), patient_id)
+    database.save_doctor_feedback(DoctorFeedback(["Aspirin"], ["Aspirin", "Vitamin D"], "", "dr", _patient()), first)
+    database.close()
+
+    # Rows the backfill must skip rather than fail on
+    conn = sqlite3.connect(path)
+    for medications in ('not json', '{"name": "Aspirin"}', '"Aspirin"', '[1, null, "Ibuprofen"]'):
+        conn.execute('''
+            INSERT INTO prescriptions (patient_input_id, medications, confidence, model_version, timestamp)
+            VALUES (?, ?, 0.5, '1.0', '2024-01-01T00:00:00')
+        ''', (patient_id, medications))
+    conn.commit()
+    conn.close()
+    return path, first, second
+
+
+def test_migration_upgrades_a_baseline_database(baseline_db):
+    path, first, second = baseline_db
+    database = MedicalDatabase(path)
+    try:
+        assert database.apply_migrations() == 2
+        assert database.get_prescription(first).medications == ["Metformin", "Aspirin"]
+        # Case variants share one dictionary entry but keep their own spelling
+        assert database.get_prescription(second).medications == ["metformin"]
+        assert set(database.find_prescriptions_by_medication(" METFORMIN ")) == {first, second}
+        assert set(database.find_prescriptions_by_medication("ibuprofen")) == {second + 4}
+        assert database.get_model_stats()['total_prescriptions'] == 6
+
+        with database.connection() as conn:
+            names = [row[0] for row in conn.execute('SELECT name FROM medications ORDER BY id')]
+            links = conn.execute('''
+                SELECT fm.modified, m.name FROM feedback_medications fm
+                JOIN medications m ON m.id = fm.medication_id
+                ORDER BY fm.modified, fm.position
+            ''').fetchall()
+        assert names == ["Metformin", "Aspirin", "Ibuprofen", "Vitamin D"]
+        assert links == [(0, "Aspirin"), (1, "Aspirin"), (1, "Vitamin D")]
+    finally:
+        database.close()
+
+
+def test_new_feedback_is_linked_to_the_dictionary(tmp_path):
+    database = MedicalDatabase(str(tmp_path / "medical.db"))
+    try:
+        patient_id = database.save_patient_input(_patient())
+        prescription_id = database.save_prescription(Prescription(["Lisinopril"], 0.9, "1.0"), patient_id)
+        feedback_id = database.save_doctor_feedback(
+            DoctorFeedback(["Lisinopril"], ["lisinopril", "Amlodipine"], "", "dr", _patient()), prescription_id)
+
+        with database.connection() as conn:
+            links = conn.execute('''
+                SELECT modified, position, COALESCE(spelling, m.name) FROM feedback_medications
+                JOIN medications m ON m.id = medication_id
+                WHERE feedback_id = ? ORDER BY modified, position
+            ''', (feedback_id,)).fetchall()
+            count = conn.execute('SELECT COUNT(*) FROM medications').fetchone()[0]
+        assert links == [(0, 0, "Lisinopril"), (1, 0, "lisinopril"), (1, 1, "Amlodipine")]
+        assert count == 2
+        assert json.loads(database.get_feedback_for_training()[0]['modified_prescription']) == [
+            "lisinopril", "Amlodipine"]
+    finally:
+        database.close()
+
+
+def test_feedback_committed_late_is_not_skipped_by_the_training_cursor(tmp_path):
+    database = MedicalDatabase(str(tmp_path / "medical.db"))
+    try:
+        patient_id = database.save_patient_input(_patient())
+        prescription_id = database.save_prescription(Prescription(["Aspirin"], 0.9, "1.0"), patient_id)
+
+        def feedback(notes, timestamp):
+            return DoctorFeedback(["Aspirin"], ["Aspirin"], notes, "dr", _patient(), timestamp=timestamp)
+
+        database.save_doctor_feedback(feedback("first", "2024-01-01T10:00:02"), prescription_id)
+        cursor = [record.key for record in database.iter_feedback_for_training()][-1]
+        # Handled before "first" but committed after the cursor was taken, as write-behind does
+        database.save_doctor_feedback(feedback("late", "2024-01-01T10:00:01"), prescription_id)
+
+        assert [record.feedback_notes for record in database.iter_feedback_for_training(after=cursor)] == ["late"]
+        assert [record.feedback_notes for record in database.iter_feedback_for_training(chunk_size=1)] == [
+            "first", "late"]
+    finally:
+        database.close()
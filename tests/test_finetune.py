@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+from pyfiles.models.finetune import MANIFEST_FILE, adapter_path, fine_tune, validate_training_options
+from pyfiles.models.model import BioGPTModelManager
+
+MODEL_NAME = "org/biogpt-test"
+
+
+def _write_adapter(adapter_dir, version, created_at):
+    path = adapter_path(MODEL_NAME, version, str(adapter_dir))
+    os.makedirs(path)
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+        json.dump({'model_name': MODEL_NAME, 'version': version, 'created_at': created_at,
+                   'last_key': None, 'total_records': 0}, f)
+    return path
+
+
+def test_training_options_accept_known_hyperparameters():
+    assert validate_training_options({'batch_size': 8, 'learning_rate': 0.001}) == {'batch_size': 8, 'learning_rate': 0.001}
+    assert validate_training_options(None) == {}
+
+
+@pytest.mark.parametrize("options", [
+    {'db_path': '/etc'},
+    {'adapter_dir': '/'},
+    {'model_name': '../x'},
+    {'version': '../../x'},
+    {'batch_size': '8'},
+    {'batch_size': True},
+    {'batch_size': 0},
+    {'learning_rate': 1.0},
+])
+def test_training_options_reject_unknown_keys_types_and_ranges(options):
+    with pytest.raises(ValueError):
+        validate_training_options(options)
+
+
+def test_fine_tune_refuses_an_existing_version(tmp_path):
+    _write_adapter(tmp_path, "1.1", "2026-01-01T00:00:00")
+    with pytest.raises(FileExistsError):
+        fine_tune(str(tmp_path / "unused.db"), MODEL_NAME, "1.1", adapter_dir=str(tmp_path))
+
+
+def test_manager_resumes_on_latest_trained_version(tmp_path):
+    _write_adapter(tmp_path, "1.1", "2026-01-01T00:00:00")
+    latest = _write_adapter(tmp_path, "1.2", "2026-02-01T00:00:00")
+    manager = BioGPTModelManager(model_name=MODEL_NAME, use_mock=True, adapter_dir=str(tmp_path))
+    assert manager.current_version == "1.2"
+    assert manager.adapter == latest
+    assert manager._next_training_version() == "1.3"
+
+
+def test_next_training_version_skips_existing_adapters(tmp_path):
+    manager = BioGPTModelManager(model_name=MODEL_NAME, use_mock=True, adapter_dir=str(tmp_path))
+    assert manager.current_version == "1.0"
+    _write_adapter(tmp_path, "1.1", "2026-01-01T00:00:00")
+    manager.current_version = "1.0"
+    assert manager._next_training_version() == "1.2"
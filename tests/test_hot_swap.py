@@ -0,0 +1,93 @@
+import asyncio
+import os
+
+import pytest
+
+from pyfiles.models.finetune import adapter_path
+from pyfiles.models import model as model_module
+from pyfiles.models.model import BioGPTModelManager
+from pyfiles.models.paths import contained_path, validate_version
+from pyfiles.models.snapshot import snapshot_path
+from pyfiles.utils import PhaseTimer
+
+
+@pytest.mark.parametrize("version", ["1", "1.0", "2.10.3"])
+def test_dotted_versions_are_valid(version):
+    assert validate_version(version) == version
+
+
+@pytest.mark.parametrize("version", ["../../x", "1.0/../..", "", "1..2", "v1", None, 1.1])
+def test_other_versions_are_rejected(version):
+    with pytest.raises(ValueError):
+        validate_version(version)
+
+
+def test_versioned_paths_stay_inside_their_directory(tmp_path):
+    with pytest.raises(ValueError):
+        adapter_path("org/model", "../../x", str(tmp_path))
+    with pytest.raises(ValueError):
+        snapshot_path("org/model", "../../x", str(tmp_path))
+    with pytest.raises(ValueError):
+        contained_path(str(tmp_path), "..", "elsewhere")
+    assert adapter_path("org/model", "1.2", str(tmp_path)).startswith(str(tmp_path.resolve()))
+
+
+def test_hot_swap_rejects_path_like_versions(tmp_path):
+    manager = BioGPTModelManager(model_name="org/model", use_mock=True, adapter_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        asyncio.run(manager.hot_swap("../../x"))
+    assert manager.current_version == "1.0"
+
+
+def test_mock_hot_swap_switches_version_and_clears_cache(tmp_path):
+    manager = BioGPTModelManager(model_name="org/model", use_mock=True, adapter_dir=str(tmp_path))
+    manager.cache.put("1.0|key", (("Aspirin",), 0.9))
+    swap = asyncio.run(manager.hot_swap("1.1"))
+    assert (swap['from_version'], swap['to_version']) == ("1.0", "1.1")
+    assert manager.get_model_info()['version'] == "1.1"
+    assert manager.get_model_info()['hot_swap']['last'] == swap
+    assert manager.cache.get("1.0|key") is None
+
+
+def _adapter_manager(tmp_path, **kwargs):
+    return BioGPTModelManager(model_name="org/model", use_mock=True, adapter_dir=str(tmp_path / "adapters"),
+                              snapshot_dir=str(tmp_path / "snapshots"), optimized_cache_dir=str(tmp_path / "cache"),
+                              **kwargs)
+
+
+def test_adapter_swap_keeps_the_configured_load_mode(tmp_path, monkeypatch):
+    manager = _adapter_manager(tmp_path, load_mode="merged", quantization="int8")
+    path = adapter_path("org/model", "1.1", str(tmp_path / "adapters"))
+    os.makedirs(path)
+    built = []
+    monkeypatch.setattr(model_module, "ensure_merged_model", lambda *args: built.append(args))
+
+    options = manager._swap_load_options("1.1", "adapter")
+    assert (options['load_mode'], options['quantization'], options['adapter']) == ("merged", "int8", path)
+
+    async def prepare():
+        await manager._prepare_swap(asyncio.get_running_loop(), options, PhaseTimer())
+
+    asyncio.run(prepare())
+    assert built[0][2:] == ("int8", str(tmp_path / "cache"), "1.1", path)
+
+
+def test_snapshot_of_an_unknown_version_is_not_built_from_the_base_adapter(tmp_path, monkeypatch):
+    manager = _adapter_manager(tmp_path)
+    builds = []
+    monkeypatch.setattr(model_module, "build_snapshot", lambda *args, **kwargs: builds.append(kwargs['adapter']))
+
+    async def prepare(version=None):
+        await manager._prepare_snapshot(asyncio.get_running_loop(), version)
+
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(prepare("1.4"))
+    # The version being served from model_name's own adapter may still be built from it
+    asyncio.run(prepare())
+    asyncio.run(prepare("1.0"))
+    assert builds == ["", ""]
+
+    path = adapter_path("org/model", "1.4", str(tmp_path / "adapters"))
+    os.makedirs(path)
+    asyncio.run(prepare("1.4"))
+    assert builds[-1] == path
@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+import websockets
+
+from pyfiles.client.mcp_client import MCPClient
+
+
+async def _reverse_order_server(websocket, path=None):
+    """Collects two requests, sends an id-less error, then answers them in reverse order"""
+    requests = [json.loads(await websocket.recv()) for _ in range(2)]
+    await websocket.send(json.dumps({'type': 'error', 'status': 'error', 'message': 'Invalid JSON format'}))
+    for request in reversed(requests):
+        await websocket.send(json.dumps({'type': 'echo', 'value': request['value'],
+                                         'request_id': request['request_id']}))
+
+
+def test_replies_are_routed_by_request_id():
+    async def main():
+        server = await websockets.serve(_reverse_order_server, "localhost", 0)
+        port = server.sockets[0].getsockname()[1]
+        unmatched = []
+        client = MCPClient(f"ws://localhost:{port}", on_unmatched=unmatched.append)
+        assert await client.connect()
+        try:
+            first, second = await asyncio.wait_for(asyncio.gather(
+                client.request({'type': 'echo', 'value': 1}),
+                client.request({'type': 'echo', 'value': 2})
+            ), timeout=5)
+        finally:
+            await client.disconnect()
+            server.close()
+            await server.wait_closed()
+        return first, second, unmatched
+
+    first, second, unmatched = asyncio.run(main())
+    assert (first['type'], first['value']) == ('echo', 1)
+    assert (second['type'], second['value']) == ('echo', 2)
+    # The id-less error went to the handler, not to the oldest pending request
+    assert [m['message'] for m in unmatched] == ['Invalid JSON format']
+
+
+def test_pending_requests_fail_when_the_connection_closes():
+    async def close_immediately(websocket, path=None):
+        await websocket.recv()
+        await websocket.close()
+
+    async def main():
+        server = await websockets.serve(close_immediately, "localhost", 0)
+        port = server.sockets[0].getsockname()[1]
+        client = MCPClient(f"ws://localhost:{port}")
+        await client.connect()
+        try:
+            await asyncio.wait_for(client.request({'type': 'model_info'}), timeout=5)
+        except Exception as e:
+            return str(e), client.in_flight
+        finally:
+            await client.disconnect()
+            server.close()
+            await server.wait_closed()
+
+    assert asyncio.run(main()) == ("Connection closed", 0)
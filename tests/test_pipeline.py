@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from pyfiles.mcp_server.pipeline import VoicePrescriptionPipeline
+from pyfiles.models.model import BioGPTModelManager
+
+TRANSCRIPTS = {
+    "a.wav": "45 year old woman with fever and cough, diagnosis influenza",
+    "b.wav": "45 year old woman with fever and cough, diagnosis influenza",
+    "c.wav": "a 60 year old man with chest pain and hypertension",
+}
+
+
+class FakeTranscription:
+    workers = 2
+
+    def __init__(self):
+        self.started = False
+
+    async def start(self):
+        self.started = True
+
+    async def transcribe(self, audio_path, block=False):
+        await asyncio.sleep(0)
+        return {'text': TRANSCRIPTS[audio_path], 'segments': []}
+
+    def get_stats(self):
+        return {}
+
+    async def close(self):
+        pass
+
+
+def test_pipeline_generates_through_the_model_manager():
+    async def scenario():
+        manager = BioGPTModelManager(use_mock=True)
+        calls = []
+        generate = manager.generate_prescription
+
+        async def counting_generate(patient_input):
+            calls.append(patient_input)
+            return await generate(patient_input)
+
+        manager.generate_prescription = counting_generate
+        pipeline = VoicePrescriptionPipeline(FakeTranscription(), manager)
+        await pipeline.start()
+        try:
+            first = await pipeline.submit("a.wav")
+            second, third = await asyncio.gather(pipeline.submit("b.wav"), pipeline.submit("c.wav"))
+            return manager, calls, first, second, third, pipeline.get_stats()
+        finally:
+            await pipeline.close()
+
+    manager, calls, first, second, third, stats = asyncio.run(scenario())
+    assert len(calls) == 3
+    assert first['patient_input'].age == 45 and first['patient_input'].gender == "female"
+    assert third['patient_input'].gender == "male"
+    # The repeated consultation is answered from the manager's prescription cache
+    assert manager.cache.get_stats()['hits'] == 1
+    assert second['prescription'].medications == first['prescription'].medications
+    assert stats['completed'] == 3 and 'generation_ms' in stats['avg_timings_ms']
+
+
+class StalledTranscription(FakeTranscription):
+    workers = 1
+
+    async def transcribe(self, audio_path, block=False):
+        await asyncio.Event().wait()
+
+
+def test_close_fails_pending_submits():
+    async def scenario():
+        # One in transcription, one waiting in the audio queue, one waiting for queue space
+        pipeline = VoicePrescriptionPipeline(StalledTranscription(), BioGPTModelManager(use_mock=True),
+                                             max_queue_size=1)
+        await pipeline.start()
+        submits = [asyncio.create_task(pipeline.submit(path)) for path in ("a.wav", "b.wav", "c.wav")]
+        await asyncio.sleep(0.01)
+        await pipeline.close()
+        results = await asyncio.wait_for(asyncio.gather(*submits, return_exceptions=True), timeout=1)
+        with pytest.raises(RuntimeError, match="closed"):
+            await pipeline.submit("a.wav")
+        return results, pipeline.get_stats()
+
+    results, stats = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) and "closed" in str(result) for result in results)
+    assert stats['failed'] == 3
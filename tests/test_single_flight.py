@@ -0,0 +1,76 @@
+import asyncio
+
+from pyfiles.models.cache import SingleFlight
+
+
+def test_concurrent_callers_share_one_run():
+    async def main():
+        flight = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(main())
+    assert calls == 1
+    assert results == ["result"] * 5
+    assert flight.get_stats() == {'in_flight': 0, 'leaders': 1, 'coalesced_requests': 4}
+
+
+def test_cancelled_first_caller_does_not_cancel_followers():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "result"
+
+        leader = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return leader, await follower
+
+    leader, result = asyncio.run(main())
+    assert leader.cancelled()
+    assert result == "result"
+
+
+def test_errors_reach_every_caller_and_clear_the_key():
+    async def main():
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(flight.do("key", work), flight.do("key", work), return_exceptions=True)
+        return flight, results
+
+    flight, results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flight.get_stats()['in_flight'] == 0
+
+
+def test_key_is_reusable_after_completion():
+    async def main():
+        flight = SingleFlight()
+        counter = iter(range(10))
+
+        async def work():
+            return next(counter)
+
+        return await flight.do("key", work), await flight.do("key", work)
+
+    assert asyncio.run(main()) == (0, 1)
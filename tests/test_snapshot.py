@@ -0,0 +1,81 @@
+import json
+import os
+
+from pyfiles.models import inference
+from pyfiles.models.optimize import ensure_merged_model, merged_snapshot_dir
+from pyfiles.models.paths import replace_directory, safe_model_name
+from pyfiles.models.snapshot import build_snapshot, list_snapshots, snapshot_exists, snapshot_path
+
+
+class FakeModel:
+    def __init__(self, marker):
+        self.marker = marker
+
+    def to(self, dtype):
+        return self
+
+    def save_pretrained(self, path, **kwargs):
+        with open(os.path.join(path, "model.safetensors"), "w") as f:
+            f.write(self.marker)
+
+
+class FakeTokenizer:
+    def save_pretrained(self, path):
+        with open(os.path.join(path, "tokenizer.json"), "w") as f:
+            f.write("{}")
+
+
+def test_safe_model_name():
+    assert safe_model_name("org/biogpt finetune") == "org--biogpt--finetune"
+
+
+def test_replace_directory_swaps_contents(tmp_path):
+    path, new_path = tmp_path / "1.0", tmp_path / "1.0.tmp"
+    path.mkdir()
+    (path / "old.txt").write_text("old")
+    new_path.mkdir()
+    (new_path / "new.txt").write_text("new")
+
+    replace_directory(str(new_path), str(path))
+
+    assert sorted(os.listdir(tmp_path)) == ["1.0"]
+    assert os.listdir(path) == ["new.txt"]
+
+
+def test_rebuilding_a_snapshot_replaces_it(tmp_path):
+    snapshot_dir = str(tmp_path)
+    build_snapshot("org/model", "1.0", snapshot_dir=snapshot_dir, model=FakeModel("first"), tokenizer=FakeTokenizer())
+    path = build_snapshot("org/model", "1.0", snapshot_dir=snapshot_dir, model=FakeModel("second"),
+                          tokenizer=FakeTokenizer())
+
+    with open(os.path.join(path, "model.safetensors")) as f:
+        assert f.read() == "second"
+    assert os.listdir(os.path.dirname(path)) == ["1.0"]
+    assert [manifest['version'] for manifest in list_snapshots(snapshot_dir)] == ["1.0"]
+
+
+def test_leftover_build_directories_are_not_listed(tmp_path):
+    path = build_snapshot("org/model", "1.0", snapshot_dir=str(tmp_path), model=FakeModel("x"),
+                          tokenizer=FakeTokenizer())
+    os.rename(path, path + ".tmp")
+    assert list_snapshots(str(tmp_path)) == []
+
+
+def test_merged_cache_is_a_snapshot(tmp_path, monkeypatch):
+    loads = []
+
+    def fake_load_biogpt(model_name, hf_token="", adapter=""):
+        loads.append(adapter)
+        return FakeTokenizer(), FakeModel("merged")
+
+    monkeypatch.setattr(inference, "load_biogpt", fake_load_biogpt)
+    cache_dir = str(tmp_path)
+
+    path = ensure_merged_model("org/model", quantization="bf16", cache_dir=cache_dir, version="1.2", adapter="/a")
+    assert ensure_merged_model("org/model", quantization="bf16", cache_dir=cache_dir, version="1.2") == path
+
+    assert loads == ["/a"]
+    assert path == snapshot_path("org/model", "1.2", merged_snapshot_dir(cache_dir, "bfloat16"))
+    assert snapshot_exists("org/model", "1.2", merged_snapshot_dir(cache_dir, "bfloat16"))
+    with open(os.path.join(path, "manifest.json")) as f:
+        assert json.load(f)['dtype'] == "bfloat16"
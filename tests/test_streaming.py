@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from pyfiles.data_models.data_models import PatientInput
+from pyfiles.models.model import BioGPTModelManager
+
+
+def _patient():
+    return PatientInput(symptoms="fever, cough", age=30, gender="female", diagnosis="influenza")
+
+
+async def _stream(manager):
+    return [message async for message in manager.stream_prescription(_patient())]
+
+
+def test_a_streamed_request_looks_the_cache_up_once():
+    manager = BioGPTModelManager(use_mock=True)
+    first = asyncio.run(_stream(manager))
+    second = asyncio.run(_stream(manager))
+
+    assert first[-1][0] == second[-1][0] == 'final'
+    assert first[-1][1].medications == second[-1][1].medications
+    assert [kind for kind, _ in first[:-1]] == ['partial'] * len(first[-1][1].medications)
+    stats = manager.cache.get_stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_a_real_model_cache_hit_is_counted_once():
+    manager = BioGPTModelManager(use_mock=True)
+    manager.use_mock = False
+    manager.model = object()  # never called: the answer is already cached
+    manager.cache.put(manager.cache_key(_patient()), (("Oseltamivir 75mg",), 0.9))
+
+    messages = asyncio.run(_stream(manager))
+
+    assert [kind for kind, _ in messages] == ['final']
+    assert messages[0][1].medications == ["Oseltamivir 75mg"]
+    stats = manager.cache.get_stats()
+    assert (stats['hits'], stats['misses']) == (1, 0)
+
+
+@pytest.mark.parametrize("executor_type", ["process", "replicas"])
+def test_streaming_is_refused_for_worker_process_executors(executor_type):
+    manager = BioGPTModelManager(use_mock=True, executor_type=executor_type)
+    manager.use_mock = False  # as if the model had loaded into worker processes
+    assert not manager.streaming_supported
+    with pytest.raises(ValueError, match=executor_type):
+        asyncio.run(_stream(manager))
+    assert manager.cache.get_stats()['misses'] == 0
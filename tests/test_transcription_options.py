@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+import pytest
+
+from pyfiles.transcription.service import TranscriptionServer, validate_transcribe_options
+
+
+def test_allowed_options_pass():
+    options = {'language': "en", 'task': "translate", 'temperature': 0, 'condition_on_previous_text': False}
+    assert validate_transcribe_options(options) == options
+    assert isinstance(validate_transcribe_options({'temperature': 0})['temperature'], float)
+    assert validate_transcribe_options(None) == {}
+
+
+@pytest.mark.parametrize("options", [
+    {'block': True},
+    {'beam_size': 5},
+    {'task': "summarize"},
+    {'temperature': 2.0},
+    {'temperature': True},
+    {'language': 3},
+    {'condition_on_previous_text': "yes"},
+    ["language", "en"],
+])
+def test_other_options_are_rejected(options):
+    with pytest.raises(ValueError):
+        validate_transcribe_options(options)
+
+
+class FakeService:
+    def __init__(self):
+        self.calls = []
+
+    async def transcribe(self, audio_path, block=False, **options):
+        self.calls.append((block, options))
+        return {'text': "ok", 'segments': []}
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+@pytest.mark.parametrize("options, status", [({'block': True}, "error"), ({'language': "en"}, "success")])
+def test_server_passes_only_validated_options(options, status):
+    service, websocket = FakeService(), FakeWebSocket()
+    server = TranscriptionServer(service)
+    message = {'type': 'transcribe', 'audio_path': "a.wav", 'options': options, 'request_id': "1"}
+    asyncio.run(server.process_message(websocket, json.dumps(message)))
+
+    assert websocket.sent[0]['status'] == status
+    assert websocket.sent[0]['request_id'] == "1"
+    assert service.calls == ([(False, options)] if status == "success" else [])
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from pyfiles.Database.async_database import AsyncMedicalDatabase
+from pyfiles.Database.database_manager import MedicalDatabase
+from pyfiles.Database.write_behind import WriteBehindBuffer
+from pyfiles.data_models.data_models import DoctorFeedback, PatientInput, Prescription
+
+
+def _patient(symptoms="fever"):
+    return PatientInput(symptoms=symptoms, age=30, gender="male", diagnosis="influenza")
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = MedicalDatabase(str(tmp_path / "medical.db"))
+    yield database
+    database.close()
+
+
+def test_flushed_rows_read_back(database):
+    # A long delay so nothing is written until the explicit flush
+    buffer = WriteBehindBuffer(database, max_rows=100, max_delay_ms=60_000)
+    try:
+        patient = buffer.add_patient_input(_patient())
+        prescription = buffer.add_prescription(Prescription(["Oseltamivir", "Paracetamol"], 0.9, "1.0"), patient)
+        feedback = buffer.add_feedback(
+            DoctorFeedback(["Oseltamivir", "Paracetamol"], ["Oseltamivir"], "no fever", "dr", _patient()),
+            prescription)
+        assert database.get_model_stats()['total_prescriptions'] == 0
+
+        assert buffer.flush() == 3
+        assert feedback.future.result(timeout=1) == feedback.id
+
+        assert database.get_patient_input(patient.id).symptoms == "fever"
+        stored = database.get_prescription(prescription.id)
+        assert stored.medications == ["Oseltamivir", "Paracetamol"]
+        assert stored.patient_id == str(patient.id)
+        assert list(database.find_prescriptions_by_medication("paracetamol")) == [prescription.id]
+        assert database.get_feedback_for_training()[0]['feedback_notes'] == "no fever"
+        stats = database.get_model_stats()
+        assert (stats['total_patients'], stats['total_prescriptions'], stats['total_feedback']) == (1, 1, 1)
+    finally:
+        buffer.close()
+
+
+def test_flush_continues_ids_after_direct_writes(database):
+    existing = database.save_patient_input(_patient("cough"))
+    buffer = WriteBehindBuffer(database, max_delay_ms=60_000)
+    try:
+        rows = [buffer.add_patient_input(_patient(f"symptom {n}")) for n in range(3)]
+        buffer.flush()
+        assert [row.id for row in rows] == [existing + 1, existing + 2, existing + 3]
+        assert [database.get_patient_input(row.id).symptoms for row in rows] == [
+            "symptom 0", "symptom 1", "symptom 2"]
+    finally:
+        buffer.close()
+
+
+def test_async_saves_go_through_the_buffer(database):
+    async def scenario():
+        async_database = AsyncMedicalDatabase(database, write_behind=True, buffer_max_delay_ms=5)
+        patient_id = await async_database.save_patient_input(_patient())
+        prescription_id = await async_database.save_prescription(
+            Prescription(["Ibuprofen"], 0.7, "1.0"), patient_id)
+        patient_id2, prescription_id2 = await async_database.save_prescription_record(
+            _patient("headache"), Prescription(["Aspirin"], 0.8, "1.0"))
+        prescriptions = [await async_database.get_prescription(prescription_id),
+                         await async_database.get_prescription(prescription_id2)]
+        await async_database.close()
+        # Read after close: futures resolve before a flush updates its counters
+        return async_database.buffer.rows_flushed, patient_id, patient_id2, prescriptions
+
+    rows_flushed, patient_id, patient_id2, prescriptions = asyncio.run(scenario())
+    assert rows_flushed == 4
+    assert [p.medications for p in prescriptions] == [["Ibuprofen"], ["Aspirin"]]
+    assert [p.patient_id for p in prescriptions] == [str(patient_id), str(patient_id2)]
+
+
+def test_rows_missing_required_fields_are_rejected_when_added(database):
+    buffer = WriteBehindBuffer(database, max_delay_ms=60_000)
+    try:
+        # app.js sends parseInt(age); an empty field arrives as null
+        with pytest.raises(ValueError, match="age"):
+            buffer.add_patient_input(PatientInput(symptoms="cough", age=None, gender="female", diagnosis="cold"))
+        assert buffer.get_stats()['buffer_depth'] == 0
+    finally:
+        buffer.close()
+
+
+def test_a_bad_row_fails_only_itself_and_its_children(database):
+    buffer = WriteBehindBuffer(database, max_delay_ms=60_000)
+    try:
+        good = [buffer.add_patient_input(_patient(f"good {n}")) for n in range(3)]
+        # Passes the NOT NULL check but cannot be bound by sqlite3, so the group commit fails
+        bad = buffer.add_patient_input(PatientInput(symptoms="bad", age={"years": 40}, gender="male",
+                                                    diagnosis="flu"))
+        orphan = buffer.add_prescription(Prescription(["Aspirin"], 0.5, "1.0"), bad)
+        good.append(buffer.add_patient_input(_patient("good 3")))
+        child = buffer.add_prescription(Prescription(["Ibuprofen"], 0.9, "1.0"), good[0])
+
+        assert buffer.flush() == 5
+
+        assert [database.get_patient_input(row.future.result(timeout=1)).symptoms for row in good] == [
+            "good 0", "good 1", "good 2", "good 3"]
+        assert database.get_prescription(child.future.result(timeout=1)).medications == ["Ibuprofen"]
+        assert bad.future.exception(timeout=1) is not None
+        assert isinstance(orphan.future.exception(timeout=1), RuntimeError)
+        stats = buffer.get_stats()
+        assert (stats['failed_flushes'], stats['failed_rows']) == (1, 2)
+        assert database.get_model_stats()['total_patients'] == 4
+    finally:
+        buffer.close()
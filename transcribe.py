@@ -1,13 +1,82 @@
 # transcribe.py
 
-import sys
-import whisper
+import argparse
+import asyncio
+import json
+import os
 
-# Get the file path from command line argument
-audio_path = sys.argv[1]
+# Thin client for the resident transcription service (python files/transcription/service.py);
+# falls back to loading Whisper here when the service is not running
+SERVICE_URI = os.getenv("TRANSCRIPTION_SERVICE_URI", "ws://localhost:8766")
 
-model = whisper.load_model("base")  # or "small", "medium"
-result = model.transcribe(audio_path)
 
-# Print transcription to stdout so Node.js can read it
-print(result["text"])
+class ServiceUnavailable(Exception):
+    pass
+
+
+async def connect():
+    import websockets
+
+    try:
+        return await websockets.connect(SERVICE_URI, open_timeout=2, max_size=None)
+    except Exception as e:
+        raise ServiceUnavailable(str(e))
+
+
+async def transcribe_remote(audio_path, busy_retries=60):
+    async with await connect() as websocket:
+        for _ in range(busy_retries):
+            await websocket.send(json.dumps({"type": "transcribe", "audio_path": os.path.abspath(audio_path)}))
+            result = json.loads(await websocket.recv())
+            if result.get("status") != "busy":
+                break
+            # Queue full: wait for a slot rather than loading a second model here
+            await asyncio.sleep(0.5)
+    if result.get("status") != "success":
+        raise RuntimeError(result.get("message", "Transcription failed"))
+    return result["text"]
+
+
+async def stream_remote(audio_path, window_s, overlap_s):
+    """Print each segment as a JSON line as soon as the service has transcribed its window"""
+    async with await connect() as websocket:
+        await websocket.send(json.dumps({"type": "transcribe_stream", "audio_path": os.path.abspath(audio_path),
+                                         "window_s": window_s, "overlap_s": overlap_s}))
+        async for message in websocket:
+            result = json.loads(message)
+            if result.get("status") != "success":
+                raise RuntimeError(result.get("message", "Transcription failed"))
+            if result["type"] != "transcription_segment":
+                return
+            print(json.dumps({"start": result["start"], "end": result["end"], "text": result["text"]}), flush=True)
+
+
+def transcribe_local(audio_path):
+    import whisper
+
+    model = whisper.load_model("base")  # or "small", "medium"
+    return model.transcribe(audio_path)
+
+
+parser = argparse.ArgumentParser(description="Transcribe an audio file")
+parser.add_argument("audio_path")
+parser.add_argument("--stream", action="store_true", help="Print timestamped segments as JSON lines while transcribing")
+parser.add_argument("--window", type=float, default=30.0, help="Streaming window length in seconds")
+parser.add_argument("--overlap", type=float, default=2.0, help="Overlap between streaming windows in seconds")
+args = parser.parse_args()
+
+try:
+    if args.stream:
+        asyncio.run(stream_remote(args.audio_path, args.window, args.overlap))
+    else:
+        # Print transcription to stdout so Node.js can read it
+        print(asyncio.run(transcribe_remote(args.audio_path)))
+except (ServiceUnavailable, ImportError):
+    result = transcribe_local(args.audio_path)
+    if args.stream:
+        # Without the service the whole file is transcribed at once; the output format is the same
+        for segment in result["segments"]:
+            print(json.dumps({"start": round(segment["start"], 2), "end": round(segment["end"], 2),
+                              "text": segment["text"]}))
+    else:
+        print(result["text"])